@@ -0,0 +1,55 @@
+"""
+Benchmark for the YTR <-> PTV joins in _filter_and_split_services and _split_channels.
+
+Both the YTR input and the PTV collections of a synthetic catalogue grow
+together, so a linear join keeps the time per PTV document flat while a nested
+scan would grow with the size.
+
+Run from the repository root:
+    python -m benchmark.bench_joins
+"""
+import time
+from unittest.mock import MagicMock
+import benchmark
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.ytr_importer import YTRImporter
+
+
+def make_importer(catalogue: SyntheticCatalogue) -> YTRImporter:
+    mongo_client = MagicMock()
+    mongo_client.service_db.municipalities.find.return_value = catalogue.ptv_municipalities
+    importer = YTRImporter(mongo_client, MagicMock())
+    importer.municipality_map = importer._parse_municipality_map(catalogue.ytr_municipalities)
+    return importer
+
+
+def make_data(importer: YTRImporter, catalogue: SyntheticCatalogue) -> tuple:
+    services = [importer._parse_service_info(offer) for offer in catalogue.service_offers]
+    channels = [importer._parse_channel_info(channel) for channel in catalogue.channels]
+    # Every fourth PTV recognized channel was already stored under another YTR id
+    old_channels = [dict(channel, id='old-' + channel['id']) for channel in channels[::4] if channel['ptvId'] is not None]
+    ptv_channels = [dict(ptv_channel, serviceIds=[]) for ptv_channel in catalogue.ptv_channels]
+    return services, catalogue.ptv_services, channels, old_channels, ptv_channels
+
+
+def run(sizes: tuple = (1000, 5000, 20000, 50000)) -> list:
+    results = []
+    for size in sizes:
+        catalogue = SyntheticCatalogue(size)
+        importer = make_importer(catalogue)
+        services, ptv_services, channels, old_channels, ptv_channels = make_data(importer, catalogue)
+        start = time.perf_counter()
+        importer._filter_and_split_services(services, ptv_services)
+        services_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        importer._split_channels(channels, old_channels, ptv_channels)
+        channels_elapsed = time.perf_counter() - start
+        results.append((size, services_elapsed, channels_elapsed))
+        print("offers={:>6}  ptv services={:>6}  services join={:.3f}s ({:.2f}us/doc)  ptv channels={:>6}  channels join={:.3f}s ({:.2f}us/doc)".format(
+            size, len(ptv_services), services_elapsed, services_elapsed / max(len(ptv_services), 1) * 1e6,
+            len(ptv_channels), channels_elapsed, channels_elapsed / max(len(ptv_channels), 1) * 1e6))
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,102 @@
+"""
+Benchmark for decoding the /palvelutarjous response.
+
+"stdlib-full" is the old response.json() path, "stdlib-stream" is what the
+importer uses for /palvelutarjous and "ijson-stream" is there for comparison.
+Every method runs in its own process so that the peak resident memory
+( ru_maxrss ) belongs to that method only. Methods whose optional library is
+not installed are skipped.
+
+Run from the repository root:
+    python -m benchmark.bench_json_decode
+"""
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+import benchmark
+from ytr_service_data_importer import json_stream
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+METHODS = ('stdlib-full', 'orjson-full', 'stdlib-stream', 'ijson-stream')
+
+
+def make_payload(path: str, offer_count: int) -> None:
+    with open(path, 'w', encoding='utf-8') as payload_file:
+        payload_file.write('[')
+        for offer_id in range(offer_count):
+            if offer_id > 0:
+                payload_file.write(',')
+            json.dump({'id': offer_id, 'ptvId': None, 'toimija_id': offer_id % 300,
+                       'palvelukanavat': [offer_id % 5000, (offer_id + 1) % 5000],
+                       'nimi': {'fi': 'Palvelu {}'.format(offer_id), 'sv': 'Tjänst {}'.format(offer_id)},
+                       'kuvaus': {'fi': 'Kuvaus ' * 30, 'sv': 'Beskrivning ' * 30},
+                       'kohderyhmat': [{'koodi': 'KR-4', 'nimi': {'fi': 'Kansalaiset'}}],
+                       'kuntasaatavuudet': [{'kunta': offer_id % 20}],
+                       'muutettu': '2020-12-13T08:02.57.083Z'}, payload_file, ensure_ascii=False)
+        payload_file.write(']')
+
+
+def available(method: str) -> bool:
+    if method == 'orjson-full':
+        return(json_stream.orjson is not None)
+    if method == 'ijson-stream':
+        return(ijson is not None)
+    return(True)
+
+
+def measure(method: str, path: str) -> None:
+    # Runs inside the child process, prints "count seconds peak_kb"
+    start = time.perf_counter()
+    if method.endswith('-full'):
+        with open(path, 'rb') as payload_file:
+            data = payload_file.read()
+        offers = json.loads(data) if method == 'stdlib-full' else json_stream.orjson.loads(data)
+        count = len(offers)
+    elif method == 'stdlib-stream':
+        def chunks():
+            with open(path, 'rb') as payload_file:
+                while True:
+                    chunk = payload_file.read(65536)
+                    if not chunk:
+                        break
+                    yield chunk
+        count = sum(1 for _ in json_stream.iter_json_array(chunks()))
+    else:
+        with open(path, 'rb') as payload_file:
+            count = sum(1 for _ in ijson.items(payload_file, 'item', use_float=True))
+    elapsed = time.perf_counter() - start
+    print(count, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def run(offer_count: int = 50000) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'palvelutarjous.json')
+        make_payload(path, offer_count)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print("offers={} payload={:.1f}MB".format(offer_count, size_mb))
+        for method in METHODS:
+            if not available(method):
+                print("{:<14} skipped, library not installed".format(method))
+                continue
+            output = subprocess.run([sys.executable, '-m', 'benchmark.bench_json_decode', method, path],
+                                    check=True, capture_output=True, text=True).stdout
+            count, elapsed, peak_kb = output.split()
+            results.append((method, int(count), float(elapsed), int(peak_kb)))
+            print("{:<14} decoded={} time={:.3f}s peak rss={:.1f}MB".format(
+                method, count, float(elapsed), int(peak_kb) / 1024))
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        measure(sys.argv[1], sys.argv[2])
+    else:
+        run()
@@ -0,0 +1,44 @@
+"""
+Micro-benchmark for the municipality lookups done while parsing service offers.
+
+The parse cost per (service x area) pair should stay flat when the number of
+PTV municipalities grows, i.e. the parse stage is O(services x areas).
+
+Run from the repository root:
+    python -m benchmark.bench_municipality_lookup
+"""
+import time
+from unittest.mock import MagicMock
+import benchmark
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.ytr_importer import YTRImporter
+
+
+def make_importer(catalogue: SyntheticCatalogue) -> YTRImporter:
+    mongo_client = MagicMock()
+    mongo_client.service_db.municipalities.find.return_value = catalogue.ptv_municipalities
+    importer = YTRImporter(mongo_client, MagicMock())
+    importer.municipality_map = importer._parse_municipality_map(catalogue.ytr_municipalities)
+    return importer
+
+
+def run(service_count: int = 2000, area_count: int = 10, municipality_counts: tuple = (30, 300, 3000)) -> list:
+    results = []
+    for municipality_count in municipality_counts:
+        catalogue = SyntheticCatalogue(service_count, municipality_count=municipality_count, areas_per_offer=area_count)
+        importer = make_importer(catalogue)
+        offers = catalogue.service_offers
+        pair_count = sum(len(offer['kuntasaatavuudet']) for offer in offers)
+        start = time.perf_counter()
+        parsed = [importer._parse_service_info(offer) for offer in offers]
+        parsed = [ser for ser in parsed if importer._is_suitable_service(ser)]
+        elapsed = time.perf_counter() - start
+        per_pair = elapsed / pair_count
+        results.append((municipality_count, elapsed, per_pair))
+        print("municipalities={:>5}  services={}  service x area pairs={}  total={:.3f}s  per service x area={:.2f}us".format(
+            municipality_count, service_count, pair_count, elapsed, per_pair * 1e6))
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,44 @@
+"""
+Benchmark for parsing service offers and channels in worker processes.
+
+Compares the serial parse with process pools of different sizes on the same
+synthetic catalogue. The documents and the parsed results are pickled to and
+from the workers, so the speed-up stays below the number of cores.
+
+Run from the repository root:
+    python -m benchmark.bench_parallel_parse
+"""
+import os
+import time
+import benchmark
+from benchmark.bench_joins import make_importer
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.parallel_parse import ParallelParser
+
+
+def run(offer_count: int = 20000, worker_counts: tuple = (1, 2, 4), chunk_size: int = 250) -> list:
+    catalogue = SyntheticCatalogue(offer_count)
+    importer = make_importer(catalogue)
+    print("offers={} channels={} cpus={}".format(offer_count, len(catalogue.channels), os.cpu_count()))
+    results = []
+    for workers in worker_counts:
+        parser = ParallelParser(importer, workers, chunk_size, min_items=0)
+        try:
+            # Start the workers outside the timing
+            parser.parse_services(catalogue.service_offers[:chunk_size * workers])
+            start = time.perf_counter()
+            parser.parse_services(catalogue.service_offers)
+            services_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            parser.parse_channels(catalogue.channels)
+            channels_elapsed = time.perf_counter() - start
+        finally:
+            parser.close()
+        results.append((workers, services_elapsed, channels_elapsed))
+        print("workers={}  offers={:.3f}s ({:.0f}/s)  channels={:.3f}s ({:.0f}/s)".format(
+            workers, services_elapsed, offer_count / services_elapsed, channels_elapsed, len(catalogue.channels) / channels_elapsed))
+    return results
+
+
+if __name__ == '__main__':
+    run()
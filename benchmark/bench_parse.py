@@ -0,0 +1,280 @@
+"""
+Benchmark for the two-phase parse of service offers and channels.
+
+The parse methods resolve the language-invariant structure ( target group
+codes, areas, contacts, the address municipality ) once and then project the
+per-language names from it. The previous parse that redid all of it for each
+language is kept below as the reference: its output must be byte for byte the
+same BSON, and its time per document is the baseline.
+
+Run from the repository root:
+    python -m benchmark.bench_parse
+"""
+import gc
+import time
+import bson
+import benchmark
+from benchmark.bench_joins import make_importer
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.ytr_importer import YTRImporter, TG_MAP
+from ytr_service_data_importer.records import ServiceRecord, ChannelRecord, LanguageSplit, EMPTY, compact_list
+from ytr_service_data_importer.timestamps import parse_ytr_timestamp
+
+
+# The parse before the language-invariant work was hoisted out of the language loops
+def per_language_parse_service(importer: YTRImporter, service: dict) -> ServiceRecord:
+    service_final = ServiceRecord()
+    service_id = service.get('id')
+    if service_id is not None:
+        service_id = str(service_id)
+    service_final['id'] = str(service_id)
+
+    service_final['ptvId'] = importer._get_ptv_service_id(service)
+
+    service_type = "Service"
+    service_final['type'] = service_type
+    service_subtype = None
+    service_final['subtype'] = service_subtype
+
+    channel_ids = [str(s_cha_id) for s_cha_id in service.get('palvelukanavat', [])]
+    service_final['channelIds'] = channel_ids
+
+    organization_id = service.get('toimija_id')
+    if organization_id is not None:
+        organization_id = str(organization_id)
+    organization_elements = [{'name': None, 'id': organization_id}]
+    service_final['organizations'] = organization_elements
+
+    languages = ['en', 'fi', 'sv']
+    service_final['name'] = LanguageSplit()
+    service_final['descriptions'] = LanguageSplit()
+    service_final['requirement'] = LanguageSplit()
+    service_final['targetGroups'] = LanguageSplit()
+    service_final['serviceClasses'] = LanguageSplit()
+    service_final['areas'] = LanguageSplit()
+    service_final['lifeEvents'] = LanguageSplit()
+    # Divided by language
+    for language in languages:
+        names = [service.get('nimi', {}).get(language)]
+        names = [l_name for l_name in names if l_name is not None]
+        if len(names) > 0:
+            name = ' - '.join(names)
+        else:
+            name = None
+        service_final['name'][language] = name
+        descriptions = [{'value': service.get('kuvaus', {}).get(language), 'type': 'Description'}]
+        descriptions = [d for d in descriptions if d['value'] is not None]
+        service_final['descriptions'][language] = compact_list(descriptions)
+
+        service_final['requirement'][language] = ''
+
+        # Target groups
+        target_groups = service.get('kohderyhmat', [])
+        target_group_elements = []
+        for target_group in target_groups:
+            target_group_name = target_group.get('nimi').get(language)
+            target_group_code = TG_MAP.get(target_group.get('koodi'))
+            if target_group_code is None:
+                raise Exception("Unrecognized target group {}".format(target_group.get('koodi')))
+
+            target_group_el = {"name": target_group_name,
+                               "code": target_group_code}
+            target_group_elements.append(target_group_el)
+        service_final['targetGroups'][language] = compact_list(target_group_elements)
+
+        # Service classes
+        service_final['serviceClasses'][language] = EMPTY
+
+        # Areas
+        areas = service.get('kuntasaatavuudet', [])
+        area_elements = []
+        for area in areas:
+            area_type = 'Municipality'
+            area_id = area.get('kunta')
+            area_code = importer.municipality_map.get(area_id)
+            if area_code in importer.ptv_municipality_codes:
+                area_name = importer.ptv_municipality_names[area_code].get(language)
+            else:
+                area_name = None
+
+            area_el = {"name": area_name,
+                       "type": area_type,
+                       "code": area_code}
+            area_elements.append(area_el)
+        service_final['areas'][language] = compact_list(area_elements)
+
+        # Life events
+        service_final['lifeEvents'][language] = EMPTY
+
+    if 'muutettu' in service.keys() and service.get('muutettu') is not None:
+        service_final['lastUpdated'] = parse_ytr_timestamp(service.get('muutettu'))
+    else:
+        service_final['lastUpdated'] = None
+
+    return(service_final)
+
+
+def per_language_parse_channel(importer: YTRImporter, channel: dict) -> ChannelRecord:
+
+    channel_final = ChannelRecord()
+
+    channel_id = channel.get('id')
+    if channel_id is not None:
+        channel_id = str(channel_id)
+    channel_final['id'] = channel_id
+
+    channel_final['ptvId'] = importer._get_ptv_channel_id(channel)
+
+    area_type = 'Municipality'
+    channel_final['areaType'] = area_type
+
+    channel_final['type'] = None
+
+    channel_final['serviceIds'] = []
+
+    organization_id = channel.get('toimija')
+    if organization_id is not None:
+        organization_id = str(organization_id)
+    channel_final['organizationId'] = organization_id
+
+    languages = ['en', 'fi', 'sv']
+    channel_final['name'] = LanguageSplit()
+    channel_final['descriptions'] = LanguageSplit()
+    channel_final['webPages'] = LanguageSplit()
+    channel_final['emails'] = LanguageSplit()
+    channel_final['phoneNumbers'] = LanguageSplit()
+    channel_final['addresses'] = LanguageSplit()
+    channel_final['areas'] = LanguageSplit()
+    channel_final['channelUrls'] = LanguageSplit()
+    channel_final['organizations'] = LanguageSplit()
+
+    # Divided by language
+    for language in languages:
+
+        if 'nimi' in channel.keys():
+            names = [channel.get('nimi').get(language)]
+            names = [l_name for l_name in names if l_name is not None]
+            if len(names) > 0:
+                name = ' - '.join(names)
+            else:
+                name = None
+        else:
+            name = None
+        channel_final['name'][language] = name
+
+        if 'kuvaus' in channel.keys():
+            descriptions = [{'value': channel.get('kuvaus').get(language), 'type': 'Description'}]
+            descriptions = [d for d in descriptions if d['value'] is not None]
+        else:
+            descriptions = []
+        channel_final['descriptions'][language] = compact_list(descriptions)
+
+        channel_types = channel.get('yhteystiedot')
+        channel_final['phoneNumbers'][language] = EMPTY
+        channel_final['webPages'][language] = EMPTY
+        channel_final['emails'][language] = EMPTY
+        if channel_types is not None:
+            for channel_type in channel_types:
+                if 'yhteystietotyyppi' in channel_type.keys():
+                    if channel_type.get('yhteystietotyyppi').get('id') == 1:
+                        if channel_type.get('arvo') is not None:
+                            phone_numbers = [{'number': channel_type.get('arvo'),
+                                              'prefixNumber': None,
+                                              'chargeDescription': None,
+                                              'serviceChargeType': None}]
+                        else:
+                            phone_numbers = []
+                        channel_final['phoneNumbers'][language] = compact_list(phone_numbers)
+                    elif channel_type.get('yhteystietotyyppi').get('id') == 2:
+                        if channel_type.get('arvo') is not None:
+                            web_pages = [channel_type.get('arvo')]
+                        else:
+                            web_pages = []
+                        channel_final['webPages'][language] = compact_list(web_pages)
+
+        # Addresses
+        if channel.get('osoite') is not None:
+            addresses = [channel.get('osoite')]
+        else:
+            addresses = []
+        address_elements = []
+        for address in addresses:
+            if address.get('katuosoite') is not None:
+                street_address = address.get('katuosoite').get(language)
+            else:
+                street_address = None
+            if address.get('postinumero') is not None:
+                postal_code = address.get('postinumero')
+            else:
+                postal_code = None
+
+            mun_id = address.get('kunta')
+            municipality_code = importer.municipality_map.get(mun_id)
+            if municipality_code in importer.ptv_municipality_codes:
+                municipality_name = importer.ptv_municipality_names[municipality_code].get(language)
+            else:
+                municipality_name = None
+
+            address_el = {"streetName": street_address,
+                               "postalCode": postal_code,
+                               "municipalityCode": municipality_code,
+                               "municipalityName": municipality_name,
+                               "type": None,
+                               "subtype": None,
+                               "streetNumber": None,
+                               "latitude": None,
+                               "longitude": None,
+                               "postOffice": None}
+            address_elements.append(address_el)
+        channel_final['addresses'][language] = compact_list(address_elements)
+
+        channel_final['areas'][language] = EMPTY
+    if 'muutettu' in channel.keys() and channel.get('muutettu') is not None:
+        channel_final['lastUpdated'] = parse_ytr_timestamp(channel.get('muutettu'))
+    else:
+        channel_final['lastUpdated'] = None
+    return(channel_final)
+
+
+def encode(documents: list) -> list:
+    return([bson.encode(document.to_document()) for document in documents])
+
+
+def timed(parse, documents: list) -> tuple:
+    # Without the garbage collector like timeit, its runs over the growing result dominate otherwise
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        parsed = [parse(document) for document in documents]
+        return(parsed, time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+
+def run(offer_count: int = 20000, repeats: int = 3) -> dict:
+    catalogue = SyntheticCatalogue(offer_count)
+    importer = make_importer(catalogue)
+    results = {}
+    for name, documents, reference, two_phase in (
+            ('services', catalogue.service_offers, per_language_parse_service, importer._parse_service_info),
+            ('channels', catalogue.channels, per_language_parse_channel, importer._parse_channel_info)):
+        reference_seconds = []
+        two_phase_seconds = []
+        for _ in range(repeats):
+            reference_parsed, seconds = timed(lambda document: reference(importer, document), documents)
+            reference_seconds.append(seconds)
+            two_phase_parsed, seconds = timed(two_phase, documents)
+            two_phase_seconds.append(seconds)
+        if encode(reference_parsed) != encode(two_phase_parsed):
+            raise Exception("The two-phase parse of the {} differs from the per-language one".format(name))
+        reference_time = min(reference_seconds) / len(documents) * 1e6
+        two_phase_time = min(two_phase_seconds) / len(documents) * 1e6
+        print("{:<9} documents={:>6}  per-language {:6.1f}us/doc  two-phase {:6.1f}us/doc  x{:.2f}  ( identical BSON )".format(
+            name, len(documents), reference_time, two_phase_time, reference_time / two_phase_time))
+        results[name] = {'reference': reference_time, 'twoPhase': two_phase_time}
+    return(results)
+
+
+if __name__ == '__main__':
+    run()
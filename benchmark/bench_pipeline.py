@@ -0,0 +1,47 @@
+"""
+Benchmark for the threaded import pipeline.
+
+Runs the same full import of a synthetic catalogue with the stages one after
+another ( YTR_PIPELINE_QUEUE_SIZE=0 ) and in the pipeline, against the stub
+YTR server with some latency per request, and prints the utilisation of every
+stage. Waiting on YTR and Mongo overlaps with parsing in the pipeline; the
+parse itself shares one interpreter, so CPU bound stages do not speed up.
+
+Run from the repository root:
+    python -m benchmark.bench_pipeline
+"""
+import io
+import time
+from contextlib import redirect_stdout
+from unittest.mock import patch
+import benchmark
+from benchmark.datagen import SyntheticCatalogue
+from benchmark.environment import get_mongo_client, serve_catalogue, make_importer
+
+
+def run(offer_count: int = 5000, queue_sizes: tuple = (0, 2), latency: float = 0.005, batch_size: int = 250) -> dict:
+    catalogue = SyntheticCatalogue(offer_count)
+    results = {}
+    print("offers={} channels={} latency={}s batch={}".format(offer_count, len(catalogue.channels), latency, batch_size))
+    for queue_size in queue_sizes:
+        mongo_client = get_mongo_client()
+        catalogue.load_ptv(mongo_client.service_db)
+        importer = make_importer(mongo_client)
+        with serve_catalogue(catalogue, latency=latency), \
+                patch('ytr_service_data_importer.ytr_importer.PIPELINE_QUEUE_SIZE', queue_size), \
+                patch('ytr_service_data_importer.ytr_importer.SERVICE_BATCH_SIZE', batch_size), \
+                redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            importer.import_ytr_data(mode='full')
+            elapsed = time.perf_counter() - start
+        summary = importer.metrics.summary()
+        print("queue size {}: {:.2f}s".format(queue_size, elapsed))
+        for name, entry in summary['pipeline'].items():
+            print("  {:<9} utilisation {:4.0%}  busy {:6.2f}s  idle {:6.2f}s  blocked {:6.2f}s".format(
+                name, entry['utilisation'], entry['busySeconds'], entry['idleSeconds'], entry['blockedSeconds']))
+        results[queue_size] = {'seconds': elapsed, 'pipeline': summary['pipeline']}
+    return(results)
+
+
+if __name__ == '__main__':
+    run()
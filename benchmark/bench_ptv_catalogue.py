@@ -0,0 +1,59 @@
+"""
+Benchmark for the local PTV catalogue cache.
+
+Runs the same full import of a synthetic catalogue with the PTV joins querying
+Mongo and with them looking up the memory-mapped copies, and prints the PTV
+lookup stages, the time to copy the collections and the time to find out
+that the copies are still up to date. mongomock scans a collection for every
+query, set BENCHMARK_MONGO_URL to compare against a real mongod.
+
+Run from the repository root:
+    python -m benchmark.bench_ptv_catalogue
+"""
+import io
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+import benchmark
+from benchmark.datagen import SyntheticCatalogue
+from benchmark.environment import get_mongo_client, serve_catalogue, make_importer
+from ytr_service_data_importer.ytr_importer import PTV_CACHE_COLLECTIONS
+from ytr_service_data_importer.ptv_catalogue import PTVCatalogueCache
+
+LOOKUP_STAGES = ('ptv_cache_refresh', 'ptv_service_lookup', 'ptv_channel_lookup')
+
+
+def run(offer_count: int = 5000) -> dict:
+    catalogue = SyntheticCatalogue(offer_count)
+    mongo_client = get_mongo_client()
+    catalogue.load_ptv(mongo_client.service_db)
+    print("offers={} ptv services={} ptv channels={}".format(offer_count, len(catalogue.ptv_services), len(catalogue.ptv_channels)))
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cache = PTVCatalogueCache(directory, PTV_CACHE_COLLECTIONS)
+        start = time.perf_counter()
+        cache.refresh(mongo_client.service_db)
+        copy_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        cache.refresh(mongo_client.service_db)
+        check_seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print("copy {:.2f}s, up to date check {:.3f}s, {:.1f} MB on disk".format(copy_seconds, check_seconds, size / 1e6))
+        for name, ptv_cache in (('mongo', None), ('cache', cache)):
+            importer = make_importer(mongo_client)
+            importer.ptv_cache = ptv_cache
+            with serve_catalogue(catalogue), redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                importer.import_ytr_data(mode='full')
+                elapsed = time.perf_counter() - start
+            stages = importer.metrics.summary()['stages']
+            print("{}: {:.2f}s  ".format(name, elapsed) + "  ".join(
+                "{} {:.3f}s".format(stage, stages[stage]['seconds']) for stage in LOOKUP_STAGES if stage in stages))
+            results[name] = {'seconds': elapsed, 'stages': stages}
+        cache.close()
+    return(results)
+
+
+if __name__ == '__main__':
+    run()
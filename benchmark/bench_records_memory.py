@@ -0,0 +1,76 @@
+"""
+Memory of the parsed services and channels as records and as plain dicts.
+
+Parses a synthetic catalogue and measures with tracemalloc how much memory
+the parsed documents hold, once as the __slots__ records the importer keeps and
+once as the dicts they used to be ( the records' to_document() ). The PTV
+documents matched to YTR ones are compared against their shallow dict copies.
+
+Run from the repository root:
+    python -m benchmark.bench_records_memory
+"""
+import gc
+import time
+import tracemalloc
+import benchmark
+from benchmark.bench_joins import make_importer
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.records import ServiceRecord, ChannelRecord
+
+
+def measure(function) -> tuple:
+    # Memory still held by the result once it is built, and the time to build it
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        held = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return(result, held, elapsed)
+
+
+def compare(name: str, build_dicts, build_records, item_count: int) -> dict:
+    # Both are built from scratch so that neither shares strings with the other
+    dicts, dict_bytes, dict_seconds = measure(build_dicts)
+    del dicts
+    records, record_bytes, record_seconds = measure(build_records)
+    del records
+    print("{:<14} items={:>7}  dicts={:7.1f}MB  records={:7.1f}MB  ratio={:.2f}  ( {:.0f} vs {:.0f} bytes/item, {:.2f}s vs {:.2f}s )".format(
+        name, item_count, dict_bytes / (1024 * 1024), record_bytes / (1024 * 1024), record_bytes / dict_bytes,
+        dict_bytes / item_count, record_bytes / item_count, dict_seconds, record_seconds))
+    return({'items': item_count, 'dictBytes': dict_bytes, 'recordBytes': record_bytes})
+
+
+def run(offer_count: int = 20000) -> dict:
+    catalogue = SyntheticCatalogue(offer_count)
+    importer = make_importer(catalogue)
+    results = {}
+    offers = catalogue.service_offers
+    results['services'] = compare('services',
+                                  lambda: [importer._parse_service_info(offer).to_document() for offer in offers],
+                                  lambda: [importer._parse_service_info(offer) for offer in offers],
+                                  len(offers))
+    channels = catalogue.channels
+    results['channels'] = compare('channels',
+                                  lambda: [importer._parse_channel_info(channel).to_document() for channel in channels],
+                                  lambda: [importer._parse_channel_info(channel) for channel in channels],
+                                  len(channels))
+    # The values are shared with the source documents, so only the containers are counted here
+    ptv_services = catalogue.ptv_services
+    results['ptv_services'] = compare('ptv_services',
+                                      lambda: [service.copy() for service in ptv_services],
+                                      lambda: [ServiceRecord.from_document(service) for service in ptv_services],
+                                      len(ptv_services))
+    ptv_channels = catalogue.ptv_channels
+    results['ptv_channels'] = compare('ptv_channels',
+                                      lambda: [channel.copy() for channel in ptv_channels],
+                                      lambda: [ChannelRecord.from_document(channel) for channel in ptv_channels],
+                                      len(ptv_channels))
+    return(results)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,67 @@
+"""
+Replays a recorded import snapshot to time the import stages without YTR or MongoDB.
+
+Record a snapshot of a real run by setting YTR_SNAPSHOT_FILE, then compare
+the stage times of two versions of the importer on the same data. Without a
+snapshot path a synthetic catalogue is recorded first. The PTV documents are
+loaded into mongomock, or into the MongoDB of BENCHMARK_MONGO_URL whose
+service_db is replaced with the snapshot's PTV collections.
+
+Run from the repository root:
+    python -m benchmark.bench_replay
+    python -m benchmark.bench_replay snapshot.zip 3
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+import benchmark
+from benchmark.datagen import SyntheticCatalogue
+from benchmark.environment import MONGO_URL, get_mongo_client, serve_catalogue, make_importer
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from ytr_service_data_importer.snapshot import Snapshot
+
+
+def record_synthetic(path: str, offer_count: int = 2000) -> None:
+    catalogue = SyntheticCatalogue(offer_count)
+    mongo_client = get_mongo_client()
+    catalogue.load_ptv(mongo_client.service_db)
+    importer = make_importer(mongo_client)
+    importer.snapshot_file = path
+    with serve_catalogue(catalogue), redirect_stdout(io.StringIO()):
+        importer.import_ytr_data(mode='full')
+
+
+def replay(path: str, repeats: int = 3) -> list:
+    mongo_client = None
+    if MONGO_URL:
+        mongo_client = get_mongo_client()
+        for collection in ('municipalities', 'services', 'channels'):
+            mongo_client.service_db.drop_collection(collection)
+        Snapshot.load(path).load_collections(mongo_client.service_db)
+    results = []
+    for repeat in range(repeats):
+        importer = YTRImporter.from_snapshot(path, mongo_client, fetch_concurrency=8)
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            services, channels = importer._get_new_services_and_channels()
+        elapsed = time.perf_counter() - start
+        summary = importer.metrics.summary()
+        print("replay {}: {:.2f}s, {} services, {} channels".format(repeat + 1, elapsed, len(services), len(channels)))
+        for name, entry in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print("  {:<20} {:8.3f}s  {:6d} calls".format(name, entry['seconds'], entry['calls']))
+        results.append({'seconds': elapsed, 'stages': summary['stages']})
+    return(results)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        replay(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = os.path.join(directory, 'snapshot.zip')
+            record_synthetic(snapshot_path)
+            print("recorded {} bytes".format(os.path.getsize(snapshot_path)))
+            replay(snapshot_path)
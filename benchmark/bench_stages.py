@@ -0,0 +1,119 @@
+"""
+Throughput and peak memory of every import stage on synthetic catalogues.
+
+Each stage runs twice: once for the time and once under tracemalloc for the
+peak memory, since tracing slows Python down. The time per item should stay
+flat as the catalogue grows, a growing one is reported as superlinear.
+
+The PTV collections live in mongomock ( or BENCHMARK_MONGO_URL ) and the end to
+end import talks to a local stub of the YTR API. mongomock scans a collection
+for every query, so the Mongo stages grow with the collection size there; use
+a real mongod for their numbers.
+
+Run from the repository root, optionally with the scales to use:
+    python -m benchmark.bench_stages
+    python -m benchmark.bench_stages 1000 10000 100000
+"""
+import io
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+import benchmark
+from benchmark.datagen import SyntheticCatalogue
+from benchmark.environment import get_mongo_client, serve_catalogue, make_importer
+from ytr_service_data_importer.records import to_document
+
+# Per item time growing more than this between the smallest and the largest scale is reported
+SUPERLINEAR_RATIO = 2.0
+
+
+def measure(name: str, item_count: int, function, results: dict):
+    # The importer's own output would drown the results
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    results[name] = (item_count, elapsed, peak)
+    print("  {:<22} items={:>7}  time={:8.3f}s  {:>10.0f} items/s  {:7.2f}us/item  peak={:7.1f}MB".format(
+        name, item_count, elapsed, item_count / elapsed if elapsed > 0 else 0, elapsed / max(item_count, 1) * 1e6, peak / (1024 * 1024)))
+    return(result)
+
+
+def run_scale(offer_count: int, end_to_end: bool = True) -> dict:
+    catalogue = SyntheticCatalogue(offer_count)
+    mongo_client = get_mongo_client()
+    catalogue.load_ptv(mongo_client.service_db)
+    importer = make_importer(mongo_client)
+    importer.municipality_map = importer._parse_municipality_map(catalogue.ytr_municipalities)
+    print("offers={} channels={} ptv services={} ptv channels={}".format(
+        offer_count, len(catalogue.channels), len(catalogue.ptv_services), len(catalogue.ptv_channels)))
+
+    results = {}
+    offers = catalogue.service_offers
+    services = measure('parse_services', len(offers), lambda: [importer._parse_service_info(offer) for offer in offers], results)
+    ptv_services = measure('ptv_service_lookup', len(services), lambda: importer._get_ptv_services(services), results)
+    ytr_original, ptv_recognized = measure('filter_and_split', len(services),
+                                           lambda: importer._filter_and_split_services(services, ptv_services), results)
+    suitable = measure('suitable_filter', len(services),
+                       lambda: [ser for ser in ptv_recognized + ytr_original if importer._is_suitable_service(ser)], results)
+    channels = measure('parse_channels', len(catalogue.channels),
+                       lambda: [importer._parse_channel_info(channel) for channel in catalogue.channels], results)
+    # All the PTV channels against the channels of the catalogue at once
+    ptv_channels = [dict(ptv_channel, serviceIds=[]) for ptv_channel in catalogue.ptv_channels]
+    measure('split_channels', len(ptv_channels), lambda: importer._split_channels(channels, [], ptv_channels), results)
+
+    def store():
+        collection = importer._get_staging_collection('ytr_services')
+        return(importer._insert_in_batches(collection, (to_document(service) for service in suitable)))
+    measure('store', len(suitable), store, results)
+
+    if end_to_end:
+        def import_full():
+            importer.import_ytr_data(mode='full')
+        with serve_catalogue(catalogue):
+            measure('end_to_end_full', offer_count, import_full, results)
+    return(results)
+
+
+def report_growth(results_by_scale: dict) -> list:
+    # Compares the time per item of the smallest and the largest scale
+    scales = sorted(results_by_scale)
+    superlinear = []
+    if len(scales) < 2:
+        return(superlinear)
+    smallest = results_by_scale[scales[0]]
+    largest = results_by_scale[scales[-1]]
+    print("time per item at {} offers relative to {} offers:".format(scales[-1], scales[0]))
+    for name in smallest:
+        if name not in largest:
+            continue
+        small_per_item = smallest[name][1] / max(smallest[name][0], 1)
+        large_per_item = largest[name][1] / max(largest[name][0], 1)
+        ratio = large_per_item / small_per_item if small_per_item > 0 else 0.0
+        flag = "  <- superlinear" if ratio > SUPERLINEAR_RATIO else ""
+        print("  {:<22} x{:.2f}{}".format(name, ratio, flag))
+        if ratio > SUPERLINEAR_RATIO:
+            superlinear.append(name)
+    return(superlinear)
+
+
+def run(scales: tuple = (1000, 10000), end_to_end: bool = True) -> dict:
+    results_by_scale = {}
+    for scale in scales:
+        results_by_scale[scale] = run_scale(scale, end_to_end)
+    report_growth(results_by_scale)
+    return(results_by_scale)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(tuple(int(scale) for scale in sys.argv[1:]))
+    else:
+        run()
@@ -0,0 +1,53 @@
+"""
+Benchmark for parsing the YTR 'muutettu' timestamps.
+
+Compares datetime.strptime with the fixed width parser, without and with its LRU
+cache, on a batch where the timestamps repeat like after bulk edits in YTR.
+
+Run from the repository root:
+    python -m benchmark.bench_timestamps
+"""
+import random
+import time
+from datetime import datetime
+import benchmark
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.timestamps import parse_ytr_timestamp, _parse_fixed_width, YTR_TIMESTAMP_FORMAT
+
+
+def make_batch(size: int, distinct: int, seed: int = 1) -> list:
+    # distinct different timestamps repeated over the batch
+    catalogue_random = random.Random(seed)
+    catalogue = SyntheticCatalogue(distinct, seed=seed, municipality_count=10)
+    timestamps = [offer['muutettu'] for offer in catalogue.service_offers]
+    return([catalogue_random.choice(timestamps) for _ in range(size)])
+
+
+def timed(function, values: list) -> tuple:
+    start = time.perf_counter()
+    result = [function(value) for value in values]
+    return(result, time.perf_counter() - start)
+
+
+def run(size: int = 500000, distinct_counts: tuple = (1000, 100000)) -> dict:
+    results = {}
+    for distinct in distinct_counts:
+        values = make_batch(size, distinct)
+        parse_ytr_timestamp.cache_clear()
+        expected, strptime_seconds = timed(lambda value: datetime.strptime(value, YTR_TIMESTAMP_FORMAT), values)
+        uncached, uncached_seconds = timed(_parse_fixed_width, values)
+        cached, cached_seconds = timed(parse_ytr_timestamp, values)
+        if uncached != expected or cached != expected:
+            raise Exception("The timestamp parsers disagree with strptime")
+        info = parse_ytr_timestamp.cache_info()
+        print("timestamps={} distinct={}".format(size, distinct))
+        print("  strptime       {:7.3f}s".format(strptime_seconds))
+        print("  fixed width    {:7.3f}s  x{:.1f}".format(uncached_seconds, strptime_seconds / uncached_seconds))
+        print("  fixed + LRU    {:7.3f}s  x{:.1f}  hit rate {:.0%}".format(cached_seconds, strptime_seconds / cached_seconds,
+                                                                          info.hits / max(info.hits + info.misses, 1)))
+        results[distinct] = {'strptime': strptime_seconds, 'slicing': uncached_seconds, 'cached': cached_seconds}
+    return(results)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,210 @@
+"""
+Seeded generator for synthetic Kompassi YTR and PTV data.
+
+The same seed and scale always give the same catalogue, so benchmark runs are
+comparable. The shapes follow the real responses: YTR municipalities, service
+offers and service channels as served by the API, and PTV municipalities,
+services and channels as stored in service_db.
+"""
+import uuid
+import random
+from datetime import datetime, timedelta
+
+FIRST_WORDS = ['Kotihoito', 'Neuvonta', 'Päivätoiminta', 'Vertaistuki', 'Ruoka-apu', 'Kuntoutus', 'Kerhotoiminta',
+               'Asumispalvelu', 'Ohjaus', 'Harrastustoiminta', 'Kriisiapu', 'Liikuntaryhmä', 'Lähimmäispalvelu']
+SECOND_WORDS = ['ikäihmisille', 'perheille', 'nuorille', 'maahanmuuttajille', 'omaishoitajille', 'työttömille',
+                'lapsille', 'opiskelijoille', 'kaikille']
+SWEDISH_WORDS = ['Hemvård', 'Rådgivning', 'Dagverksamhet', 'Kamratstöd', 'Matbiståndet', 'Rehabilitering']
+DESCRIPTION_WORDS = ['palvelu', 'tarjoaa', 'apua', 'arjen', 'tilanteisiin', 'yhdessä', 'vapaaehtoisten', 'kanssa',
+                     'maksuton', 'ajanvaraus', 'tarvittaessa', 'paikan', 'päällä', 'sekä', 'etänä']
+STREETS = ['Rauhankatu', 'Linnankatu', 'Aurakatu', 'Hämeenkatu', 'Puistokatu', 'Kauppiaskatu', 'Yliopistonkatu']
+# Share of KR-1 and KR-3 keeps a realistic part of the offers unsuitable
+TARGET_GROUPS = [('KR-4', 'Kansalaiset', 0.7), ('KR-2', 'Perheet', 0.15), ('KR-1', 'Ikäihmiset', 0.1), ('KR-3', 'Nuoret', 0.05)]
+
+
+class SyntheticCatalogue():
+    """
+    A synthetic YTR catalogue with the matching PTV collections
+
+    Args
+    ----------
+    offer_count : int
+        Number of YTR service offers, e.g. 1 000 - 100 000
+
+    seed : int ( default 1 )
+        Seed of the random generator
+
+    municipality_count : int ( default 300 )
+        Number of municipalities, a few of them are missing from PTV
+
+    channels_per_offer : float ( default 0.6 )
+        Number of distinct YTR channels per offer, offers share channels
+
+    ptv_share : float ( default 0.4 )
+        Share of offers and channels that refer to PTV
+
+    areas_per_offer : int ( default 3 )
+        Maximum number of municipalities an offer is available in
+
+    Methods
+    -------
+    routes()
+        Endpoint -> payload for StubYTRServer
+
+    load_ptv(service_db)
+        Inserts the PTV municipalities, services and channels
+
+    """
+
+    def __init__(self, offer_count: int, seed: int = 1, municipality_count: int = 300, channels_per_offer: float = 0.6,
+                 ptv_share: float = 0.4, areas_per_offer: int = 3) -> None:
+        self.offer_count = offer_count
+        self.seed = seed
+        self._random = random.Random(seed)
+        self.ytr_municipalities, self.ptv_municipalities = self._make_municipalities(municipality_count)
+        channel_count = max(1, int(offer_count * channels_per_offer))
+        self.channels = [self._make_channel(channel_id) for channel_id in range(1, channel_count + 1)]
+        self.service_offers = [self._make_offer(offer_id, channel_count, areas_per_offer) for offer_id in range(1, offer_count + 1)]
+        self._assign_ptv_ids(ptv_share)
+        self.ptv_services, self.ptv_channels = self._make_ptv_documents()
+
+    def _uuid(self) -> str:
+        return(str(uuid.UUID(int=self._random.getrandbits(128), version=4)))
+
+    def _timestamp(self) -> str:
+        moment = datetime(2020, 1, 1) + timedelta(seconds=self._random.randrange(2 * 365 * 24 * 3600), milliseconds=self._random.randrange(1000))
+        # The YTR format with a dot between minutes and seconds
+        return(moment.strftime("%Y-%m-%dT%H:%M.%S.") + "{:03d}Z".format(moment.microsecond // 1000))
+
+    def _text(self, word_count: int) -> str:
+        return(' '.join(self._random.choice(DESCRIPTION_WORDS) for _ in range(word_count)).capitalize() + '.')
+
+    def _make_municipalities(self, municipality_count: int) -> tuple:
+        ytr_municipalities = []
+        ptv_municipalities = []
+        for municipality_id in range(1, municipality_count + 1):
+            code = '{:03d}'.format(municipality_id)
+            name_fi = 'Kunta {}'.format(municipality_id)
+            ytr_municipalities.append({'id': municipality_id, 'kuntakoodi': code,
+                                       'nimi': {'fi': name_fi, 'sv': 'Kommun {}'.format(municipality_id)}})
+            # Every 20th municipality is unknown to PTV
+            if municipality_id % 20 != 0:
+                ptv_municipalities.append({'id': code, 'name': {'fi': name_fi, 'sv': 'Kommun {}'.format(municipality_id), 'en': name_fi}})
+        return ytr_municipalities, ptv_municipalities
+
+    def _make_channel(self, channel_id: int) -> dict:
+        contacts = [{'id': channel_id * 10 + 1,
+                     'yhteystietotyyppi': {'id': 2, 'nimet': {'fi': 'Verkkosivun osoite', 'sv': 'Webbsida'}},
+                     'arvo': 'https://www.palvelu{}.fi'.format(channel_id), 'lisatieto': {}, 'palvelukanava': channel_id}]
+        if self._random.random() < 0.7:
+            contacts.append({'id': channel_id * 10 + 2,
+                             'yhteystietotyyppi': {'id': 1, 'nimet': {'fi': 'Puhelinnumero', 'sv': 'Telefon'}},
+                             'arvo': '040 {:07d}'.format(self._random.randrange(10 ** 7)), 'lisatieto': {}, 'palvelukanava': channel_id})
+        channel = {'id': channel_id,
+                   'aktiivinen': True,
+                   'toimija': self._random.randrange(1, 500),
+                   'ptvId': None,
+                   'nimi': {'fi': 'Kanava {}'.format(channel_id), 'sv': 'Kanal {}'.format(channel_id)},
+                   'kuvaus': {'fi': self._text(15), 'sv': 'På svenska'},
+                   'yhteystiedot': contacts,
+                   'muutettu': self._timestamp()}
+        if self._random.random() < 0.8:
+            channel['osoite'] = {'id': channel_id,
+                                 'katuosoite': {'fi': '{} {}'.format(self._random.choice(STREETS), self._random.randrange(1, 60))},
+                                 'postinumero': '{:05d}'.format(self._random.randrange(100, 99999)),
+                                 'kunta': self._random.randrange(1, len(self.ytr_municipalities) + 1)}
+        return(channel)
+
+    def _make_offer(self, offer_id: int, channel_count: int, areas_per_offer: int) -> dict:
+        name = '{} {}'.format(self._random.choice(FIRST_WORDS), self._random.choice(SECOND_WORDS))
+        # A few popular channels are shared by many offers
+        channel_ids = set()
+        for _ in range(self._random.choice((0, 1, 1, 2, 2, 3))):
+            if self._random.random() < 0.2:
+                channel_ids.add(self._random.randrange(1, min(channel_count, 50) + 1))
+            else:
+                channel_ids.add(self._random.randrange(1, channel_count + 1))
+        target_group = self._random.choices(TARGET_GROUPS, weights=[weight for _, _, weight in TARGET_GROUPS])[0]
+        areas = self._random.sample(range(1, len(self.ytr_municipalities) + 1), self._random.randrange(1, areas_per_offer + 1))
+        return({'id': offer_id,
+                'aktiivinen': True,
+                'ptvId': None,
+                'toimija_id': self._random.randrange(1, 500),
+                'palvelukanavat': sorted(channel_ids),
+                'nimi': {'fi': name, 'sv': self._random.choice(SWEDISH_WORDS)},
+                'kuvaus': {'fi': self._text(self._random.randrange(10, 60)), 'sv': ''},
+                'requirements': [],
+                'kohderyhmat': [{'koodi': target_group[0], 'nimi': {'fi': target_group[1]}}],
+                'serviceClasses': [],
+                'lifeEvents': [],
+                'kuntasaatavuudet': [{'kunta': area} for area in areas],
+                'muutettu': self._timestamp()})
+
+    def _assign_ptv_ids(self, ptv_share: float) -> None:
+        for offer in self.service_offers:
+            if self._random.random() < ptv_share:
+                offer['ptvId'] = self._uuid()
+        for channel in self.channels:
+            if self._random.random() < ptv_share:
+                channel['ptvId'] = self._uuid()
+
+    def _ptv_channel(self, ptv_id: str, service_ids: list) -> dict:
+        languages = {'en': [], 'fi': [], 'sv': []}
+        return({'id': ptv_id,
+                'type': self._random.choice(['EChannel', 'ServiceLocation', 'Phone', 'WebPage']),
+                'areaType': self._random.choice(['Nationwide', 'AreaType']),
+                'organizationId': self._uuid(),
+                'serviceIds': service_ids,
+                'name': {'en': None, 'fi': 'PTV kanava', 'sv': 'PTV kanal'},
+                'descriptions': {'en': [], 'fi': [{'value': self._text(20), 'type': 'Summary'}], 'sv': []},
+                'webPages': dict(languages), 'emails': dict(languages), 'phoneNumbers': dict(languages),
+                'addresses': dict(languages), 'areas': dict(languages),
+                'lastUpdated': datetime(2021, 8, 6) + timedelta(minutes=self._random.randrange(60 * 24 * 300))})
+
+    def _make_ptv_documents(self) -> tuple:
+        ptv_services = []
+        ptv_channels = []
+        ptv_service_ids = []
+        for offer in self.service_offers:
+            if offer['ptvId'] is None:
+                continue
+            ptv_service_ids.append(offer['ptvId'])
+            ptv_services.append({'id': offer['ptvId'],
+                                 'type': 'Service',
+                                 'subtype': None,
+                                 'channelIds': [],
+                                 'organizations': [{'id': self._uuid(), 'name': 'PTV organisaatio'}],
+                                 'name': {'en': None, 'fi': offer['nimi']['fi'], 'sv': offer['nimi']['sv']},
+                                 'descriptions': {'en': [], 'fi': [{'value': self._text(30), 'type': 'Description'}], 'sv': []},
+                                 'requirement': {'en': '', 'fi': '', 'sv': ''},
+                                 'targetGroups': {'en': [], 'fi': [{'name': 'Kansalaiset', 'code': 'KR1'}], 'sv': []},
+                                 'serviceClasses': {'en': [], 'fi': [], 'sv': []},
+                                 'areas': {'en': [], 'fi': [], 'sv': []},
+                                 'lifeEvents': {'en': [], 'fi': [], 'sv': []},
+                                 'lastUpdated': datetime(2021, 8, 6) + timedelta(minutes=self._random.randrange(60 * 24 * 300))})
+            # Channels that only PTV knows about
+            for _ in range(self._random.choice((0, 1, 1, 2))):
+                ptv_channels.append(self._ptv_channel(self._uuid(), [offer['ptvId']]))
+        # The PTV side of the YTR channels that refer to PTV
+        for channel in self.channels:
+            if channel['ptvId'] is not None:
+                service_ids = self._random.sample(ptv_service_ids, min(len(ptv_service_ids), self._random.randrange(0, 3)))
+                ptv_channels.append(self._ptv_channel(channel['ptvId'], service_ids))
+        ptv_services_by_id = {ptv_service['id']: ptv_service for ptv_service in ptv_services}
+        for ptv_channel in ptv_channels:
+            for ptv_service_id in ptv_channel['serviceIds']:
+                ptv_services_by_id[ptv_service_id]['channelIds'].append(ptv_channel['id'])
+        return ptv_services, ptv_channels
+
+    def routes(self) -> dict:
+        routes = {'/kunta': self.ytr_municipalities, '/palvelutarjous': self.service_offers}
+        for channel in self.channels:
+            routes['/palvelukanava/{}'.format(channel['id'])] = channel
+        return(routes)
+
+    def load_ptv(self, service_db) -> None:
+        # insert_many adds _id to the documents, so copies are inserted
+        for collection, documents in (('municipalities', self.ptv_municipalities), ('services', self.ptv_services), ('channels', self.ptv_channels)):
+            getattr(service_db, collection).drop()
+            if len(documents) > 0:
+                getattr(service_db, collection).insert_many([dict(document) for document in documents])
@@ -0,0 +1,35 @@
+"""
+MongoDB and YTR stand-ins for the benchmarks.
+
+BENCHMARK_MONGO_URL points the benchmarks to a real ( e.g. local ) mongod,
+otherwise mongomock is used if it is installed.
+"""
+import os
+from pymongo import MongoClient
+from ytr_service_data_importer import ytr_importer
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from ytr_service_data_importer.http_transport import create_api_session
+from test.stub_server import StubYTRServer
+
+MONGO_URL = os.environ.get("BENCHMARK_MONGO_URL")
+
+
+def get_mongo_client():
+    if MONGO_URL:
+        return(MongoClient(MONGO_URL))
+    try:
+        import mongomock
+    except ImportError:
+        raise Exception("Install mongomock or set BENCHMARK_MONGO_URL to run this benchmark")
+    return(mongomock.MongoClient())
+
+
+def serve_catalogue(catalogue, latency: float = 0.0) -> StubYTRServer:
+    # Use as a context manager, the importer talks to the stub until it is closed
+    server = StubYTRServer(catalogue.routes(), latency=latency)
+    ytr_importer.API = server.api_url
+    return(server)
+
+
+def make_importer(mongo_client, fetch_concurrency: int = 8) -> YTRImporter:
+    return(YTRImporter(mongo_client, create_api_session(fetch_concurrency, 0, 0.0), fetch_concurrency=fetch_concurrency))
@@ -0,0 +1,145 @@
+"""
+A local stand-in for the Kompassi-YTR API used by the HTTP level tests.
+"""
+import json
+import hashlib
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PATH = "/palvelutieto/api/v1"
+
+
+class StubYTRRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        path = self.path.split('?')[0]
+        with stub.lock:
+            stub.request_log.append(self.path)
+        if stub.latency > 0:
+            time.sleep(stub.latency)
+        with stub.lock:
+            failures_left = stub.failures.get(path[len(API_PATH):], 0)
+            if failures_left > 0:
+                stub.failures[path[len(API_PATH):]] = failures_left - 1
+        if failures_left > 0:
+            self.send_response(stub.failure_status)
+            if stub.retry_after is not None:
+                self.send_header('Retry-After', stub.retry_after)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if not path.startswith(API_PATH) or path[len(API_PATH):] not in stub.routes:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        payload = stub.routes[path[len(API_PATH):]]
+        query = parse_qs(urlsplit(self.path).query)
+        if stub.paging and isinstance(payload, list) and 'offset' in query and 'limit' in query:
+            offset = int(query['offset'][0])
+            payload = payload[offset:offset + int(query['limit'][0])]
+        body = json.dumps(payload).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest()) if stub.etags else None
+        if (etag is not None and self.headers.get('If-None-Match') == etag) or \
+                (stub.last_modified is not None and self.headers.get('If-Modified-Since') == stub.last_modified):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if stub.last_modified is not None:
+            self.send_header('Last-Modified', stub.last_modified)
+        self.end_headers()
+        with stub.lock:
+            broken_left = stub.broken_bodies.get(self.path[len(API_PATH):], 0)
+            if broken_left > 0:
+                stub.broken_bodies[self.path[len(API_PATH):]] = broken_left - 1
+        if broken_left > 0:
+            # Half of the promised body and then the connection goes away
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting ( e.g. a read timeout test )
+            return
+        with stub.lock:
+            stub.bytes_sent = stub.bytes_sent + len(body)
+
+
+class StubYTRServer():
+    """
+    Serves JSON payloads for YTR endpoints from a background thread
+
+    Args
+    ----------
+    routes : dict
+        Endpoint ( e.g. "/palvelukanava/123" ) -> JSON serializable payload
+
+    latency : float ( default 0.0 )
+        Artificial latency in seconds added to every request
+
+    etags : bool ( default False )
+        Send ETags and answer matching If-None-Match requests with 304
+
+    last_modified : str ( default None )
+        Last-Modified value to send, matching If-Modified-Since requests get 304
+
+    failures : dict ( default None )
+        Endpoint -> number of requests answered with failure_status before the real response
+
+    failure_status : int ( default 503 )
+        Status of the failed responses
+
+    retry_after : str ( default None )
+        Retry-After value sent with the failed responses
+
+    paging : bool ( default False )
+        Slice list payloads by the offset and limit query parameters when both are given
+
+    broken_bodies : dict ( default None )
+        Path with the query ( e.g. "/palvelutarjous?offset=0&limit=10" ) -> number of responses cut off halfway
+
+    """
+
+    def __init__(self, routes: dict, latency: float = 0.0, etags: bool = False, last_modified: str = None,
+                 failures: dict = None, failure_status: int = 503, retry_after: str = None, paging: bool = False,
+                 broken_bodies: dict = None) -> None:
+        self.routes = routes
+        self.latency = latency
+        self.etags = etags
+        self.last_modified = last_modified
+        self.failures = dict(failures or {})
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.paging = paging
+        self.broken_bodies = dict(broken_bodies or {})
+        self.request_log = []
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubYTRRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def api_url(self) -> str:
+        return "http://127.0.0.1:{}{}".format(self.httpd.server_address[1], API_PATH)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,41 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import unittest
+from ytr_service_data_importer.channel_registry import ChannelRegistry
+
+class ChannelRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ChannelRegistry()
+        self.ytr_channel = {'id': '125', 'ptvId': None, 'serviceIds': []}
+        self.other_ytr_channel = {'id': '126', 'ptvId': None, 'serviceIds': []}
+        self.ptv_channel = {'id': '123', 'ptvId': '112', 'serviceIds': []}
+        self.registry.add(self.ytr_channel, '1')
+        self.registry.add(self.other_ytr_channel, '1')
+        self.registry.add(self.ptv_channel, '2')
+
+    def test_lookup(self):
+        self.assertTrue(self.registry.has_ytr_id('126'))
+        self.assertTrue(self.registry.has_ptv_id('112'))
+        self.assertFalse(self.registry.has_ptv_id(None))
+        self.assertIs(self.registry.find({'id': '999', 'ptvId': '112'}), self.ptv_channel)
+        self.assertIs(self.registry.find({'id': '126', 'ptvId': None}), self.other_ytr_channel)
+        self.assertIsNone(self.registry.find({'id': '999', 'ptvId': None}))
+
+    def test_link_and_order(self):
+        self.registry.link({'id': '126', 'ptvId': None}, '3')
+        self.registry.link({'id': '124', 'ptvId': '112'}, '3')
+        self.assertEqual([cha['id'] for cha in self.registry.channels()], ['125', '126', '123'])
+        self.assertEqual(self.ytr_channel['serviceIds'], ['1'])
+        self.assertEqual(self.other_ytr_channel['serviceIds'], ['1', '3'])
+        self.assertEqual(self.ptv_channel['serviceIds'], ['2', '3'])
+        self.assertEqual(len(self.registry), 3)
+
+    def test_add_copies_references(self):
+        shared_ids = []
+        first = self.registry.add({'id': '200', 'ptvId': '300', 'serviceIds': shared_ids}, '4')
+        self.assertEqual(first['serviceIds'], ['4'])
+        self.assertEqual(shared_ids, [])
+
+if __name__ == '__main__':
+    unittest.main()
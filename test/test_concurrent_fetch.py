@@ -0,0 +1,53 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from test.stub_server import StubYTRServer
+
+class ConcurrentChannelFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.channel_ids = list(range(100, 116))
+        self.routes = {"/palvelukanava/{}".format(channel_id): {'id': channel_id, 'nimi': {'fi': 'Kanava {}'.format(channel_id)}}
+                       for channel_id in self.channel_ids}
+        self.mongo_client_instance = MagicMock()
+        self.mongo_client_instance.service_db.municipalities.find.return_value = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _counting_get(self, get):
+        def counted_get(*args, **kwargs):
+            with self.lock:
+                self.in_flight = self.in_flight + 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                return get(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.in_flight = self.in_flight - 1
+        return counted_get
+
+    def _fetch(self, server: StubYTRServer, fetch_concurrency: int) -> tuple:
+        importer = YTRImporter(self.mongo_client_instance, fetch_concurrency=fetch_concurrency)
+        importer.api_session.get = self._counting_get(importer.api_session.get)
+        self.max_in_flight = 0
+        with patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            channels = importer.get_service_channels(self.channel_ids)
+        return channels, self.max_in_flight
+
+    def test_concurrent_fetch_keeps_order_and_overlaps_requests(self):
+        # The latency keeps every request open long enough for the workers to overlap
+        with StubYTRServer(self.routes, latency=0.05) as server:
+            sequential_channels, sequential_in_flight = self._fetch(server, 1)
+            concurrent_channels, concurrent_in_flight = self._fetch(server, 8)
+        self.assertEqual([cha['id'] for cha in sequential_channels], self.channel_ids)
+        self.assertEqual(concurrent_channels, sequential_channels)
+        self.assertEqual(sequential_in_flight, 1)
+        self.assertGreater(concurrent_in_flight, 1)
+        self.assertLessEqual(concurrent_in_flight, 8)
+
+if __name__ == '__main__':
+    unittest.main()
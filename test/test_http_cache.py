@@ -0,0 +1,97 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import requests
+from ytr_service_data_importer.http_cache import HTTPResponseCache
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from test.stub_server import StubYTRServer
+
+class HTTPResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.routes = {'/kunta': [{'id': 1, 'kuntakoodi': '001'}],
+                       '/palvelutarjous': [{'id': offer_id, 'nimi': {'fi': 'Palvelu {}'.format(offer_id)}} for offer_id in range(200)]}
+        self.mongo_client_instance = MagicMock()
+        self.mongo_client_instance.service_db.municipalities.find.return_value = []
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def _importer(self, max_bytes: int = 1024 * 1024) -> YTRImporter:
+        http_cache = HTTPResponseCache(self.cache_dir.name, max_bytes)
+        return YTRImporter(self.mongo_client_instance, requests.Session(), http_cache=http_cache)
+
+    def test_etag_revalidation(self):
+        with StubYTRServer(self.routes, etags=True) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            first = list(self._importer().iter_service_offers())
+            bytes_after_first = server.bytes_sent
+            importer = self._importer()
+            second = list(importer.iter_service_offers())
+            municipalities = importer.get_municipalities()
+        self.assertEqual(first, self.routes['/palvelutarjous'])
+        self.assertEqual(second, first)
+        self.assertEqual(municipalities, self.routes['/kunta'])
+        # Only the municipalities were transferred on the second run
+        self.assertEqual(server.bytes_sent - bytes_after_first, len(b'[{"id": 1, "kuntakoodi": "001"}]'))
+        self.assertEqual(importer.http_cache.hits, 1)
+        self.assertEqual(importer.http_cache.misses, 1)
+
+    def test_last_modified_revalidation(self):
+        last_modified = 'Wed, 02 Jun 2021 09:40:06 GMT'
+        with StubYTRServer(self.routes, last_modified=last_modified) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            self._importer().get_municipalities()
+            importer = self._importer()
+            municipalities = importer.get_municipalities()
+        self.assertEqual(municipalities, self.routes['/kunta'])
+        self.assertEqual(importer.http_cache.hits, 1)
+
+    def test_size_based_eviction(self):
+        with StubYTRServer(self.routes, etags=True) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            # Room for the municipalities but not for both responses
+            importer = self._importer(max_bytes=100)
+            importer.get_municipalities()
+            list(importer.iter_service_offers())
+            importer.get_municipalities()
+        bodies = [file_name for file_name in os.listdir(self.cache_dir.name) if file_name.endswith('.body')]
+        self.assertEqual(len(bodies), 1)
+        self.assertEqual(importer.http_cache.hits, 0)
+        self.assertEqual(importer.http_cache.misses, 3)
+
+    def _session(self, status_code: int, headers: dict) -> MagicMock:
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        response.url = 'http://ytr.test/kunta'
+        response.raw = MagicMock()
+        response.close = MagicMock()
+        session = MagicMock()
+        session.get.return_value = response
+        return session
+
+    def test_error_responses_are_closed(self):
+        http_cache = HTTPResponseCache(self.cache_dir.name)
+        for status_code in (304, 404, 500):
+            session = self._session(status_code, {'ETag': '"1"'})
+            response = http_cache.get(session, 'http://ytr.test/kunta')
+            response.close.assert_called_once_with()
+        # The importer raises for the status of the closed response
+        importer = YTRImporter(self.mongo_client_instance, self._session(503, {}), http_cache=http_cache)
+        with patch('ytr_service_data_importer.ytr_importer.API', 'http://ytr.test'):
+            with self.assertRaisesRegex(Exception, '503 Server Error'):
+                importer.get_service_offers()
+        importer.api_session.get.return_value.close.assert_called_with()
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_uncached_error_responses_are_closed(self):
+        importer = YTRImporter(self.mongo_client_instance, self._session(500, {}))
+        with patch('ytr_service_data_importer.ytr_importer.API', 'http://ytr.test'):
+            with self.assertRaises(requests.HTTPError):
+                importer.get_services()
+        importer.api_session.get.return_value.close.assert_called_once_with()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import requests
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from ytr_service_data_importer.http_transport import create_api_session, RequestMetrics
+from test.stub_server import StubYTRServer
+
+class HTTPTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.routes = {'/kunta': [{'id': 1, 'kuntakoodi': '001'}],
+                       '/palvelukanava/7': {'id': 7, 'nimi': {'fi': 'Kanava'}},
+                       '/palvelukanava/8': {'id': 8, 'nimi': {'fi': 'Kanava'}}}
+        self.mongo_client_instance = MagicMock()
+        self.mongo_client_instance.service_db.municipalities.find.return_value = []
+
+    def _importer(self, max_retries: int = 3, backoff_factor: float = 0.0) -> YTRImporter:
+        return YTRImporter(self.mongo_client_instance, create_api_session(4, max_retries, backoff_factor))
+
+    def test_retries_server_errors(self):
+        with StubYTRServer(self.routes, failures={'/kunta': 2, '/palvelukanava/7': 1}) as server, \
+                patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            importer = self._importer()
+            municipalities = importer.get_municipalities()
+            channels = importer.get_service_channels([7, 8])
+        self.assertEqual(municipalities, self.routes['/kunta'])
+        self.assertEqual([cha['id'] for cha in channels], [7, 8])
+        summary = importer.request_metrics.summary()
+        self.assertEqual(summary['/kunta']['requests'], 1)
+        self.assertEqual(summary['/kunta']['retries'], 2)
+        # Channel requests are grouped under one endpoint
+        self.assertEqual(summary['/palvelukanava/{id}']['requests'], 2)
+        self.assertEqual(summary['/palvelukanava/{id}']['retries'], 1)
+
+    def test_honours_retry_after(self):
+        with StubYTRServer(self.routes, failures={'/kunta': 1}, failure_status=429, retry_after='1') as server, \
+                patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            start = time.perf_counter()
+            municipalities = self._importer().get_municipalities()
+            elapsed = time.perf_counter() - start
+        self.assertEqual(municipalities, self.routes['/kunta'])
+        self.assertGreaterEqual(elapsed, 0.9)
+
+    def test_gives_up_with_status_error(self):
+        with StubYTRServer(self.routes, failures={'/palvelukanava/7': 5}) as server, \
+                patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            importer = self._importer(max_retries=2)
+            with self.assertRaises(Exception):
+                importer.get_service_channels([7])
+            # The first attempt and two retries
+            self.assertEqual(len(server.request_log), 3)
+        self.assertEqual(importer.request_metrics.summary()['/palvelukanava/{id}']['errors'], 1)
+
+    def test_read_timeout(self):
+        with StubYTRServer(self.routes, latency=0.5) as server, \
+                patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                patch('ytr_service_data_importer.ytr_importer.HTTP_READ_TIMEOUT', 0.1):
+            importer = self._importer(max_retries=1)
+            with self.assertRaises(Exception):
+                importer.get_municipalities()
+            self.assertEqual(len(server.request_log), 2)
+
+    def test_missing_endpoint_is_not_retried(self):
+        with StubYTRServer(self.routes) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url):
+            importer = self._importer()
+            with self.assertRaises(requests.HTTPError):
+                importer._api_get('/palvelukanava/9')
+            self.assertEqual(len(server.request_log), 1)
+
+    def test_request_metrics(self):
+        metrics = RequestMetrics()
+        metrics.record('/palvelukanava/12', 0.2, 1)
+        metrics.record('/palvelukanava/13', 0.4)
+        metrics.record_error('/palvelukanava/14')
+        summary = metrics.summary()
+        self.assertEqual(list(summary), ['/palvelukanava/{id}'])
+        entry = summary['/palvelukanava/{id}']
+        self.assertEqual((entry['requests'], entry['retries'], entry['errors']), (2, 1, 1))
+        self.assertAlmostEqual(entry['meanSeconds'], 0.3)
+        self.assertAlmostEqual(entry['maxSeconds'], 0.4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import unittest
+from pymongo import ASCENDING, DESCENDING
+from ytr_service_data_importer.indexes import INDEX_SPEC, ensure_indexes, get_missing_indexes
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service_db = mongomock.MongoClient().service_db
+        self.service_db.channels.insert_one({'id': 'a', 'serviceIds': ['b']})
+
+    def test_missing_indexes_are_created_once(self):
+        channels = self.service_db.channels
+        self.assertEqual(get_missing_indexes(channels, INDEX_SPEC['channels']), ['id', 'serviceIds', 'lastUpdated'])
+        self.assertEqual(ensure_indexes(channels, INDEX_SPEC['channels']), ['id', 'serviceIds', 'lastUpdated'])
+        self.assertEqual(ensure_indexes(channels, INDEX_SPEC['channels']), [])
+        self.assertEqual(len(channels.index_information()), 4)
+
+    def test_compound_index_prefix_counts(self):
+        services = self.service_db.ytr_services
+        services.create_index([('lastUpdated', DESCENDING), ('id', ASCENDING)])
+        self.assertEqual(get_missing_indexes(services, INDEX_SPEC['ytr_services']), ['id', 'ptvId'])
+
+if __name__ == '__main__':
+    unittest.main()
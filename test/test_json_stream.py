@@ -0,0 +1,49 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import json
+import unittest
+from unittest.mock import patch
+from ytr_service_data_importer import json_stream
+from ytr_service_data_importer.json_stream import decode_json, iter_json_array
+
+class JSONStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.offers = [{'id': offer_id, 'nimi': {'fi': 'Palvelu ä {}'.format(offer_id)}, 'arvo': [1.5, None, True]}
+                       for offer_id in range(50)] + [12345, 'teksti', [], {}, -0.5e3, False, None,
+                                                      {'kuvaus': 'lainaus \\" ja [sulut] {}', 'lista': [[{'a': '\\'}]]}]
+        self.body = json.dumps(self.offers, ensure_ascii=False).encode('utf-8')
+
+    def _chunked(self, size: int) -> list:
+        return [self.body[start:start + size] for start in range(0, len(self.body), size)]
+
+    def test_iter_json_array(self):
+        # Chunk boundaries inside multi-byte characters, strings and numbers
+        for size in (1, 3, 7, 64, len(self.body)):
+            self.assertEqual(list(iter_json_array(self._chunked(size))), self.offers)
+        self.assertEqual(list(iter_json_array([b' [ ] '])), [])
+        for malformed in (b'{"id": 1}', b'[1, 2', b'[1 2]', b'[{"id":', b'[{"id" 1}]', b'[{"id": 1]}]', b'[tosi]'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array([malformed]))
+
+    def test_elements_are_decoded_with_loads(self):
+        with patch.object(json_stream, 'loads', wraps=json_stream.loads) as loads:
+            self.assertEqual(list(iter_json_array(self._chunked(64))), self.offers)
+        self.assertEqual(loads.call_count, len(self.offers))
+
+    def test_iter_json_array_without_orjson(self):
+        with patch.object(json_stream, 'orjson', None):
+            self.assertEqual(list(iter_json_array(self._chunked(7))), self.offers)
+            with self.assertRaises(ValueError):
+                list(iter_json_array([b'[{"id" 1}]']))
+
+    def test_decode_json(self):
+        self.assertEqual(decode_json(self.body, list, '/palvelutarjous'), self.offers)
+        self.assertEqual(json_stream.loads(self.body), json.loads(self.body))
+        with self.assertRaisesRegex(ValueError, 'Expected a JSON dict in /palvelukanava/1'):
+            decode_json(self.body, dict, '/palvelukanava/1')
+        with self.assertRaisesRegex(ValueError, 'Malformed JSON in /kunta'):
+            decode_json(b'[{"id": 1', list, '/kunta')
+
+if __name__ == '__main__':
+    unittest.main()
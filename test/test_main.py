@@ -0,0 +1,51 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import os
+import subprocess
+import unittest
+from benchmark.datagen import SyntheticCatalogue
+from test.stub_server import StubYTRServer
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Runs main.py as the __main__ script like the Docker CMD, with mongomock holding the synthetic PTV
+# collections in place of the Cosmos client
+RUN_MAIN = """
+import runpy
+import sys
+import mongomock
+import pymongo
+sys.path.append({repository!r})
+from benchmark.datagen import SyntheticCatalogue
+
+class LocalMongoClient(mongomock.MongoClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        SyntheticCatalogue({offer_count}, seed={seed}).load_ptv(self.service_db)
+
+pymongo.MongoClient = LocalMongoClient
+runpy.run_path('main.py', run_name='__main__')
+"""
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class MainScriptTest(unittest.TestCase):
+
+    def test_main_with_parse_workers(self):
+        # The parse workers import the main script again, which must not start another import
+        catalogue = SyntheticCatalogue(300, seed=13)
+        run_main = RUN_MAIN.format(repository=REPOSITORY, offer_count=300, seed=13)
+        with StubYTRServer(catalogue.routes()) as server:
+            env = dict(os.environ, KOMPASSIYTR_HOST='127.0.0.1', KOMPASSIYTR_PORT=str(server.httpd.server_address[1]),
+                       YTR_PARSE_WORKERS='2', YTR_IMPORT_MODE='full')
+            result = subprocess.run([sys.executable, '-c', run_main], cwd=os.path.join(REPOSITORY, 'ytr_service_data_import'), env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+        output = result.stdout.decode('utf-8')
+        self.assertEqual(result.returncode, 0, output)
+        self.assertEqual(output.count("new services stored."), 1, output)
+        self.assertEqual(len([path for path in server.request_log if path.endswith('/kunta')]), 1)
+
+if __name__ == '__main__':
+    unittest.main()
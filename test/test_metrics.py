@@ -0,0 +1,64 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import os
+import json
+import time
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from ytr_service_data_importer.metrics import ImportMetrics
+
+class ImportMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = ImportMetrics()
+
+    def test_nested_stages_are_exclusive(self):
+        with self.metrics.stage('outer'):
+            time.sleep(0.02)
+            with self.metrics.stage('inner'):
+                time.sleep(0.05)
+        stages = self.metrics.summary()['stages']
+        self.assertGreaterEqual(stages['inner']['seconds'], 0.05)
+        self.assertLess(stages['outer']['seconds'], stages['inner']['seconds'])
+        self.assertEqual(stages['outer']['calls'], 1)
+
+    def test_timed_iter(self):
+        def slow_items():
+            for item in range(3):
+                time.sleep(0.01)
+                yield item
+        self.assertEqual(list(self.metrics.timed_iter('read', slow_items())), [0, 1, 2])
+        stages = self.metrics.summary()['stages']
+        # One wait per item and one for the end of the iterator
+        self.assertEqual(stages['read']['calls'], 4)
+        self.assertGreaterEqual(stages['read']['seconds'], 0.03)
+
+    def test_counters_and_reset(self):
+        self.metrics.count('offers_read', 500)
+        self.metrics.count('offers_read', 20)
+        self.metrics.http.record('/kunta', 0.1)
+        self.metrics.mongo.started(MagicMock(command_name='find'))
+        self.metrics.mongo.started(MagicMock(command_name='getMore'))
+        self.metrics.mongo.failed(MagicMock(command_name='getMore'))
+        summary = self.metrics.summary(mode='full')
+        self.assertEqual(summary['mode'], 'full')
+        self.assertEqual(summary['counters'], {'offers_read': 520})
+        self.assertEqual(summary['http']['/kunta']['requests'], 1)
+        self.assertEqual(summary['mongo'], {'roundTrips': 2, 'failures': 1, 'commands': {'find': 1, 'getMore': 1}})
+        self.metrics.reset()
+        summary = self.metrics.summary()
+        self.assertEqual((summary['counters'], summary['http'], summary['mongo']['roundTrips']), ({}, {}, 0))
+
+    def test_write(self):
+        self.metrics.count('services_stored', 3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.json')
+            summary = self.metrics.summary(status='ok')
+            self.metrics.write(path, summary)
+            with open(path) as metrics_file:
+                self.assertEqual(json.load(metrics_file), summary)
+            self.assertEqual(os.listdir(directory), ['metrics.json'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import io
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock, patch
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from ytr_service_data_importer.http_transport import create_api_session
+from ytr_service_data_importer.paged_fetch import iter_pages
+from test.stub_server import StubYTRServer
+
+class IterPagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.items = list(range(95))
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.offsets = []
+
+    def _fetch_page(self, offset: int, limit: int) -> list:
+        with self.lock:
+            self.offsets.append(offset)
+            self.in_flight = self.in_flight + 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight = self.in_flight - 1
+        return self.items[offset:offset + limit]
+
+    def test_pages_come_in_order_with_a_bounded_window(self):
+        pages = list(iter_pages(self._fetch_page, 10, 3))
+        self.assertEqual([item for page in pages for item in page], self.items)
+        self.assertEqual(len(pages), 10)
+        self.assertLessEqual(self.max_in_flight, 3)
+        # No more than the window is fetched past the end
+        self.assertLessEqual(max(self.offsets), 95 + 3 * 10)
+
+    def test_short_first_page_is_the_only_one(self):
+        self.items = list(range(4))
+        self.assertEqual(list(iter_pages(self._fetch_page, 10, 3)), [[0, 1, 2, 3]])
+        self.assertEqual(self.offsets, [0])
+
+    def test_ignored_limit_gives_everything_at_once(self):
+        pages = list(iter_pages(lambda offset, limit: self.items, 10, 3))
+        self.assertEqual(pages, [self.items])
+
+    def test_ignored_offset_is_an_error(self):
+        with self.assertRaises(Exception) as context:
+            list(iter_pages(lambda offset, limit: self.items[:limit], 10, 3))
+        self.assertIn("offset is not supported", str(context.exception))
+
+
+class PagedOfferFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.offers = [{'id': offer_id, 'nimi': {'fi': 'Palvelu {}'.format(offer_id)}} for offer_id in range(1, 48)]
+        self.routes = {'/palvelutarjous': self.offers}
+        self.mongo_client_instance = MagicMock()
+
+    def _fetch(self, server: StubYTRServer, page_size: int = 10) -> tuple:
+        with patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                patch('ytr_service_data_importer.ytr_importer.HTTP_BACKOFF_FACTOR', 0.0), \
+                redirect_stdout(io.StringIO()):
+            importer = YTRImporter(self.mongo_client_instance, create_api_session(4, 0, 0.0), page_size=page_size)
+            offers = list(importer.iter_service_offers())
+        return offers, importer
+
+    def test_paged_fetch(self):
+        with StubYTRServer(self.routes, paging=True) as server:
+            offers, importer = self._fetch(server)
+        self.assertEqual(offers, self.offers)
+        self.assertTrue(all('limit=10' in path for path in server.request_log))
+        self.assertEqual(importer.metrics.summary()['counters']['offer_pages'], 5)
+
+    def test_broken_page_is_fetched_again(self):
+        broken = '/palvelutarjous?offset=20&limit=10'
+        with StubYTRServer(self.routes, paging=True, broken_bodies={broken: 1}) as server:
+            offers, importer = self._fetch(server)
+        self.assertEqual(offers, self.offers)
+        paths = [path.split('/api/v1')[1] for path in server.request_log]
+        self.assertEqual(paths.count(broken), 2)
+        # The pages before it were not fetched again
+        self.assertEqual(paths.count('/palvelutarjous?offset=0&limit=10'), 1)
+        self.assertEqual(importer.metrics.summary()['counters']['offer_page_retries'], 1)
+
+    def test_server_without_paging(self):
+        with StubYTRServer(self.routes) as server:
+            offers, importer = self._fetch(server)
+        self.assertEqual(offers, self.offers)
+        self.assertEqual(len(server.request_log), 1)
+
+    def test_rejected_paging_falls_back_to_one_get(self):
+        with StubYTRServer(self.routes, paging=True, failures={'/palvelutarjous': 1}, failure_status=400) as server:
+            offers, importer = self._fetch(server)
+        self.assertEqual(offers, self.offers)
+        self.assertEqual([path.split('/api/v1')[1] for path in server.request_log],
+                         ['/palvelutarjous?offset=0&limit=10', '/palvelutarjous'])
+
+    def test_single_get_without_page_size(self):
+        with StubYTRServer(self.routes, paging=True) as server:
+            offers, importer = self._fetch(server, page_size=0)
+        self.assertEqual(offers, self.offers)
+        self.assertEqual([path.split('/api/v1')[1] for path in server.request_log], ['/palvelutarjous'])
+
+    def test_connection_pool_covers_the_page_window(self):
+        with patch('ytr_service_data_importer.ytr_importer.OFFER_PAGE_WINDOW', 6):
+            importer = YTRImporter(self.mongo_client_instance, fetch_concurrency=2)
+            self.assertEqual(importer.api_session.get_adapter('http://ytr').poolmanager.connection_pool_kw['maxsize'], 6)
+            importer = YTRImporter(self.mongo_client_instance, fetch_concurrency=8)
+            self.assertEqual(importer.api_session.get_adapter('http://ytr').poolmanager.connection_pool_kw['maxsize'], 8)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import unittest
+from unittest.mock import MagicMock
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from ytr_service_data_importer.parallel_parse import ParallelParser
+
+class ParallelParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue = SyntheticCatalogue(300, seed=3)
+        mongo_client = MagicMock()
+        mongo_client.service_db.municipalities.find.return_value = self.catalogue.ptv_municipalities
+        self.importer = YTRImporter(mongo_client, MagicMock())
+        self.importer.municipality_map = self.importer._parse_municipality_map(self.catalogue.ytr_municipalities)
+
+    def test_parallel_parse_matches_serial(self):
+        offers = self.catalogue.service_offers
+        channels = self.catalogue.channels
+        parser = ParallelParser(self.importer, workers=2, chunk_size=64, min_items=10)
+        try:
+            parsed_offers = parser.parse_services(offers)
+            parsed_channels = parser.parse_channels(channels)
+            self.assertIsNotNone(parser._pool)
+        finally:
+            parser.close()
+        self.assertEqual(parsed_offers, [self.importer._parse_service_info(offer) for offer in offers])
+        self.assertEqual(parsed_channels, [self.importer._parse_channel_info(channel) for channel in channels])
+
+    def test_start_launches_the_workers(self):
+        parser = ParallelParser(self.importer, workers=2, chunk_size=64, min_items=10)
+        try:
+            parser.start()
+            self.assertIsNotNone(parser._pool)
+            # The workers are not forked from the threads of the importing process
+            self.assertIn(parser._pool._mp_context.get_start_method(), ('forkserver', 'spawn'))
+            self.assertGreater(len(parser._pool._processes), 0)
+            pool = parser._pool
+            parser.parse_services(self.catalogue.service_offers)
+            self.assertIs(parser._pool, pool)
+        finally:
+            parser.close()
+        single = ParallelParser(self.importer, workers=1, chunk_size=64, min_items=10)
+        single.start()
+        self.assertIsNone(single._pool)
+
+    def test_small_inputs_are_parsed_serially(self):
+        parser = ParallelParser(self.importer, workers=4, chunk_size=64, min_items=500)
+        parsed_offers = parser.parse_services(self.catalogue.service_offers)
+        self.assertIsNone(parser._pool)
+        self.assertEqual(len(parsed_offers), 300)
+        parser.close()
+
+    def test_single_worker_never_starts_a_pool(self):
+        parser = ParallelParser(self.importer, workers=1, chunk_size=1, min_items=0)
+        parser.parse_channels(self.catalogue.channels)
+        self.assertIsNone(parser._pool)
+
+if __name__ == '__main__':
+    unittest.main()
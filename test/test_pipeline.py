@@ -0,0 +1,74 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import threading
+import time
+import unittest
+from ytr_service_data_importer.pipeline import StagedPipeline
+
+class StagedPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.produced = 0
+
+    def _source(self, count: int):
+        for item in range(count):
+            self.produced = self.produced + 1
+            yield item
+
+    def _pipeline(self, queue_size: int) -> StagedPipeline:
+        return StagedPipeline([('double', lambda item: item * 2), ('increment', lambda item: item + 1)], queue_size)
+
+    def test_results_keep_the_source_order(self):
+        for queue_size in (0, 1, 3):
+            pipeline = self._pipeline(queue_size)
+            self.assertEqual(list(pipeline.run(self._source(50))), [item * 2 + 1 for item in range(50)])
+            utilisation = pipeline.utilisation()
+            self.assertEqual(list(utilisation), ['fetch', 'double', 'increment', 'write'])
+            self.assertTrue(all(entry['items'] == 50 for entry in utilisation.values()))
+
+    def test_stages_run_in_their_own_threads(self):
+        thread_names = set()
+        def record(item):
+            thread_names.add(threading.current_thread().name)
+            return item
+        list(StagedPipeline([('parse', record)], 2).run(range(5)))
+        self.assertEqual(thread_names, {'pipeline-parse'})
+        thread_names.clear()
+        list(StagedPipeline([('parse', record)], 0).run(range(5)))
+        self.assertEqual(thread_names, {threading.current_thread().name})
+
+    def test_backpressure_bounds_the_items_in_flight(self):
+        results = StagedPipeline([('slow', lambda item: item)], 2).run(self._source(1000))
+        next(results)
+        time.sleep(0.2)
+        # Two queues of two, one item in each thread and the one handed out
+        self.assertLessEqual(self.produced, 8)
+        results.close()
+
+    def test_stage_error_reaches_the_consumer(self):
+        def fail(item):
+            if item == 7:
+                raise ValueError("broken item")
+            return item
+        for queue_size in (0, 2):
+            with self.assertRaises(ValueError):
+                list(StagedPipeline([('parse', fail)], queue_size).run(self._source(1000)))
+
+    def test_source_error_reaches_the_consumer(self):
+        def broken_source():
+            yield 1
+            raise IOError("connection lost")
+        results = StagedPipeline([('parse', lambda item: item)], 2).run(broken_source())
+        self.assertEqual(next(results), 1)
+        with self.assertRaises(IOError):
+            next(results)
+
+    def test_stopping_early_ends_the_threads(self):
+        results = self._pipeline(2).run(self._source(100000))
+        self.assertEqual(next(results), 1)
+        results.close()
+        self.assertFalse(any(thread.name.startswith('pipeline-') for thread in threading.enumerate()))
+        self.assertLess(self.produced, 100)
+
+if __name__ == '__main__':
+    unittest.main()
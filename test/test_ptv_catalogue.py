@@ -0,0 +1,176 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest.mock import patch
+from pymongo.errors import OperationFailure
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.ytr_importer import YTRImporter, PTV_CACHE_COLLECTIONS
+from ytr_service_data_importer.http_transport import create_api_session
+from ytr_service_data_importer.ptv_catalogue import CatalogueFile, PTVCatalogueCache, get_collection_stamp
+from test.stub_server import StubYTRServer
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+PROJECTION = {'_id': False, 'id': True, 'serviceIds': True, 'lastUpdated': True}
+
+
+class CatalogueFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'channels.bson')
+        self.documents = [{'id': 'a', 'serviceIds': ['s1', 's2', 's1'], 'lastUpdated': datetime(2021, 8, 6, 13, 45, 7, 123000)},
+                          {'id': 'b', 'serviceIds': ['s2'], 'name': {'fi': 'Kanava'}},
+                          {'id': 'a', 'serviceIds': [], 'lastUpdated': None},
+                          {'id': 'c', 'serviceIds': None}]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookups_decode_the_stored_documents(self):
+        catalogue_file = CatalogueFile(self.path)
+        self.assertEqual(catalogue_file.build(self.documents, {'count': 4}, PROJECTION, ('serviceIds',)), 3)
+        # The first document of an id wins
+        self.assertEqual(catalogue_file['a'], self.documents[0])
+        self.assertEqual(catalogue_file.get('b'), self.documents[1])
+        self.assertIsNone(catalogue_file.get('x'))
+        self.assertIn('c', catalogue_file)
+        self.assertNotIn('x', catalogue_file)
+        self.assertEqual(len(catalogue_file), 3)
+        by_service = catalogue_file.grouped_by('serviceIds')
+        self.assertEqual(by_service.get('s1'), [self.documents[0]])
+        self.assertEqual(by_service.get('s2'), [self.documents[0], self.documents[1]])
+        self.assertEqual(by_service.get('x', []), [])
+        with self.assertRaisesRegex(Exception, 'not indexed'):
+            catalogue_file.grouped_by('id')
+        # Every lookup decodes a document of its own
+        self.assertIsNot(catalogue_file['a'], catalogue_file['a'])
+
+    def test_reopen_and_damaged_copy(self):
+        CatalogueFile(self.path).build(self.documents, {'count': 4}, PROJECTION, ('serviceIds',))
+        catalogue_file = CatalogueFile(self.path)
+        self.assertTrue(catalogue_file.open())
+        self.assertEqual(catalogue_file.stamp, {'count': 4})
+        self.assertEqual(catalogue_file['b'], self.documents[1])
+        catalogue_file.close()
+        with open(self.path, 'ab') as data_file:
+            data_file.write(b'\x00')
+        self.assertFalse(catalogue_file.open())
+        self.assertFalse(CatalogueFile(os.path.join(self.directory.name, 'missing.bson')).open())
+
+    def test_empty_collection(self):
+        catalogue_file = CatalogueFile(self.path)
+        self.assertEqual(catalogue_file.build([], {'count': 0}, PROJECTION), 0)
+        self.assertIsNone(catalogue_file.get('a'))
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class PTVCatalogueCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.service_db = mongomock.MongoClient().service_db
+        self.service_db.channels.insert_many([{'id': 'a', 'serviceIds': ['s1'], 'lastUpdated': datetime(2021, 1, 1)},
+                                              {'id': 'b', 'serviceIds': ['s1'], 'lastUpdated': datetime(2021, 1, 2)}])
+        self.collections = {'channels': (PROJECTION, ('serviceIds',))}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_refresh_only_when_the_collection_changes(self):
+        cache = PTVCatalogueCache(self.directory.name, self.collections)
+        self.assertEqual(cache.refresh(self.service_db), ['channels'])
+        self.assertEqual(cache.refresh(self.service_db), [])
+        # A new process finds the copy on disk
+        other = PTVCatalogueCache(self.directory.name, self.collections)
+        self.assertEqual(other.refresh(self.service_db), [])
+        self.assertEqual(other.get('channels')['b']['lastUpdated'], datetime(2021, 1, 2))
+        # Newer lastUpdated
+        self.service_db.channels.update_one({'id': 'a'}, {'$set': {'lastUpdated': datetime(2021, 1, 3), 'serviceIds': ['s2']}})
+        self.assertEqual(cache.refresh(self.service_db), ['channels'])
+        self.assertEqual(cache.get('channels').grouped_by('serviceIds').get('s2'), [{'id': 'a', 'serviceIds': ['s2'], 'lastUpdated': datetime(2021, 1, 3)}])
+        # A removed document
+        self.service_db.channels.delete_one({'id': 'b'})
+        self.assertEqual(cache.refresh(self.service_db), ['channels'])
+        self.assertNotIn('b', cache.get('channels'))
+        self.assertEqual(cache.rebuilds, 3)
+        # Another projection
+        changed = PTVCatalogueCache(self.directory.name, {'channels': ({'_id': False, 'id': True}, ('serviceIds',))})
+        self.assertEqual(changed.refresh(self.service_db), ['channels'])
+
+    def test_unchanged_stamp_reuses_the_copy(self):
+        PTVCatalogueCache(self.directory.name, self.collections).refresh(self.service_db)
+        cache = PTVCatalogueCache(self.directory.name, self.collections)
+        with patch.object(CatalogueFile, 'build') as build:
+            self.assertEqual(cache.refresh(self.service_db), [])
+            self.assertEqual(cache.refresh(self.service_db), [])
+        build.assert_not_called()
+        self.assertEqual(cache.rebuilds, 0)
+        self.assertEqual(cache.get('channels').grouped_by('serviceIds').get('s1'),
+                         [{'id': 'a', 'serviceIds': ['s1'], 'lastUpdated': datetime(2021, 1, 1)},
+                          {'id': 'b', 'serviceIds': ['s1'], 'lastUpdated': datetime(2021, 1, 2)}])
+
+    def test_collection_stamp(self):
+        self.assertEqual(get_collection_stamp(self.service_db.channels), {'lastUpdated': datetime(2021, 1, 2), 'count': 2})
+        self.assertEqual(get_collection_stamp(self.service_db.services), {'lastUpdated': None, 'count': 0})
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class CachedJoinImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue = SyntheticCatalogue(200, seed=11)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _import(self, ptv_cache=None, **kwargs) -> tuple:
+        mongo_client = mongomock.MongoClient()
+        self.catalogue.load_ptv(mongo_client.service_db)
+        with StubYTRServer(self.catalogue.routes()) as server, \
+                patch('ytr_service_data_importer.ytr_importer.API', server.api_url), redirect_stdout(io.StringIO()):
+            importer = YTRImporter(mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4, ptv_cache=ptv_cache, **kwargs)
+            importer.import_ytr_data(mode='full')
+        service_db = mongo_client.service_db
+        services = sorted(service_db.ytr_services.find({}, {'_id': False}), key=lambda service: service['id'])
+        channels = sorted(service_db.ytr_channels.find({}, {'_id': False}), key=lambda channel: channel['id'])
+        return(importer, services, channels)
+
+    def test_joins_against_the_cache_give_the_same_import(self):
+        _, services, channels = self._import()
+        cache = PTVCatalogueCache(self.directory.name, PTV_CACHE_COLLECTIONS)
+        importer, cached_services, cached_channels = self._import(cache)
+        self.assertTrue(importer._use_ptv_cache)
+        self.assertEqual(importer.metrics.summary()['counters']['ptv_cache_rebuilds'], 2)
+        self.assertEqual(cached_services, services)
+        self.assertEqual(cached_channels, channels)
+        self.assertTrue(any(service['ptvId'] is not None for service in cached_services))
+        # The unchanged PTV collections are not copied again
+        importer, cached_services, _ = self._import(cache)
+        self.assertNotIn('ptv_cache_rebuilds', importer.metrics.summary()['counters'])
+        self.assertEqual(cached_services, services)
+
+    def test_failed_refresh_is_counted(self):
+        cache = PTVCatalogueCache(self.directory.name, PTV_CACHE_COLLECTIONS)
+        with patch('ytr_service_data_importer.ptv_catalogue.get_collection_stamp', side_effect=OperationFailure('sort exceeded memory limit')):
+            importer, services, _ = self._import(cache)
+        self.assertFalse(importer._use_ptv_cache)
+        self.assertEqual(importer.metrics.summary()['counters']['ptv_cache_failures'], 1)
+        self.assertGreater(len(services), 0)
+
+    def test_snapshot_runs_read_ptv_from_mongo(self):
+        cache = PTVCatalogueCache(self.directory.name, PTV_CACHE_COLLECTIONS)
+        importer, _, _ = self._import(cache, snapshot_file=os.path.join(self.directory.name, 'snapshot.zip'))
+        self.assertFalse(importer._use_ptv_cache)
+        self.assertEqual(cache.rebuilds, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import pickle
+import unittest
+from datetime import datetime
+from ytr_service_data_importer.records import ServiceRecord, ChannelRecord, LanguageSplit, EMPTY, compact_list, to_document
+
+class RecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ptv_service = {'_id': 'mongo-id',
+                            'id': 'ptv-1',
+                            'type': 'Service',
+                            'channelIds': [],
+                            'name': {'en': None, 'fi': 'Nimi', 'sv': 'Namn'},
+                            'descriptions': {'en': [], 'fi': [{'value': 'Kuvaus', 'type': 'Summary'}], 'sv': []},
+                            'organizations': [{'id': 'org-1'}],
+                            'lastUpdated': datetime(2021, 8, 6)}
+
+    def test_record_behaves_like_the_document(self):
+        record = ServiceRecord.from_document(self.ptv_service)
+        self.assertEqual(record, self.ptv_service)
+        self.assertEqual(record['name']['fi'], 'Nimi')
+        self.assertEqual(record.get('subtype', 'none'), 'none')
+        self.assertNotIn('subtype', record)
+        self.assertIn('_id', record)
+        with self.assertRaises(KeyError):
+            record['requirement']
+        del record['_id']
+        self.assertNotIn('_id', record)
+
+    def test_from_document_shares_the_values(self):
+        record = ServiceRecord.from_document(self.ptv_service, ptvId='ptv-1')
+        self.assertIs(record['descriptions'], self.ptv_service['descriptions'])
+        self.assertEqual(record['ptvId'], 'ptv-1')
+        self.assertNotIn('ptvId', self.ptv_service)
+
+    def test_empty_language_lists_are_shared(self):
+        split = LanguageSplit.from_document({'en': [], 'fi': ['a'], 'sv': []})
+        self.assertIs(split['en'], EMPTY)
+        self.assertIs(split['sv'], EMPTY)
+        self.assertIs(compact_list([]), EMPTY)
+        self.assertEqual(split.to_document(), {'en': [], 'fi': ['a'], 'sv': []})
+
+    def test_to_document_gives_plain_dicts_and_lists(self):
+        document = ServiceRecord.from_document(self.ptv_service).to_document()
+        self.assertEqual(document, self.ptv_service)
+        self.assertEqual(list(document), ['id', 'type', 'channelIds', 'organizations', 'name', 'descriptions', 'lastUpdated', '_id'])
+        record = ServiceRecord(id='1', name=LanguageSplit(en=EMPTY, fi=['Nimi'], sv=None))
+        self.assertEqual(record.to_document(), {'id': '1', 'name': {'en': [], 'fi': ['Nimi'], 'sv': None}})
+        self.assertIs(type(record.to_document()['name']['en']), list)
+        plain = {'id': 1}
+        self.assertIs(to_document(plain), plain)
+
+    def test_copy_is_shallow(self):
+        record = ChannelRecord(id='1', serviceIds=[], name=LanguageSplit(fi='Kanava'))
+        copied = record.copy()
+        copied['serviceIds'] = ['2']
+        copied['name']['sv'] = 'Kanal'
+        self.assertEqual(record['serviceIds'], [])
+        self.assertEqual(record['name']['sv'], 'Kanal')
+
+    def test_language_split_only_takes_languages(self):
+        split = LanguageSplit()
+        with self.assertRaises(KeyError):
+            split['de'] = 'Name'
+        self.assertEqual(split, {'en': None, 'fi': None, 'sv': None})
+
+    def test_records_survive_pickling(self):
+        record = ServiceRecord.from_document(self.ptv_service)
+        record['targetGroups'] = LanguageSplit(en=EMPTY, fi=[{'code': 'KR4'}], sv=EMPTY)
+        del record['type']
+        unpickled = pickle.loads(pickle.dumps(record))
+        self.assertEqual(unpickled, record)
+        self.assertNotIn('type', unpickled)
+        self.assertIs(unpickled['targetGroups']['sv'], EMPTY)
+
+if __name__ == '__main__':
+    unittest.main()
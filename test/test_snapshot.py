@@ -0,0 +1,146 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest.mock import patch
+import requests
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from ytr_service_data_importer.http_transport import create_api_session
+from ytr_service_data_importer.records import to_document
+from ytr_service_data_importer.snapshot import SnapshotRecorder, Snapshot, ReplaySession
+from test.stub_server import StubYTRServer
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class SnapshotArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.zip')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip_keeps_bodies_and_bson_types(self):
+        recorder = SnapshotRecorder()
+        recorder.record_response('/kunta', b'[{"id": 1}]')
+        recorder.record_response('/palvelutarjous?offset=0&limit=2', b'[]')
+        documents = [{'id': 'a', 'lastUpdated': datetime(2021, 8, 6, 13, 45, 7, 123000), 'size': 2 ** 40},
+                     {'id': 'a', 'lastUpdated': None}, {'id': 'b'}]
+        self.assertEqual(list(recorder.record_documents('channels', documents)), documents)
+        recorder.save(self.path, pageSize=2)
+        snapshot = Snapshot.load(self.path)
+        self.assertEqual(snapshot.responses, {'/kunta': b'[{"id": 1}]', '/palvelutarjous?offset=0&limit=2': b'[]'})
+        # The first document of an id wins, datetimes come back naive
+        self.assertEqual(snapshot.collections, {'channels': [documents[0], documents[2]]})
+        self.assertEqual(snapshot.manifest['pageSize'], 2)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertEqual(archive.getinfo('manifest.json').compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_rejects_other_format_version(self):
+        with zipfile.ZipFile(self.path, 'w') as archive:
+            archive.writestr('manifest.json', '{"version": 99, "responses": {}, "collections": {}}')
+        with self.assertRaisesRegex(Exception, 'format version 99'):
+            Snapshot.load(self.path)
+
+    def test_replay_session_answers_from_snapshot(self):
+        snapshot = Snapshot({}, {'/kunta': b'[1, 2]'}, {})
+        session = ReplaySession(snapshot, 'http://ytr/api')
+        response = session.get(url='http://ytr/api/kunta', stream=True, timeout=(1, 1))
+        response.raise_for_status()
+        self.assertEqual(b''.join(response.iter_content(chunk_size=1)), b'[1, 2]')
+        self.assertEqual(response.json(), [1, 2])
+        missing = session.get(url='http://ytr/api/palvelukanava/1')
+        with self.assertRaises(requests.HTTPError) as context:
+            missing.raise_for_status()
+        self.assertEqual(context.exception.response.status_code, 404)
+
+    def test_replay_session_pages_past_the_end_are_empty(self):
+        snapshot = Snapshot({}, {'/palvelutarjous?offset=0&limit=2': b'[1, 2]', '/palvelutarjous?offset=2&limit=2': b'[3]'}, {})
+        session = ReplaySession(snapshot, 'http://ytr/api')
+        self.assertEqual(session.get(url='http://ytr/api/palvelutarjous?offset=2&limit=2').json(), [3])
+        past_end = session.get(url='http://ytr/api/palvelutarjous?offset=6&limit=2')
+        past_end.raise_for_status()
+        self.assertEqual(past_end.json(), [])
+        # A missing page before the end is not made up
+        self.assertEqual(session.get(url='http://ytr/api/palvelutarjous?offset=1&limit=2').status_code, 404)
+        self.assertEqual(session.get(url='http://ytr/api/palvelukanava?offset=6&limit=2').status_code, 404)
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class SnapshotReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue = SyntheticCatalogue(150, seed=5)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.zip')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _record(self, page_size: int = 0) -> YTRImporter:
+        mongo_client = mongomock.MongoClient()
+        self.catalogue.load_ptv(mongo_client.service_db)
+        with StubYTRServer(self.catalogue.routes(), paging=True) as server, \
+                patch('ytr_service_data_importer.ytr_importer.API', server.api_url), redirect_stdout(io.StringIO()):
+            importer = YTRImporter(mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4, page_size=page_size,
+                                   snapshot_file=self.path)
+            importer.import_ytr_data(mode='full')
+        return(importer)
+
+    def _documents(self, collection) -> dict:
+        return({document['id']: to_document(document) for document in collection})
+
+    def _assert_replay_matches(self, importer: YTRImporter) -> None:
+        # The stub server is closed, every response has to come from the snapshot
+        with patch('ytr_service_data_importer.ytr_importer.API', 'http://127.0.0.1:9/palvelutieto/api/v1'), \
+                redirect_stdout(io.StringIO()):
+            replay = YTRImporter.from_snapshot(self.path, fetch_concurrency=4)
+            services, channels = replay._get_new_services_and_channels()
+        service_db = importer.mongo_client.service_db
+        stored_services = self._documents(service_db.ytr_services.find({}, {'_id': False, 'contentHash': False}))
+        stored_channels = self._documents(service_db.ytr_channels.find({}, {'_id': False, 'contentHash': False}))
+        self.assertGreater(len(stored_services), 0)
+        self.assertEqual(self._documents(services), stored_services)
+        self.assertEqual(self._documents(channels), stored_channels)
+        self.assertEqual(replay.metrics.summary()['http']['/palvelutarjous']['errors'], 0)
+
+    def test_replay_gives_the_recorded_import(self):
+        importer = self._record()
+        snapshot = Snapshot.load(self.path)
+        self.assertIn('/kunta', snapshot.responses)
+        self.assertIn('/palvelutarjous', snapshot.responses)
+        self.assertTrue(any(endpoint.startswith('/palvelukanava/') for endpoint in snapshot.responses))
+        self.assertEqual(set(snapshot.collections), {'municipalities', 'services', 'channels'})
+        self.assertEqual(snapshot.manifest['status'], 'ok')
+        self._assert_replay_matches(importer)
+
+    def test_replay_of_paged_fetch(self):
+        importer = self._record(page_size=40)
+        snapshot = Snapshot.load(self.path)
+        self.assertIn('/palvelutarjous?offset=40&limit=40', snapshot.responses)
+        self.assertNotIn('/palvelutarjous', snapshot.responses)
+        self._assert_replay_matches(importer)
+
+    def test_no_snapshot_by_default(self):
+        mongo_client = mongomock.MongoClient()
+        self.catalogue.load_ptv(mongo_client.service_db)
+        with StubYTRServer(self.catalogue.routes()) as server, \
+                patch('ytr_service_data_importer.ytr_importer.API', server.api_url), redirect_stdout(io.StringIO()):
+            importer = YTRImporter(mongo_client, create_api_session(1, 0, 0.0))
+            importer.import_ytr_data(mode='full')
+        self.assertIsNone(importer.snapshot)
+        self.assertFalse(os.path.exists(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import gc
+import json
+import tracemalloc
+import unittest
+from unittest.mock import MagicMock, patch
+from ytr_service_data_importer.ytr_importer import YTRImporter
+
+# Memory a distinct channel may take until the channels are written, its parsed record with the
+# cache and registry entries. A raw channel that stayed cached next to it would go over.
+CHANNEL_BYTES_CEILING = 3200
+
+
+def service_offer(offer_id: int, channel_count: int) -> dict:
+    return {'id': offer_id,
+            'ptvId': None,
+            'toimija_id': 78,
+            'palvelukanavat': [offer_id % channel_count],
+            'nimi': {'fi': 'Palvelu {}'.format(offer_id), 'sv': 'Tjänst {}'.format(offer_id)},
+            'kuvaus': {'fi': 'Kuvaus ' * 20, 'sv': 'Beskrivning ' * 20},
+            'kohderyhmat': [{'koodi': 'KR-4', 'nimi': {'fi': 'Kansalaiset'}}],
+            'kuntasaatavuudet': [{'kunta': 1}, {'kunta': 2}],
+            'muutettu': '2020-12-13T08:02.57.083Z'}
+
+
+class StreamingResponse():
+
+    def __init__(self, offer_count: int, channel_count: int) -> None:
+        self.offer_count = offer_count
+        self.channel_count = channel_count
+
+    def iter_content(self, chunk_size: int = 1):
+        # The payload is produced lazily so that only the importer's memory is measured
+        yield b'['
+        for offer_id in range(self.offer_count):
+            separator = b',' if offer_id > 0 else b''
+            yield separator + json.dumps(service_offer(offer_id, self.channel_count)).encode('utf-8')
+        yield b']'
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class CountingCollection():
+
+    def __init__(self, documents: list = None) -> None:
+        self.documents = documents or []
+        self.inserted = 0
+        self.insert_calls = 0
+
+    def find(self, *args, **kwargs) -> list:
+        return list(self.documents)
+
+    def insert_many(self, documents: list, ordered: bool = True) -> None:
+        self.inserted = self.inserted + len(documents)
+        self.insert_calls = self.insert_calls + 1
+
+    def drop(self) -> None:
+        self.inserted = 0
+        self.insert_calls = 0
+
+    def index_information(self) -> dict:
+        return {'_id_': {'key': [('_id', 1)]}}
+
+    def create_indexes(self, *args, **kwargs) -> None:
+        pass
+
+    def rename(self, new_name: str, dropTarget: bool = False) -> None:
+        setattr(self.database, new_name, self)
+
+    def update_one(self, *args, **kwargs) -> None:
+        pass
+
+
+class FakeDatabase():
+
+    def __init__(self) -> None:
+        self.municipalities = CountingCollection([{'id': '001', 'name': {'fi': 'Turku', 'sv': 'Åbo', 'en': 'Turku'}},
+                                                  {'id': '002', 'name': {'fi': 'Naantali', 'sv': 'Nådendal', 'en': 'Naantali'}}])
+        self.services = CountingCollection()
+        self.channels = CountingCollection()
+
+    def __getattr__(self, name: str):
+        collection = CountingCollection()
+        collection.database = self
+        setattr(self, name, collection)
+        return collection
+
+
+class FakeSession():
+
+    def __init__(self, offer_count: int, channel_count: int) -> None:
+        self.offer_count = offer_count
+        self.channel_count = channel_count
+
+    def get(self, url: str, **kwargs):
+        if url.endswith('/kunta'):
+            return MagicMock(content=json.dumps([{'id': 1, 'kuntakoodi': '001'}, {'id': 2, 'kuntakoodi': '002'}]).encode('utf-8'))
+        if url.endswith('/palvelutarjous'):
+            return StreamingResponse(self.offer_count, self.channel_count)
+        if '/palvelukanava/' in url:
+            channel_id = int(url.rsplit('/', 1)[1])
+            return MagicMock(content=json.dumps({'id': channel_id, 'ptvId': None, 'nimi': {'fi': 'Kanava'},
+                                                 'kuvaus': {'fi': 'Kuvaus ' * 20, 'sv': 'Beskrivning ' * 20},
+                                                 # Not stored, only the raw channel has it
+                                                 'lisatiedot': 'Lisätietoa ' * 40}).encode('utf-8'))
+        raise Exception("Unexpected url {}".format(url))
+
+
+class StreamingImportTest(unittest.TestCase):
+
+    @patch('ytr_service_data_importer.ytr_importer.STORE_BATCH_SIZE', 100)
+    @patch('ytr_service_data_importer.ytr_importer.SERVICE_BATCH_SIZE', 50)
+    def _import(self, offer_count: int, channel_count: int = 10) -> tuple:
+        mongo_client = MagicMock()
+        mongo_client.service_db = FakeDatabase()
+        importer = YTRImporter(mongo_client, FakeSession(offer_count, channel_count))
+        # Garbage left by earlier tests would be collected at different points of the runs
+        gc.collect()
+        tracemalloc.start()
+        try:
+            importer.import_ytr_data()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return mongo_client.service_db, peak
+
+    def test_services_are_stored_in_batches(self):
+        service_db, _ = self._import(250)
+        self.assertEqual(service_db.ytr_services.inserted, 250)
+        self.assertEqual(service_db.ytr_services.insert_calls, 3)
+        self.assertEqual(service_db.ytr_channels.inserted, 10)
+
+    def test_peak_memory_stays_flat(self):
+        # The same channels for every input size, only the services grow
+        _, small_peak = self._import(400)
+        _, large_peak = self._import(1600)
+        # Four times the input must not mean four times the memory
+        self.assertLess(large_peak, small_peak * 1.5)
+
+    def test_peak_memory_grows_with_the_channels_only(self):
+        # Every distinct channel is kept until the channels are written, and nothing else grows
+        service_db, small_peak = self._import(400, 200)
+        self.assertEqual(service_db.ytr_channels.inserted, 200)
+        _, large_peak = self._import(1600, 800)
+        self.assertLess(large_peak - small_peak, 600 * CHANNEL_BYTES_CEILING)
+
+if __name__ == '__main__':
+    unittest.main()
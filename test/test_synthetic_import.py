@@ -0,0 +1,185 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import io
+import unittest
+from contextlib import redirect_stdout
+from datetime import timedelta
+from unittest.mock import patch
+from pymongo.errors import OperationFailure
+from benchmark.datagen import SyntheticCatalogue
+from ytr_service_data_importer.ytr_importer import YTRImporter
+from ytr_service_data_importer.http_transport import create_api_session
+from ytr_service_data_importer.timestamps import parse_ytr_timestamp
+from ytr_service_data_importer.indexes import INDEX_SPEC, get_missing_indexes
+from test.stub_server import StubYTRServer
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class SyntheticImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue = SyntheticCatalogue(200, seed=7)
+        self.mongo_client = mongomock.MongoClient()
+        self.catalogue.load_ptv(self.mongo_client.service_db)
+
+    def test_generator_is_deterministic(self):
+        other = SyntheticCatalogue(200, seed=7)
+        self.assertEqual(other.service_offers, self.catalogue.service_offers)
+        self.assertEqual(other.ptv_channels, self.catalogue.ptv_channels)
+        self.assertNotEqual(SyntheticCatalogue(200, seed=8).service_offers, self.catalogue.service_offers)
+
+    def test_full_then_sync_import(self):
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                redirect_stdout(io.StringIO()):
+            importer = YTRImporter(self.mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4)
+            importer.import_ytr_data(mode='full')
+            importer.import_ytr_data(mode='sync')
+        service_db = self.mongo_client.service_db
+        service_count = service_db.ytr_services.count_documents({})
+        self.assertGreater(service_count, 100)
+        self.assertLessEqual(service_count, 200)
+        self.assertGreater(service_db.ytr_channels.count_documents({}), 0)
+        # Every channel belongs to a stored service
+        service_ids = set(ser['id'] for ser in service_db.ytr_services.find({}))
+        for channel in service_db.ytr_channels.find({}):
+            self.assertTrue(set(channel['serviceIds']) <= service_ids)
+        # Nothing changed in between
+        self.assertEqual(importer.sync_counts['ytr_services']['unchanged'], service_count)
+        for collection in ('ytr_services', 'ytr_channels'):
+            counts = importer.sync_counts[collection]
+            self.assertEqual(counts['updated'] + counts['inserted'] + counts['deleted'], 0)
+        # The swapped in collections and the PTV collections have their indexes
+        for collection, fields in INDEX_SPEC.items():
+            self.assertEqual(get_missing_indexes(getattr(service_db, collection), fields), [], collection)
+
+    def test_threaded_pipeline_gives_the_same_import(self):
+        imported = []
+        for queue_size, parse_workers in ((0, 1), (2, 2)):
+            mongo_client = mongomock.MongoClient()
+            self.catalogue.load_ptv(mongo_client.service_db)
+            with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                    patch('ytr_service_data_importer.ytr_importer.PIPELINE_QUEUE_SIZE', queue_size), \
+                    patch('ytr_service_data_importer.ytr_importer.SERVICE_BATCH_SIZE', 50), \
+                    patch('ytr_service_data_importer.ytr_importer.PARSE_PARALLEL_MIN_ITEMS', 10), redirect_stdout(io.StringIO()):
+                importer = YTRImporter(mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4, parse_workers=parse_workers)
+                importer.import_ytr_data(mode='full')
+            service_db = mongo_client.service_db
+            imported.append([sorted(getattr(service_db, collection).find({}, {'_id': False}), key=lambda document: document['id'])
+                             for collection in ('ytr_services', 'ytr_channels')])
+            self.assertEqual(importer.metrics.summary()['pipeline']['parse']['items'], 4)
+        self.assertEqual(imported[1], imported[0])
+
+    def test_incremental_import_after_full_import(self):
+        service_db = self.mongo_client.service_db
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                redirect_stdout(io.StringIO()):
+            importer = YTRImporter(self.mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4)
+            importer.import_ytr_data(mode='full')
+        newest_offer = max(parse_ytr_timestamp(offer['muutettu']) for offer in self.catalogue.service_offers)
+        self.assertEqual(importer.get_high_water_mark(), newest_offer)
+        # PTV matched services store the PTV lastUpdated, here newer than any YTR edit
+        newest_stored = service_db.ytr_services.find_one({'ptvId': {'$ne': None}}, sort=[('lastUpdated', -1)])['lastUpdated']
+        self.assertGreater(newest_stored, newest_offer)
+
+        # An offer of a YTR original service is edited after the full import
+        edited_id = service_db.ytr_services.find_one({'ptvId': None})['id']
+        edited_offer = next(offer for offer in self.catalogue.service_offers if str(offer['id']) == edited_id)
+        edited_at = newest_offer + timedelta(minutes=1)
+        self.assertLess(edited_at, newest_stored)
+        edited_offer['nimi'] = {'fi': 'Muutettu palvelu', 'sv': 'Ändrad tjänst'}
+        edited_offer['muutettu'] = edited_at.strftime("%Y-%m-%dT%H:%M.%S.") + "{:03d}Z".format(edited_at.microsecond // 1000)
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                redirect_stdout(io.StringIO()):
+            importer.import_ytr_data(mode='incremental')
+        summary = importer.metrics.summary(mode='incremental')
+        self.assertEqual(summary['counters']['offers_read'], 1)
+        self.assertEqual(service_db.ytr_services.find_one({'id': edited_id})['name']['fi'], 'Muutettu palvelu')
+        self.assertEqual(importer.get_high_water_mark(), edited_at)
+
+    def test_full_import_without_rename_refills_in_place(self):
+        service_db = self.mongo_client.service_db
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                redirect_stdout(io.StringIO()):
+            YTRImporter(self.mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4).import_ytr_data(mode='full')
+        stored_count = service_db.ytr_services.count_documents({})
+        # One offer is gone and one is renamed before the next full import
+        removed_offer = self.catalogue.service_offers.pop(0)
+        edited_id = service_db.ytr_services.find_one({'ptvId': None, 'id': {'$ne': str(removed_offer['id'])}})['id']
+        next(offer for offer in self.catalogue.service_offers if str(offer['id']) == edited_id)['nimi'] = {'fi': 'Muutettu palvelu'}
+        fresh_client = mongomock.MongoClient()
+        self.catalogue.load_ptv(fresh_client.service_db)
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                patch.object(mongomock.collection.Collection, 'rename', side_effect=OperationFailure("renameCollection is not supported")), \
+                redirect_stdout(io.StringIO()):
+            importer = YTRImporter(self.mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4)
+            importer.import_ytr_data(mode='full')
+            YTRImporter(fresh_client, create_api_session(4, 0, 0.0), fetch_concurrency=4).import_ytr_data(mode='full')
+        for collection in ('ytr_services', 'ytr_channels'):
+            self.assertEqual(sorted(getattr(service_db, collection).find({}, {'_id': False}), key=lambda document: document['id']),
+                             sorted(getattr(fresh_client.service_db, collection).find({}, {'_id': False}), key=lambda document: document['id']),
+                             collection)
+            self.assertNotIn(collection + '_staging', service_db.list_collection_names())
+        self.assertEqual(service_db.ytr_services.count_documents({}), stored_count - 1)
+        # Only the edited service was written again, the removed one deleted
+        self.assertLess(importer.metrics.summary()['counters']['swap_fallback_writes'], 20)
+
+    def _channel_references(self, service_db) -> dict:
+        # PTV id, or YTR id of a channel PTV does not know -> referring services
+        references = {}
+        for channel in service_db.ytr_channels.find({}, {'_id': False}):
+            key = channel['ptvId'] if channel.get('ptvId') is not None else ('ytr', channel['id'])
+            self.assertNotIn(key, references)
+            references[key] = sorted(channel['serviceIds'])
+        return(references)
+
+    def test_partial_incremental_import_matches_full_import(self):
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                redirect_stdout(io.StringIO()):
+            importer = YTRImporter(self.mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4)
+            importer.import_ytr_data(mode='full')
+        # Every 2nd offer changes, so the channels they share with unchanged offers are stored already
+        edited_at = importer.get_high_water_mark() + timedelta(minutes=1)
+        for offer in self.catalogue.service_offers[::2]:
+            offer['muutettu'] = edited_at.strftime("%Y-%m-%dT%H:%M.%S.") + "{:03d}Z".format(edited_at.microsecond // 1000)
+        fresh_client = mongomock.MongoClient()
+        self.catalogue.load_ptv(fresh_client.service_db)
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                redirect_stdout(io.StringIO()):
+            importer.import_ytr_data(mode='incremental')
+            self.assertEqual(importer.metrics.summary()['counters']['offers_read'], 100)
+            YTRImporter(fresh_client, create_api_session(4, 0, 0.0), fetch_concurrency=4).import_ytr_data(mode='full')
+        service_db = self.mongo_client.service_db
+        self.assertEqual(set(service['id'] for service in service_db.ytr_services.find({})),
+                         set(service['id'] for service in fresh_client.service_db.ytr_services.find({})))
+        self.assertEqual(self._channel_references(service_db), self._channel_references(fresh_client.service_db))
+        self.assertEqual(service_db.ytr_channels.count_documents({}), fresh_client.service_db.ytr_channels.count_documents({}))
+
+    def test_ptv_matched_documents_are_stored_unchanged(self):
+        # Fields the importer does not read itself are kept as well
+        for document in self.catalogue.ptv_services + self.catalogue.ptv_channels:
+            document['statutoryDescription'] = {'fi': 'Lakisääteinen', 'sv': None}
+        self.catalogue.load_ptv(self.mongo_client.service_db)
+        with StubYTRServer(self.catalogue.routes()) as server, patch('ytr_service_data_importer.ytr_importer.API', server.api_url), \
+                redirect_stdout(io.StringIO()):
+            importer = YTRImporter(self.mongo_client, create_api_session(4, 0, 0.0), fetch_concurrency=4)
+            importer.import_ytr_data(mode='full')
+        service_db = self.mongo_client.service_db
+        # Fields the import sets on a matched document, the rest comes from PTV as it is
+        for collection, ptv_documents, import_fields in (('ytr_services', self.catalogue.ptv_services, ('id', 'organizations', 'channelIds')),
+                                                         ('ytr_channels', self.catalogue.ptv_channels, ('id', 'organizationId', 'serviceIds'))):
+            ptv_by_id = {document['id']: document for document in ptv_documents}
+            # YTR originals can refer to PTV too, e.g. the channels of a service that PTV does not know
+            matched = [stored for stored in getattr(service_db, collection).find({'ptvId': {'$in': list(ptv_by_id)}}, {'_id': False, 'contentHash': False})
+                       if stored['name'] == ptv_by_id[stored['ptvId']]['name']]
+            self.assertGreater(len(matched), 0, collection)
+            for stored in matched:
+                expected = dict(ptv_by_id[stored['ptvId']], ptvId=stored['ptvId'])
+                for field in import_fields:
+                    expected[field] = stored[field]
+                self.assertEqual(stored, expected, collection)
+
+if __name__ == '__main__':
+    unittest.main()
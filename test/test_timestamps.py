@@ -0,0 +1,28 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import unittest
+from datetime import datetime
+from ytr_service_data_importer.timestamps import parse_ytr_timestamp, YTR_TIMESTAMP_FORMAT
+
+class TimestampTest(unittest.TestCase):
+
+    def test_same_result_as_strptime(self):
+        for value in ("2021-08-06T13:45.07.123Z", "2020-02-29T00:00.00.0Z", "1999-12-31T23:59.59.999999Z",
+                      "2021-08-06T13:45.07.12Z", "2021-8-6T3:5.7.12Z"):
+            self.assertEqual(parse_ytr_timestamp(value), datetime.strptime(value, YTR_TIMESTAMP_FORMAT), value)
+
+    def test_malformed_timestamps(self):
+        for value in ("", "2021-08-06", "2021-08-06T13:45:07.123Z", "2021-08-06T13:45.07.123", "2021-13-06T13:45.07.123Z",
+                      "2021-02-30T13:45.07.123Z", "2021-08-06T13:45.07.1234567Z", "2021-08-06T13:45.07.12aZ"):
+            with self.assertRaises(ValueError) as context:
+                parse_ytr_timestamp(value)
+            self.assertIn("Malformed YTR timestamp", str(context.exception))
+
+    def test_repeated_timestamps_are_cached(self):
+        parse_ytr_timestamp.cache_clear()
+        for _ in range(3):
+            parse_ytr_timestamp("2021-08-06T13:45.07.123Z")
+        self.assertEqual(parse_ytr_timestamp.cache_info().hits, 2)
+
+if __name__ == '__main__':
+    unittest.main()
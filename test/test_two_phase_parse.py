@@ -0,0 +1,40 @@
+import sys
+sys.path.append('ytr_service_data_import')
+import unittest
+from benchmark.bench_parse import per_language_parse_service, per_language_parse_channel, encode
+from benchmark.bench_joins import make_importer
+from benchmark.datagen import SyntheticCatalogue
+
+class TwoPhaseParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue = SyntheticCatalogue(300, seed=11)
+        # Documents off the generator's usual shapes
+        channels = self.catalogue.channels
+        channels[0]['yhteystiedot'].append({'yhteystietotyyppi': {'id': 1}, 'arvo': None})
+        channels[1].pop('yhteystiedot')
+        channels[2]['osoite'] = {'kunta': 20}
+        channels[3].pop('nimi')
+        offers = self.catalogue.service_offers
+        offers[0]['kuntasaatavuudet'].append({'kunta': 999})
+        offers[1].pop('kuvaus')
+        offers[2]['kohderyhmat'] = []
+        self.importer = make_importer(self.catalogue)
+
+    def test_services_match_the_per_language_parse(self):
+        offers = self.catalogue.service_offers
+        self.assertEqual(encode([self.importer._parse_service_info(offer) for offer in offers]),
+                         encode([per_language_parse_service(self.importer, offer) for offer in offers]))
+
+    def test_channels_match_the_per_language_parse(self):
+        channels = self.catalogue.channels
+        self.assertEqual(encode([self.importer._parse_channel_info(channel) for channel in channels]),
+                         encode([per_language_parse_channel(self.importer, channel) for channel in channels]))
+
+    def test_unknown_target_group(self):
+        offer = dict(self.catalogue.service_offers[0], kohderyhmat=[{'koodi': 'KR-9', 'nimi': {'fi': 'Muut'}}])
+        with self.assertRaises(Exception):
+            self.importer._parse_service_info(offer)
+
+if __name__ == '__main__':
+    unittest.main()
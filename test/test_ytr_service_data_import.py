@@ -2,9 +2,12 @@ import os
 import sys
 sys.path.append('ytr_service_data_import')
 import json
+import tempfile
 import unittest
 from datetime import datetime
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, call, patch
+from pymongo import DESCENDING, ReplaceOne
+from pymongo.errors import OperationFailure
 from ytr_service_data_importer.ytr_importer import YTRImporter
 
 class YTRServiceDataImporterTest(unittest.TestCase):
@@ -232,15 +235,7 @@ class YTRServiceDataImporterTest(unittest.TestCase):
         "addresses":{"en":[],"fi":[],"sv":[]},
         "areas":{"en":[],"fi":[],"sv":[]},
         "lastUpdated":datetime.strptime("2021-08-06T08:26:31.495Z", "%Y-%m-%dT%H:%M:%S.%fZ")}]
-        self.ptv_channels_response1 = self.ptv_channels_response[0:2]
-        self.ptv_channels_response2 = self.ptv_channels_response[0:2]
-        self.ptv_channels_response3 = self.ptv_channels_response[1:3]
-        self.ptv_channels_response4 = self.ptv_channels_response[1:3]
-        self.ptv_channels_response5 = []
-        self.ptv_channels_response6 = []
-        self.ptv_channels_response7 = []
-        self.ptv_channels_response8 = []
-        self.mongo_response = [{'_id': None,'max': 1000 * datetime.strptime('2020-12-11T08:02.57.083Z', "%Y-%m-%dT%H:%M.%S.%fZ").timestamp()}]
+        self.mongo_response = [{'lastUpdated': 1000 * datetime.strptime('2020-12-11T08:02.57.083Z', "%Y-%m-%dT%H:%M.%S.%fZ").timestamp()}]
 
         # PTV municipalities
         self.mongo_client_instance = MagicMock()
@@ -256,12 +251,14 @@ class YTRServiceDataImporterTest(unittest.TestCase):
         # PTV channels
         self.mongo_client_instance.service_db.channels = MagicMock()
         self.mongo_client_instance.service_db.channels.find = MagicMock()
-        self.mongo_client_instance.service_db.channels.find.side_effect = [self.ptv_channels_response1, self.ptv_channels_response2, self.ptv_channels_response3, self.ptv_channels_response4, self.ptv_channels_response5, self.ptv_channels_response6, self.ptv_channels_response7, self.ptv_channels_response8]
+        self.mongo_client_instance.service_db.channels.find.side_effect = self._find_ptv_channels
+
+        # High-water mark of the last import
+        self.mongo_client_instance.service_db.ytr_import_state.find_one.return_value = {'_id': 'ytr_services', 'highWaterMark': datetime(2020, 12, 11, 8, 2, 57, 83000)}
 
         # Current YTR services
         self.mongo_client_instance.service_db.ytr_services = MagicMock()
-        self.mongo_client_instance.service_db.ytr_services.aggregate = MagicMock()
-        self.mongo_client_instance.service_db.ytr_services.aggregate.return_value = self.mongo_response
+        self.mongo_client_instance.service_db.ytr_services.find.return_value.sort.return_value.limit.return_value = self.mongo_response
 
         # YTR requests
         self.api_session_instance = MagicMock()
@@ -269,28 +266,51 @@ class YTRServiceDataImporterTest(unittest.TestCase):
         get_mock_0 = MagicMock()
         get_mock_0.json = MagicMock()
         get_mock_0.json.return_value = self.municipalities_response
+        get_mock_0.content = json.dumps(self.municipalities_response).encode('utf-8')
         get_mock_1 = MagicMock()
         get_mock_1.json = MagicMock()
         get_mock_1.json.return_value = self.service_offers_response
+        get_mock_1.content = json.dumps(self.service_offers_response).encode('utf-8')
+        get_mock_1.iter_content = MagicMock()
+        get_mock_1.iter_content.side_effect = lambda chunk_size=1: iter([json.dumps(self.service_offers_response).encode('utf-8')])
         get_mock_2 = MagicMock()
         get_mock_2.json = MagicMock()
         get_mock_2.json.return_value = self.channels_response1
+        get_mock_2.content = json.dumps(self.channels_response1).encode('utf-8')
         get_mock_3 = MagicMock()
         get_mock_3.json = MagicMock()
         get_mock_3.json.return_value = self.channels_response2
-        get_mock_4 = MagicMock()
-        get_mock_4.json = MagicMock()
-        get_mock_4.json.return_value = self.channels_response3
+        get_mock_3.content = json.dumps(self.channels_response2).encode('utf-8')
         get_mock_5 = MagicMock()
         get_mock_5.json = MagicMock()
         get_mock_5.json.return_value = self.channels_response4
-        self.api_session_instance.get.side_effect = [get_mock_0, get_mock_1, get_mock_2, get_mock_3, get_mock_4, get_mock_5]
+        get_mock_5.content = json.dumps(self.channels_response4).encode('utf-8')
+        self.api_responses = {'/kunta': get_mock_0,
+                              '/palvelutarjous': get_mock_1,
+                              '/palvelukanava/123': get_mock_2,
+                              '/palvelukanava/124': get_mock_3,
+                              '/palvelukanava/125': get_mock_5}
+        self.api_session_instance.get.side_effect = lambda url, **kwargs: self.api_responses[url.split('/api/v1')[1]]
         
         self.ytr_importer = YTRImporter(self.mongo_client_instance, self.api_session_instance)
 
+    def _find_ptv_channels(self, query: dict, projection: dict = None, **kwargs) -> list:
+        if 'serviceIds' in query:
+            service_ids = query['serviceIds']['$in']
+            return [cha for cha in self.ptv_channels_response if any(ser_id in service_ids for ser_id in cha['serviceIds'])]
+        return [cha for cha in self.ptv_channels_response if cha['id'] in query['id']['$in']]
+
     def test_latest_update_time(self):
         lu_time = self.ytr_importer.get_latest_update_time_from_mongo('ytr_services')
         self.assertEqual(lu_time, datetime(2020, 12, 11, 8, 2, 57, 83000))
+        self.mongo_client_instance.service_db.ytr_services.find.assert_called_with({}, {'_id': False, 'lastUpdated': True})
+        self.mongo_client_instance.service_db.ytr_services.find.return_value.sort.assert_called_with('lastUpdated', DESCENDING)
+        self.mongo_client_instance.service_db.ytr_services.find.return_value.sort.return_value.limit.assert_called_with(1)
+        self.mongo_client_instance.service_db.ytr_services.find.return_value.sort.return_value.limit.return_value = [{'lastUpdated': datetime(2020, 12, 12)}]
+        lu_time = self.ytr_importer.get_latest_update_time_from_mongo('ytr_services')
+        self.assertEqual(lu_time, datetime(2020, 12, 12))
+        self.mongo_client_instance.service_db.ytr_services.find.return_value.sort.return_value.limit.return_value = []
+        self.assertIsNone(self.ytr_importer.get_latest_update_time_from_mongo('ytr_services'))
 
     def test_parse_municipality_map(self):
         self.setUp()
@@ -298,6 +318,24 @@ class YTRServiceDataImporterTest(unittest.TestCase):
         self.ytr_importer.municipality_map = self.ytr_importer._parse_municipality_map(municipalities)
         self.assertEqual(self.ytr_importer.municipality_map.get(2), '002')        
         
+    def test_ptv_municipalities_are_loaded_on_first_use(self):
+        self.assertFalse(self.mongo_client_instance.service_db.municipalities.find.called)
+        self.assertIn('002', self.ytr_importer.ptv_municipality_codes)
+        self.assertIn('002', self.ytr_importer.ptv_municipality_names)
+        self.mongo_client_instance.service_db.municipalities.find.assert_called_once()
+        projection = self.mongo_client_instance.service_db.municipalities.find.call_args[0][1]
+        self.assertEqual(projection, {'_id': False, 'id': True, 'name': True})
+
+    def test_municipality_index(self):
+        self.setUp()
+        self.assertEqual(self.ytr_importer.ptv_municipality_codes, frozenset(['001', '002', '003']))
+        self.assertEqual(self.ytr_importer.ptv_municipality_names['002']['sv'], 'Nådendal')
+        self.ytr_importer.municipality_map = {1: '001', 4: '999'}
+        service = dict(self.service_offers_response[0], kuntasaatavuudet=[{'kunta': 1}, {'kunta': 4}])
+        service_parsed = self.ytr_importer._parse_service_info(service)
+        self.assertEqual([area['name'] for area in service_parsed['areas']['sv']], ['Åbo', None])
+        self.assertTrue(self.ytr_importer._is_suitable_service(service_parsed))
+
     def test_parse_service_info(self):
         self.setUp()
         municipalities = self.ytr_importer.get_municipalities()
@@ -443,11 +481,195 @@ class YTRServiceDataImporterTest(unittest.TestCase):
         self.assertEqual(len(ptv_unrecognized_channels), 0)
         self.assertEqual(len(known_channels), 0)
 
+    def test_split_channels_order(self):
+        self.setUp()
+        channels = [{'id': '1', 'ptvId': '113', 'organizationId': '78', 'serviceIds': []},
+                    {'id': '2', 'ptvId': None, 'organizationId': '78', 'serviceIds': []},
+                    {'id': '3', 'ptvId': '113', 'organizationId': '78', 'serviceIds': []},
+                    {'id': '4', 'ptvId': '112', 'organizationId': '78', 'serviceIds': []}]
+        old_channels = [{'id': '0', 'ptvId': '112'}]
+        ptv_channels = self.ptv_channels_response + [self.ptv_channels_response[0]]
+        new_channels, ptv_unrecognized_channels, known_channels = self.ytr_importer._split_channels(channels, old_channels, ptv_channels)
+        self.assertEqual([(cha['id'], cha['ptvId']) for cha in new_channels], [('1', '113'), ('2', None)])
+        self.assertEqual(new_channels[0]['organizationId'], '78')
+        self.assertEqual([cha['id'] for cha in known_channels], ['3', '4'])
+        self.assertEqual([(cha['id'], cha['ptvId'], cha['organizationId']) for cha in ptv_unrecognized_channels], [('114', '114', None)])
+
+    def test_split_channels_links_earlier_ptv_channels(self):
+        self.setUp()
+        channels = [{'id': '1', 'ptvId': '113', 'organizationId': '78', 'serviceIds': []}]
+        old_channels = [{'id': '0', 'ptvId': '114'}]
+        new_channels, ptv_unrecognized_channels, known_channels = self.ytr_importer._split_channels(channels, old_channels, self.ptv_channels_response)
+        self.assertEqual([(cha['id'], cha['ptvId']) for cha in new_channels], [('1', '113')])
+        self.assertEqual([(cha['id'], cha['ptvId']) for cha in ptv_unrecognized_channels], [('112', '112')])
+        # A PTV channel of the service that an earlier service brought in gets the reference too
+        self.assertEqual([(cha['id'], cha['ptvId']) for cha in known_channels], [('114', '114')])
+
     def test_import_ytr_data(self):
         self.setUp()
         all_services, all_channels = self.ytr_importer._get_new_services_and_channels()
         self.assertEqual(len(all_services), 4)
         self.assertEqual(len(all_channels), 4)
+        self.assertEqual([(cha['id'], cha['ptvId'], cha['serviceIds']) for cha in all_channels],
+                         [('123', '112', ['1']), ('124', '113', ['1', '2']), ('114', '114', ['2']), ('125', None, ['3'])])
+
+    def test_parallel_parse(self):
+        self.setUp()
+        serial_services, serial_channels = self.ytr_importer._get_new_services_and_channels()
+        self.setUp()
+        importer = YTRImporter(self.mongo_client_instance, self.api_session_instance, parse_workers=2)
+        with patch('ytr_service_data_importer.ytr_importer.PARSE_PARALLEL_MIN_ITEMS', 1), \
+                patch('ytr_service_data_importer.ytr_importer.PARSE_CHUNK_SIZE', 2):
+            parallel_services, parallel_channels = importer._get_new_services_and_channels()
+        self.assertEqual(parallel_services, serial_services)
+        self.assertEqual(parallel_channels, serial_channels)
+        self.assertIsNone(importer.parser)
+
+    def test_batched_ptv_channel_lookups(self):
+        self.setUp()
+        self.ytr_importer._get_new_services_and_channels()
+        queries = [call.args[0] for call in self.mongo_client_instance.service_db.channels.find.call_args_list]
+        self.assertEqual(queries, [{'serviceIds': {'$in': ['102', '103']}}, {'id': {'$in': ['112', '113']}}])
+        self.assertEqual(self.ptv_channels_response[2]['serviceIds'], ['103'])
+
+    def test_incremental_import(self):
+        self.setUp()
+        # Offer 2 has not changed since the last import and offer 9 is gone from YTR
+        self.service_offers_response[1]['muutettu'] = '2020-12-01T08:02.57.083Z'
+        self.mongo_client_instance.service_db.ytr_services.find.return_value = [{'id': '1'}, {'id': '2'}, {'id': '9'}]
+        self.mongo_client_instance.service_db.ytr_channels.delete_many.return_value = MagicMock(deleted_count=0)
+        self.ytr_importer.import_ytr_data(mode='incremental')
+
+        ytr_services = self.mongo_client_instance.service_db.ytr_services
+        upserted = [operation._filter['id'] for operation in ytr_services.bulk_write.call_args.args[0]]
+        self.assertEqual(upserted, ['1', '3', '4'])
+        ytr_services.delete_many.assert_called_once()
+        self.assertEqual(sorted(ytr_services.delete_many.call_args.args[0]['id']['$in']), ['5', '9'])
+        ytr_services.insert_many.assert_not_called()
+
+        ytr_channels = self.mongo_client_instance.service_db.ytr_channels
+        pulled = ytr_channels.update_many.call_args.args[0]['serviceIds']['$in']
+        self.assertEqual(sorted(pulled), ['1', '3', '4', '5', '9'])
+        upserted_channels = [operation._filter['id'] for operation in ytr_channels.bulk_write.call_args.args[0]]
+        self.assertEqual(upserted_channels, ['123', '124', '125'])
+        # The mark moves to the newest 'muutettu' of the offers, not to a PTV lastUpdated
+        self.mongo_client_instance.service_db.ytr_import_state.update_one.assert_called_once_with(
+            {'_id': 'ytr_services'}, {'$max': {'highWaterMark': datetime(2020, 12, 13, 8, 2, 57, 83000)}}, upsert=True)
+
+    def test_incremental_import_falls_back_to_full(self):
+        self.setUp()
+        self.mongo_client_instance.service_db.ytr_import_state.find_one.return_value = None
+        self.ytr_importer.import_ytr_data(mode='incremental')
+        self.mongo_client_instance.service_db.ytr_services_staging.insert_many.assert_called_once()
+        self.mongo_client_instance.service_db.ytr_services_staging.rename.assert_called_once_with('ytr_services', dropTarget=True)
+
+    def test_full_import_swaps_staging_collections(self):
+        self.setUp()
+        self.ytr_importer.import_ytr_data(mode='full')
+        service_db = self.mongo_client_instance.service_db
+        self.assertEqual(len(service_db.ytr_services_staging.insert_many.call_args.args[0]), 4)
+        self.assertEqual(service_db.ytr_services_staging.insert_many.call_args.kwargs, {'ordered': False})
+        self.assertEqual(len(service_db.ytr_channels_staging.insert_many.call_args.args[0]), 4)
+        service_db.ytr_services_staging.rename.assert_called_once_with('ytr_services', dropTarget=True)
+        service_db.ytr_channels_staging.rename.assert_called_once_with('ytr_channels', dropTarget=True)
+        service_db.ytr_services.delete_many.assert_not_called()
+        service_db.ytr_services.insert_many.assert_not_called()
+
+    def test_full_import_without_rename_replaces_documents(self):
+        self.setUp()
+        service_db = self.mongo_client_instance.service_db
+        service_db.ytr_services_staging.rename.side_effect = OperationFailure("renameCollection is not supported")
+        service_db.ytr_services_staging.find.return_value = [{'id': '1', 'contentHash': 'a'}, {'id': '2', 'contentHash': 'b'}]
+        service_db.ytr_services.find.return_value = [{'id': '1', 'contentHash': 'a'}, {'id': '2', 'contentHash': 'c'}, {'id': '9', 'contentHash': 'd'}]
+        service_db.ytr_channels_staging.find.return_value = [{'id': '123'}]
+        service_db.ytr_channels.find.return_value = []
+        self.ytr_importer.import_ytr_data(mode='full')
+        # The channels are not renamed either once a rename was refused, both collections come from this run
+        service_db.ytr_channels_staging.rename.assert_not_called()
+        # The live documents are replaced in place, unchanged ones are left alone
+        for collection, documents in (('ytr_services', [{'id': '2', 'contentHash': 'b'}]), ('ytr_channels', [{'id': '123'}])):
+            getattr(service_db, collection).bulk_write.assert_called_once_with(
+                [ReplaceOne({'id': document['id']}, document, upsert=True) for document in documents], ordered=False)
+            self.assertNotIn(call({}), getattr(service_db, collection).delete_many.call_args_list)
+            getattr(service_db, collection).insert_many.assert_not_called()
+            getattr(service_db, collection + '_staging').drop.assert_called()
+        service_db.ytr_services.delete_many.assert_called_once_with({'id': {"$in": ['9']}})
+        service_db.ytr_channels.delete_many.assert_not_called()
+        self.assertEqual(self.ytr_importer.metrics.summary()['counters']['swap_fallback_writes'], 3)
+        self.assertEqual(self.ytr_importer.metrics.summary()['counters']['swap_fallbacks'], 2)
+        # The high-water mark is stored after the fallback too
+        service_db.ytr_import_state.update_one.assert_called_once()
+
+    def test_failed_channel_rename_replaces_channels(self):
+        self.setUp()
+        service_db = self.mongo_client_instance.service_db
+        service_db.ytr_channels_staging.rename.side_effect = OperationFailure("rename failed")
+        service_db.ytr_channels_staging.find.return_value = [{'id': '123'}]
+        service_db.ytr_channels.find.return_value = [{'id': '124'}]
+        self.ytr_importer.import_ytr_data(mode='full')
+        service_db.ytr_services_staging.rename.assert_called_once_with('ytr_services', dropTarget=True)
+        service_db.ytr_services.bulk_write.assert_not_called()
+        service_db.ytr_channels.bulk_write.assert_called_once_with([ReplaceOne({'id': '123'}, {'id': '123'}, upsert=True)], ordered=False)
+        service_db.ytr_channels.delete_many.assert_called_once_with({'id': {"$in": ['124']}})
+
+    def test_import_metrics(self):
+        self.setUp()
+        with tempfile.TemporaryDirectory() as directory:
+            metrics_file = os.path.join(directory, 'metrics.json')
+            with patch('ytr_service_data_importer.ytr_importer.METRICS_FILE', metrics_file):
+                self.ytr_importer.import_ytr_data(mode='full')
+            with open(metrics_file) as metrics:
+                summary = json.load(metrics)
+        self.assertEqual((summary['mode'], summary['status']), ('full', 'ok'))
+        self.assertEqual(summary['counters']['offers_read'], 5)
+        self.assertEqual(summary['counters']['services_stored'], 4)
+        self.assertEqual(summary['counters']['channels_stored'], 4)
+        for stage in ('fetch_municipalities', 'read_offers', 'parse_services', 'ptv_service_lookup', 'split_services',
+                      'fetch_channels', 'ptv_channel_lookup', 'join_channels', 'mongo_insert', 'swap_collections'):
+            self.assertIn(stage, summary['stages'])
+        self.assertEqual(summary['http']['/palvelukanava/{id}']['requests'], 3)
+        self.assertGreater(summary['http']['/palvelutarjous']['bytes'], 0)
+        self.assertEqual(set(summary['pipeline']), {'fetch', 'parse', 'channels', 'write'})
+        self.assertEqual(summary['pipeline']['parse']['items'], 1)
+        self.assertTrue(all(0.0 <= entry['utilisation'] <= 1.0 for entry in summary['pipeline'].values()))
+
+    def test_full_import_keeps_old_data_on_empty_response(self):
+        self.setUp()
+        self.service_offers_response.clear()
+        self.ytr_importer.import_ytr_data(mode='full')
+        service_db = self.mongo_client_instance.service_db
+        service_db.ytr_services_staging.rename.assert_not_called()
+        service_db.ytr_channels_staging.rename.assert_not_called()
+        service_db.ytr_services_staging.drop.assert_called()
+
+    def test_sync_import(self):
+        self.setUp()
+        self.ytr_importer.import_ytr_data(mode='full')
+        service_db = self.mongo_client_instance.service_db
+        stored_services = [{'id': ser['id'], 'contentHash': ser['contentHash']} for ser in service_db.ytr_services_staging.insert_many.call_args.args[0]]
+        stored_channels = [{'id': cha['id'], 'contentHash': cha['contentHash']} for cha in service_db.ytr_channels_staging.insert_many.call_args.args[0]]
+        # Service 3 has changed, service 4 is new and service 9 is gone
+        stored_services[2]['contentHash'] = 'outdated'
+        stored_services[3]['id'] = '9'
+        service_db.ytr_services.find.return_value = stored_services
+        service_db.ytr_channels.find.return_value = stored_channels
+
+        self.ytr_importer.import_ytr_data(mode='sync')
+        operations = service_db.ytr_services.bulk_write.call_args.args[0]
+        self.assertEqual([(type(op).__name__, op._filter['id'] if hasattr(op, '_filter') else op._doc['id']) for op in operations],
+                         [('ReplaceOne', '3'), ('InsertOne', '4'), ('DeleteOne', '9')])
+        self.assertEqual(service_db.ytr_services.bulk_write.call_args.kwargs, {'ordered': False})
+        service_db.ytr_channels.bulk_write.assert_not_called()
+        self.assertEqual(self.ytr_importer.sync_counts['ytr_services'], {'unchanged': 2, 'updated': 1, 'inserted': 1, 'deleted': 1})
+        self.assertEqual(self.ytr_importer.sync_counts['ytr_channels'], {'unchanged': 4, 'updated': 0, 'inserted': 0, 'deleted': 0})
+
+    def test_channel_cache(self):
+        self.setUp()
+        self.ytr_importer._get_new_services_and_channels()
+        channel_urls = [call.kwargs['url'] for call in self.api_session_instance.get.call_args_list if '/palvelukanava/' in call.kwargs['url']]
+        self.assertEqual(len(channel_urls), 3)
+        self.assertEqual(self.ytr_importer.channel_cache.misses, 3)
+        self.assertEqual(self.ytr_importer.channel_cache.hits, 1)
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,6 @@
 from ytr_service_data_importer.ytr_importer import *
 
-yi = YTRImporter()
-yi.import_ytr_data()
-
+# The parse worker processes import this module again, only the script itself runs the import
+if __name__ == '__main__':
+    yi = YTRImporter()
+    yi.import_ytr_data()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Per-import cache for service channels fetched from Kompassi YTR.
+"""
+from typing import Callable, Optional
+
+
+class ChannelCache():
+    """
+    Fetches every distinct channel once and serves repeated lookups from memory.
+    The cache grows with the number of distinct channels of the import, not with the
+    number of services. With parse given only the parsed channels are kept, the raw
+    ones are dropped as soon as they are parsed.
+
+    Args
+    ----------
+    fetch : Callable
+        Function that takes a list of channel ids and returns the channels in the same order
+
+    parse : Callable ( default None )
+        Function that takes a list of fetched channels and returns them parsed in the same order
+
+    Methods
+    -------
+    prefetch(channel_ids)
+        Fetches all the given channels that are not cached yet
+
+    get_channels(channel_ids)
+        Returns the channels for the given ids, fetching the ones that are missing
+
+    """
+
+    def __init__(self, fetch: Callable, parse: Optional[Callable] = None) -> None:
+        self._fetch = fetch
+        self._parse = parse
+        self._channels = {}
+        self._served = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return(len(self._channels))
+
+    def prefetch(self, channel_ids: list) -> None:
+        missing = []
+        missing_set = set()
+        for channel_id in channel_ids:
+            if channel_id not in self._channels and channel_id not in missing_set:
+                missing.append(channel_id)
+                missing_set.add(channel_id)
+        if len(missing) > 0:
+            fetched = self._fetch(missing)
+            if self._parse is not None:
+                fetched = self._parse(fetched)
+            for channel_id, channel in zip(missing, fetched):
+                self._channels[channel_id] = channel
+            self.misses = self.misses + len(missing)
+
+    def peek_channels(self, channel_ids: list) -> list:
+        # Cached channels for the given ids without fetching or counting
+        return([self._channels[channel_id] for channel_id in channel_ids if channel_id in self._channels])
+
+    def get_channels(self, channel_ids: list) -> list:
+        self.prefetch(channel_ids)
+        channels = []
+        for channel_id in channel_ids:
+            # The first use of a channel paid for its download, the rest are hits
+            if channel_id in self._served:
+                self.hits = self.hits + 1
+            else:
+                self._served.add(channel_id)
+            channels.append(self._channels[channel_id])
+        return(channels)
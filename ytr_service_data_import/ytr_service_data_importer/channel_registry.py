@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Accumulator for the service channels collected during one YTR import.
+"""
+from typing import Optional
+
+
+class ChannelRegistry():
+    """
+    Keeps the channels of one import in insertion order and indexes them by
+    YTR id and PTV id so that known channels can be linked in constant time
+
+    Args
+    ----------
+    channels : list ( default None )
+        Channels that are already registered, they are indexed as they are
+
+    Methods
+    -------
+    add(channel, service_id)
+        Registers a new channel and optionally refers it to a service
+
+    link(channel, service_id)
+        Adds a service reference to the registered channel matching the given one
+
+    channels()
+        Returns the registered channels in insertion order
+
+    """
+
+    def __init__(self, channels: Optional[list] = None) -> None:
+        self._channels = []
+        self._by_ytr_id = {}
+        self._by_ptv_id = {}
+        if channels is not None:
+            for channel in channels:
+                self._register(channel)
+
+    def __len__(self) -> int:
+        return(len(self._channels))
+
+    def __iter__(self):
+        return(iter(self._channels))
+
+    def _register(self, channel: dict) -> None:
+        position = len(self._channels)
+        self._channels.append(channel)
+        ytr_id = channel.get('id')
+        if ytr_id is not None and ytr_id not in self._by_ytr_id:
+            self._by_ytr_id[ytr_id] = position
+        ptv_id = channel.get('ptvId')
+        if ptv_id is not None and ptv_id not in self._by_ptv_id:
+            self._by_ptv_id[ptv_id] = position
+
+    def has_ytr_id(self, ytr_id) -> bool:
+        return(ytr_id in self._by_ytr_id)
+
+    def has_ptv_id(self, ptv_id) -> bool:
+        return(ptv_id in self._by_ptv_id)
+
+    def find(self, channel: dict) -> Optional[dict]:
+        # The earliest registered channel that shares either the PTV id or the YTR id
+        positions = []
+        ptv_id = channel.get('ptvId')
+        if ptv_id is not None and ptv_id in self._by_ptv_id:
+            positions.append(self._by_ptv_id[ptv_id])
+        ytr_id = channel.get('id')
+        if ytr_id is not None and ytr_id in self._by_ytr_id:
+            positions.append(self._by_ytr_id[ytr_id])
+        if len(positions) == 0:
+            return(None)
+        return(self._channels[min(positions)])
+
+    def add(self, channel: dict, service_id: Optional[str] = None) -> dict:
+        # Own copy of the reference list so that references can be appended in place
+        channel['serviceIds'] = list(channel.get('serviceIds') or [])
+        if service_id is not None:
+            channel['serviceIds'].append(service_id)
+        self._register(channel)
+        return(channel)
+
+    def link(self, channel: dict, service_id: str) -> Optional[dict]:
+        handle = self.find(channel)
+        if handle is not None:
+            handle['serviceIds'].append(service_id)
+        return(handle)
+
+    def channels(self) -> list:
+        return(list(self._channels))
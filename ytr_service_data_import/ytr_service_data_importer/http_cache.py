@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache for Kompassi YTR responses using conditional GETs.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import requests
+
+
+class CachedResponse():
+    """
+    A stored response body that can be used like a requests.Response
+
+    Args
+    ----------
+    path : str
+        File containing the response body
+
+    url : str
+        Requested URL
+
+    from_cache : bool
+        True if the body was not transferred in this request ( i.e. the server answered 304 )
+
+    raw : urllib3.response.HTTPResponse ( default None )
+        The underlying response of the request, kept for its retry history
+
+    """
+
+    def __init__(self, path: str, url: str, from_cache: bool, raw=None) -> None:
+        self.path = path
+        self.url = url
+        self.from_cache = from_cache
+        self.raw = raw
+        self.status_code = 200
+
+    @property
+    def content(self) -> bytes:
+        with open(self.path, 'rb') as body_file:
+            return(body_file.read())
+
+    def iter_content(self, chunk_size: int = 65536):
+        with open(self.path, 'rb') as body_file:
+            while True:
+                chunk = body_file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def json(self):
+        with open(self.path, 'rb') as body_file:
+            return(json.load(body_file))
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class HTTPResponseCache():
+    """
+    Stores response bodies together with their ETag and Last-Modified validators
+    and revalidates them with If-None-Match / If-Modified-Since
+
+    Args
+    ----------
+    directory : str
+        Directory where the bodies and their metadata are stored
+
+    max_bytes : int ( default 256 MB )
+        Total size of the stored bodies, least recently used ones are evicted above it
+
+    Methods
+    -------
+    get(session, url)
+        Sends a conditional GET and returns the body from disk
+
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.body'), os.path.join(self.directory, key + '.meta')
+
+    def _read_meta(self, meta_path: str, body_path: str) -> dict:
+        if not os.path.exists(meta_path) or not os.path.exists(body_path):
+            return({})
+        try:
+            with open(meta_path, 'r') as meta_file:
+                return(json.load(meta_file))
+        except ValueError:
+            return({})
+
+    def get(self, session: requests.Session, url: str, **kwargs):
+        body_path, meta_path = self._paths(url)
+        meta = self._read_meta(meta_path, body_path)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if meta.get('etag') is not None:
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('lastModified') is not None:
+            headers['If-Modified-Since'] = meta['lastModified']
+        response = session.get(url=url, headers=headers, stream=True, **kwargs)
+
+        if response.status_code == 304 and len(meta) > 0:
+            response.close()
+            self.hits = self.hits + 1
+            # Mark as recently used for the eviction
+            os.utime(body_path)
+            return(CachedResponse(body_path, url, True, response.raw))
+
+        self.misses = self.misses + 1
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code != 200:
+            # The status is enough to raise for, the streamed body would hold the connection
+            response.close()
+            return(response)
+        if etag is None and last_modified is None:
+            # Nothing to revalidate with later, the caller reads and closes the body
+            return(response)
+
+        # The old validators must not describe the new body
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        body_file = tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False)
+        try:
+            with body_file:
+                for chunk in response.iter_content(chunk_size=65536):
+                    body_file.write(chunk)
+            os.replace(body_file.name, body_path)
+        finally:
+            response.close()
+            if os.path.exists(body_file.name):
+                os.remove(body_file.name)
+        with open(meta_path, 'w') as meta_file:
+            json.dump({'url': url, 'etag': etag, 'lastModified': last_modified, 'stored': time.time()}, meta_file)
+        self._evict(keep=body_path)
+        return(CachedResponse(body_path, url, False, response.raw))
+
+    def _evict(self, keep: str) -> None:
+        bodies = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.body'):
+                path = os.path.join(self.directory, file_name)
+                stat = os.stat(path)
+                bodies.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in bodies)
+        for _, size, path in sorted(bodies):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            meta_path = path[:-len('.body')] + '.meta'
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            total = total - size
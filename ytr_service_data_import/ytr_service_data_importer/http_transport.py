@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP session setup for Kompassi YTR with retries, pooling and request metrics.
+"""
+import re
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Statuses worth another try, Retry-After is honoured for 413, 429 and 503
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Numeric path segments ( e.g. channel ids ) are grouped under one endpoint in the metrics
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def _get_retry(max_retries: int, backoff_factor: float) -> Retry:
+    settings = {'total': max_retries,
+                'backoff_factor': backoff_factor,
+                'status_forcelist': RETRY_STATUSES,
+                'respect_retry_after_header': True,
+                # Give back the last response so that raise_for_status reports the real status
+                'raise_on_status': False}
+    try:
+        return(Retry(allowed_methods=frozenset(['GET']), **settings))
+    except TypeError:
+        # urllib3 < 1.26
+        return(Retry(method_whitelist=frozenset(['GET']), **settings))
+
+
+def create_api_session(pool_size: int, max_retries: int, backoff_factor: float) -> requests.Session:
+    """
+    Creates a session that retries failed GETs with exponential backoff
+
+    Args
+    ----------
+    pool_size : int
+        Number of connections kept alive per host, should match the fetch concurrency
+
+    max_retries : int
+        Number of retries after the first attempt
+
+    backoff_factor : float
+        Retries wait backoff_factor * 2 ** ( retry - 1 ) seconds unless the server sends Retry-After
+
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=_get_retry(max_retries, backoff_factor))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return(session)
+
+
+class RequestMetrics():
+    """
+    Collects the number of requests, retries, errors, body bytes and latency per endpoint
+
+    Methods
+    -------
+    record(endpoint, latency, retries)
+        Records one finished request
+
+    record_error(endpoint)
+        Records a request that failed for good
+
+    record_bytes(endpoint, size)
+        Records the size of a response body that was read
+
+    summary()
+        Returns the metrics as a dict keyed by endpoint
+
+    """
+
+    def __init__(self) -> None:
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints = {}
+
+    def _endpoint_key(self, endpoint: str) -> str:
+        return(_ID_SEGMENT.sub('/{id}', endpoint.split('?')[0]))
+
+    def _get_entry(self, endpoint: str) -> dict:
+        key = self._endpoint_key(endpoint)
+        if key not in self._endpoints:
+            self._endpoints[key] = {'requests': 0, 'retries': 0, 'errors': 0, 'bytes': 0, 'totalSeconds': 0.0, 'maxSeconds': 0.0}
+        return(self._endpoints[key])
+
+    def record(self, endpoint: str, latency: float, retries: int = 0) -> None:
+        with self._lock:
+            entry = self._get_entry(endpoint)
+            entry['requests'] = entry['requests'] + 1
+            entry['retries'] = entry['retries'] + retries
+            entry['totalSeconds'] = entry['totalSeconds'] + latency
+            entry['maxSeconds'] = max(entry['maxSeconds'], latency)
+
+    def record_error(self, endpoint: str) -> None:
+        with self._lock:
+            entry = self._get_entry(endpoint)
+            entry['errors'] = entry['errors'] + 1
+
+    def record_bytes(self, endpoint: str, size: int) -> None:
+        with self._lock:
+            entry = self._get_entry(endpoint)
+            entry['bytes'] = entry['bytes'] + size
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = {}
+            for key, entry in self._endpoints.items():
+                summary[key] = dict(entry)
+                summary[key]['meanSeconds'] = entry['totalSeconds'] / entry['requests'] if entry['requests'] > 0 else 0.0
+            return(summary)
+
+
+def get_retry_count(response) -> int:
+    # Number of retries urllib3 did before this response, 0 if it cannot be told
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    history = getattr(retries, 'history', None)
+    if isinstance(history, tuple):
+        return(len(history))
+    return(0)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+The indexes the importer's queries rely on and their idempotent creation.
+"""
+from pymongo import ASCENDING, IndexModel
+
+# Collection -> fields that need an ascending index of their own or as the first key of one
+INDEX_SPEC = {
+    # PTV services are looked up by id, PTV channels by id and by the services they belong to.
+    # The newest lastUpdated of both tells whether the local PTV catalogue copy is up to date.
+    'services': ('id', 'lastUpdated'),
+    'channels': ('id', 'serviceIds', 'lastUpdated'),
+    # Writes and deletes by id, the newest lastUpdated is read with a descending sort on it
+    'ytr_services': ('id', 'ptvId', 'lastUpdated'),
+    # Incremental imports also $pull and $addToSet service references by serviceIds
+    'ytr_channels': ('id', 'ptvId', 'serviceIds', 'lastUpdated'),
+}
+
+
+def get_missing_indexes(collection, fields: tuple) -> list:
+    """
+    Returns the fields that no index of the collection starts with
+
+    Args
+    ----------
+    collection : Collection
+        A pymongo collection
+
+    fields : tuple
+        Field names, e.g. INDEX_SPEC['channels']
+
+    """
+    leading_fields = set()
+    for index in collection.index_information().values():
+        keys = list(index.get('key', []))
+        if len(keys) > 0:
+            leading_fields.add(keys[0][0])
+    return([field for field in fields if field not in leading_fields])
+
+
+def ensure_indexes(collection, fields: tuple) -> list:
+    """
+    Creates the indexes that are missing from the collection and returns their fields
+
+    Args
+    ----------
+    collection : Collection
+        A pymongo collection
+
+    fields : tuple
+        Field names, e.g. INDEX_SPEC['channels']
+
+    """
+    missing = get_missing_indexes(collection, fields)
+    if len(missing) > 0:
+        collection.create_indexes([IndexModel([(field, ASCENDING)]) for field in missing])
+    return(missing)
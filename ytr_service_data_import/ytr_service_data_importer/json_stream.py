@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+JSON decoding of YTR responses, incremental for large arrays.
+
+Documents, and the elements of streamed arrays, are decoded with orjson when
+it is installed and with the standard library otherwise.
+"""
+import codecs
+import json
+import re
+from typing import Iterable, Iterator, Optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_WHITESPACE = ' \t\n\r'
+# Consumed text is dropped from the buffer once there is this much of it
+_COMPACT_THRESHOLD = 1 << 16
+# Characters that change the nesting depth or start a string inside an array element
+_STRUCTURE = re.compile(r'["\[\]{}]')
+# Characters that end a string or escape the next one
+_STRING_END = re.compile(r'["\\]')
+# Characters that end a number or a literal
+_SCALAR_END = re.compile(r'[,\]\s]')
+
+
+def loads(data):
+    if orjson is not None:
+        return(orjson.loads(data))
+    return(json.loads(data))
+
+
+def _find_string_end(buffer: str, start: int) -> Optional[int]:
+    # start is the position after the opening quote
+    position = start
+    while True:
+        match = _STRING_END.search(buffer, position)
+        if match is None:
+            return(None)
+        if match.group() == '"':
+            return(match.end())
+        position = match.end() + 1
+
+
+def _find_value_end(buffer: str, start: int) -> Optional[int]:
+    """
+    Finds the end of the JSON value starting at start without decoding it
+
+    Returns None if the value does not end in the buffer. The value is not
+    validated, the decoder reports malformed values.
+
+    Args
+    ----------
+    buffer : str
+        Text of the array read so far
+
+    start : int
+        Position of the first character of the value
+
+    """
+    character = buffer[start]
+    if character == '"':
+        return(_find_string_end(buffer, start + 1))
+    if character not in '[{':
+        match = _SCALAR_END.search(buffer, start)
+        return(match.start() if match is not None else None)
+    depth = 0
+    position = start
+    while True:
+        match = _STRUCTURE.search(buffer, position)
+        if match is None:
+            return(None)
+        character = match.group()
+        if character == '"':
+            position = _find_string_end(buffer, match.end())
+            if position is None:
+                return(None)
+            continue
+        depth = depth + 1 if character in '[{' else depth - 1
+        position = match.end()
+        if depth == 0:
+            return(position)
+
+
+def decode_json(data, expected_type: Optional[type] = None, source: str = 'response'):
+    """
+    Decodes a whole JSON document and checks the type of its top-level value
+
+    Args
+    ----------
+    data : bytes or str
+        The document
+
+    expected_type : type ( default None )
+        e.g. list or dict, not checked if None
+
+    source : str ( default 'response' )
+        Name of the document for error messages
+
+    """
+    try:
+        value = loads(data)
+    except ValueError as e:
+        raise ValueError("Malformed JSON in {}: {}".format(source, e))
+    if expected_type is not None and not isinstance(value, expected_type):
+        raise ValueError("Expected a JSON {} in {}, got {}".format(expected_type.__name__, source, type(value).__name__))
+    return(value)
+
+
+def iter_json_array(chunks: Iterable[bytes], encoding: str = 'utf-8') -> Iterator:
+    """
+    Yields the elements of a top-level JSON array one at a time
+
+    The end of each element is found by scanning its brackets and strings,
+    then the element alone is decoded with loads.
+
+    Args
+    ----------
+    chunks : Iterable[bytes]
+        The raw response body in pieces, e.g. requests' Response.iter_content()
+
+    encoding : str ( default 'utf-8' )
+        Character encoding of the body
+
+    """
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    exhausted = False
+    state = 'start'
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position = position + 1
+        if position >= len(buffer):
+            if exhausted:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+            else:
+                buffer = buffer[position:] + text_decoder.decode(chunk)
+            position = 0
+            continue
+
+        character = buffer[position]
+        if state == 'start':
+            if character != '[':
+                raise ValueError("Expected a JSON array")
+            position = position + 1
+            state = 'first'
+        elif state == 'first' and character == ']':
+            return
+        elif state in ('first', 'value'):
+            end = _find_value_end(buffer, position)
+            if end is None:
+                if exhausted:
+                    raise ValueError("Malformed JSON array element at offset {}".format(position))
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    buffer = buffer + text_decoder.decode(b'', final=True)
+                else:
+                    buffer = buffer + text_decoder.decode(chunk)
+                continue
+            try:
+                element = loads(buffer[position:end])
+            except ValueError as e:
+                raise ValueError("Malformed JSON array element at offset {}: {}".format(position, e))
+            yield element
+            position = end
+            state = 'separator'
+        else:
+            if character == ',':
+                state = 'value'
+            elif character == ']':
+                return
+            else:
+                raise ValueError("Expected ',' or ']' in JSON array at offset {}".format(position))
+            position = position + 1
+
+        if position > _COMPACT_THRESHOLD:
+            buffer = buffer[position:]
+            position = 0
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Stage timers and counters of an import run, summarised as JSON at the end.
+"""
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pymongo import monitoring
+from .http_transport import RequestMetrics
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """
+    Counts the commands ( i.e. round-trips, getMores included ) sent to MongoDB,
+    registered with MongoClient( event_listeners=[...] )
+
+    """
+
+    def __init__(self) -> None:
+        self._commands = {}
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def started(self, event) -> None:
+        with self._lock:
+            self._commands[event.command_name] = self._commands.get(event.command_name, 0) + 1
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        with self._lock:
+            self._failures = self._failures + 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._commands = {}
+            self._failures = 0
+
+    def summary(self) -> dict:
+        with self._lock:
+            return({'roundTrips': sum(self._commands.values()), 'failures': self._failures, 'commands': dict(self._commands)})
+
+
+class ImportMetrics():
+    """
+    Collects the time spent in each stage of an import together with item counts,
+    HTTP requests and MongoDB round-trips
+
+    Stage times are exclusive: time spent in a nested stage of the same thread is
+    not counted to the outer one. Stages of different threads ( e.g. the import
+    pipeline ) overlap, so their times can add up to more than the run time.
+
+    Methods
+    -------
+    reset()
+        Clears everything and restarts the run clock
+
+    stage(name)
+        Context manager that adds the time spent inside it to the stage
+
+    timed_iter(name, iterable)
+        Yields from iterable adding the time spent waiting for items to the stage
+
+    count(name, amount)
+        Adds to a counter, also from other threads
+
+    add_pipeline(utilisation)
+        Adds the per-stage utilisation of an import pipeline
+
+    summary(**fields)
+        Returns the metrics as a JSON serialisable dict
+
+    write(path, summary)
+        Writes a summary to a file atomically
+
+    """
+
+    def __init__(self) -> None:
+        self.http = RequestMetrics()
+        self.mongo = MongoCommandCounter()
+        self._counter_lock = threading.Lock()
+        # Every thread has its own stack of open stages
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        self.http.reset()
+        self.mongo.reset()
+        self._stages = {}
+        self._counters = {}
+        self._pipeline = {}
+        self._local = threading.local()
+        self._started_at = datetime.utcnow()
+        self._start = time.perf_counter()
+
+    def _get_stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return(self._local.stack)
+
+    @contextmanager
+    def stage(self, name: str):
+        # Every open stage keeps [start, time spent in nested stages]
+        stack = self._get_stack()
+        frame = [time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            if len(stack) > 0:
+                stack[-1][1] = stack[-1][1] + elapsed
+            with self._counter_lock:
+                entry = self._stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                entry['seconds'] = entry['seconds'] + elapsed - frame[1]
+                entry['calls'] = entry['calls'] + 1
+
+    def timed_iter(self, name: str, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._counter_lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def add_pipeline(self, utilisation: dict) -> None:
+        # Stage name -> items, busySeconds, idleSeconds, blockedSeconds and wallSeconds, added up over the pipelines of the run
+        with self._counter_lock:
+            for name, entry in utilisation.items():
+                total = self._pipeline.setdefault(name, {})
+                for key, value in entry.items():
+                    total[key] = total.get(key, 0) + value
+
+    def summary(self, **fields) -> dict:
+        summary = dict(fields)
+        summary['startedAt'] = self._started_at.isoformat() + 'Z'
+        summary['seconds'] = time.perf_counter() - self._start
+        summary['stages'] = {name: dict(entry) for name, entry in self._stages.items()}
+        summary['counters'] = dict(self._counters)
+        if len(self._pipeline) > 0:
+            summary['pipeline'] = {}
+            for name, entry in self._pipeline.items():
+                summary['pipeline'][name] = dict(entry)
+                # Share of the time the pipeline ran that the stage was working
+                wall = entry.get('wallSeconds', 0.0)
+                summary['pipeline'][name]['utilisation'] = entry.get('busySeconds', 0.0) / wall if wall > 0 else 0.0
+        summary['http'] = self.http.summary()
+        summary['mongo'] = self.mongo.summary()
+        return(summary)
+
+    def write(self, path: str, summary: dict) -> None:
+        # Scrapers never see a half written file
+        directory = os.path.dirname(os.path.abspath(path))
+        metrics_file = tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False)
+        try:
+            with metrics_file:
+                json.dump(summary, metrics_file, sort_keys=True)
+            os.replace(metrics_file.name, path)
+        finally:
+            if os.path.exists(metrics_file.name):
+                os.remove(metrics_file.name)
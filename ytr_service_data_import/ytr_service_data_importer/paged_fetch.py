@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Fetching of list endpoints in offset / limit pages with a window of pages in flight.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def iter_pages(fetch_page, page_size: int, window: int):
+    """
+    Yields the pages of a list endpoint in order while the next pages are fetched in threads
+
+    The first page is fetched alone. If it is shorter than page_size it is the only page, and if
+    it is longer the server ignored the paging and sent the whole list. Otherwise up to window
+    pages are in flight at a time until a page shorter than page_size ends the list.
+
+    Args
+    ----------
+    fetch_page : function
+        fetch_page(offset, limit) returns the items of one page as a list
+
+    page_size : int
+        Number of items asked per page
+
+    window : int
+        Maximum number of pages fetched ahead of the one being consumed
+
+    """
+    first_page = fetch_page(0, page_size)
+    yield first_page
+    if len(first_page) != page_size:
+        return
+    window = max(1, window)
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        # ( offset, future ) of the pages in flight, in page order
+        pending = deque()
+        next_offset = page_size
+        for _ in range(window):
+            pending.append((next_offset, executor.submit(fetch_page, next_offset, page_size)))
+            next_offset = next_offset + page_size
+        previous_offset, previous_page = 0, first_page
+        try:
+            while len(pending) > 0:
+                offset, future = pending.popleft()
+                page = future.result()
+                if len(page) > 0 and page[0] == previous_page[0]:
+                    # Paging on the limit alone would never end
+                    raise Exception("The server sent the same page for offsets {} and {}, the offset is not supported".format(
+                        previous_offset, offset))
+                yield page
+                if len(page) < page_size:
+                    break
+                pending.append((next_offset, executor.submit(fetch_page, next_offset, page_size)))
+                next_offset = next_offset + page_size
+                previous_offset, previous_page = offset, page
+        finally:
+            # Pages past the end or after an error are not needed
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing of YTR service offers and channels in a pool of worker processes.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Parser of each worker process, set up once by the pool initializer
+_worker_parser = None
+
+
+def _init_worker(municipality_map: dict, ptv_municipality_names: dict, ptv_municipality_codes: frozenset) -> None:
+    global _worker_parser
+    from .ytr_importer import YTRImporter
+    # Only the lookup tables the parse methods need, no Mongo client or HTTP session
+    parser = YTRImporter.__new__(YTRImporter)
+    parser.municipality_map = municipality_map
+    parser._ptv_municipality_index = (ptv_municipality_names, ptv_municipality_codes)
+    _worker_parser = parser
+
+
+def _get_context():
+    # The importer runs threads, a fork of it could copy a lock some other thread holds.
+    # The workers are forked from a single threaded server process where there is one.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return(multiprocessing.get_context('forkserver'))
+    return(multiprocessing.get_context('spawn'))
+
+
+def _parse_services(service_offers: list) -> list:
+    return([_worker_parser._parse_service_info(service_offer) for service_offer in service_offers])
+
+
+def _parse_channels(channels: list) -> list:
+    return([_worker_parser._parse_channel_info(channel) for channel in channels])
+
+
+class ParallelParser():
+    """
+    Splits service offers and channels into chunks that are parsed in worker processes
+
+    Args
+    ----------
+    importer : YTRImporter
+        Importer whose municipality map and PTV municipality index are shipped to the workers,
+        its own parse methods are used for the serial fallback
+
+    workers : int
+        Number of worker processes, 1 parses everything in this process
+
+    chunk_size : int
+        Number of documents sent to a worker at a time
+
+    min_items : int
+        Inputs smaller than this are parsed in this process
+
+    Methods
+    -------
+    start()
+        Starts the worker processes if there are to be any
+
+    parse_services(service_offers)
+        Returns the parsed offers in input order
+
+    parse_channels(channels)
+        Returns the parsed channels in input order
+
+    close()
+        Shuts the worker processes down
+
+    """
+
+    def __init__(self, importer, workers: int, chunk_size: int, min_items: int) -> None:
+        self.importer = importer
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.min_items = min_items
+        self._pool = None
+        # Services and channels are parsed from different pipeline threads, they share one pool
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=_get_context(),
+                                                 initializer=_init_worker,
+                                                 initargs=(self.importer.municipality_map,
+                                                           self.importer.ptv_municipality_names,
+                                                           self.importer.ptv_municipality_codes))
+            return(self._pool)
+
+    def start(self) -> None:
+        # Called before the pipeline threads start so that their parse stage finds the workers running
+        if self.workers > 1:
+            self._get_pool().submit(int).result()
+
+    def _parse(self, documents: list, worker_function, serial_function) -> list:
+        if self.workers <= 1 or len(documents) < self.min_items:
+            return([serial_function(document) for document in documents])
+        chunks = [documents[start:start + self.chunk_size] for start in range(0, len(documents), self.chunk_size)]
+        parsed = []
+        # Executor.map keeps the chunks in order
+        for parsed_chunk in self._get_pool().map(worker_function, chunks):
+            parsed.extend(parsed_chunk)
+        return(parsed)
+
+    def parse_services(self, service_offers: list) -> list:
+        return(self._parse(service_offers, _parse_services, self.importer._parse_service_info))
+
+    def parse_channels(self, channels: list) -> list:
+        return(self._parse(channels, _parse_channels, self.importer._parse_channel_info))
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+A pipeline of import stages running in threads connected by bounded queues.
+"""
+import queue
+import threading
+import time
+
+# Marks the end of the items in a queue
+_DONE = object()
+# Seconds between checks of the stop flag while waiting on a queue
+_POLL_SECONDS = 0.1
+
+
+class _Failure():
+    # An exception of a stage on its way to the consumer
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+class _StageStats():
+
+    def __init__(self) -> None:
+        self.items = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.blocked = 0.0
+
+    def as_dict(self, wall: float) -> dict:
+        return({'items': self.items, 'busySeconds': self.busy, 'idleSeconds': self.idle, 'blockedSeconds': self.blocked,
+                'wallSeconds': wall})
+
+
+class StagedPipeline():
+    """
+    Runs a source and a chain of stages each in its own thread, with at most queue_size items
+    waiting between two stages. The thread that iterates run() is the last stage.
+
+    Args
+    ----------
+    stages : list
+        ( name, function ) pairs, function( item ) returns the item for the next stage
+
+    queue_size : int
+        Items waiting between two stages, 0 runs everything in the calling thread
+
+    source_name : str ( default 'fetch' )
+        Name of the stage that iterates the source
+
+    sink_name : str ( default 'write' )
+        Name of the calling thread's stage in the utilisation
+
+    Methods
+    -------
+    run(source)
+        Yields the results of the last stage in the order of the source
+
+    utilisation()
+        Returns items, busy, idle ( waiting for input ) and blocked ( waiting for room in the
+        output queue ) seconds per stage, with the seconds the pipeline ran
+
+    """
+
+    def __init__(self, stages: list, queue_size: int, source_name: str = 'fetch', sink_name: str = 'write') -> None:
+        self.stages = stages
+        self.queue_size = queue_size
+        self.source_name = source_name
+        self.sink_name = sink_name
+        self._stats = {name: _StageStats() for name in [source_name] + [name for name, _ in stages] + [sink_name]}
+        self._stop = threading.Event()
+        self._wall = 0.0
+
+    def utilisation(self) -> dict:
+        return({name: stats.as_dict(self._wall) for name, stats in self._stats.items()})
+
+    def _put(self, output: queue.Queue, item) -> bool:
+        # False if the pipeline was stopped while the queue was full
+        while not self._stop.is_set():
+            try:
+                output.put(item, timeout=_POLL_SECONDS)
+                return(True)
+            except queue.Full:
+                continue
+        return(False)
+
+    def _get(self, input_queue: queue.Queue):
+        while True:
+            try:
+                return(input_queue.get(timeout=_POLL_SECONDS))
+            except queue.Empty:
+                if self._stop.is_set():
+                    return(_DONE)
+
+    def _run_source(self, source, output: queue.Queue, stats: _StageStats) -> None:
+        iterator = iter(source)
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    stats.busy = stats.busy + time.perf_counter() - start
+                stats.items = stats.items + 1
+                start = time.perf_counter()
+                delivered = self._put(output, item)
+                stats.blocked = stats.blocked + time.perf_counter() - start
+                if not delivered:
+                    return
+        except BaseException as error:
+            self._put(output, _Failure(error))
+            return
+        finally:
+            # e.g. closes the response of a streamed download that was not read to the end
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+        self._put(output, _DONE)
+
+    def _run_stage(self, function, input_queue: queue.Queue, output: queue.Queue, stats: _StageStats) -> None:
+        while True:
+            start = time.perf_counter()
+            item = self._get(input_queue)
+            stats.idle = stats.idle + time.perf_counter() - start
+            if item is _DONE or isinstance(item, _Failure):
+                self._put(output, item)
+                return
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except BaseException as error:
+                self._put(output, _Failure(error))
+                return
+            finally:
+                stats.busy = stats.busy + time.perf_counter() - start
+            stats.items = stats.items + 1
+            start = time.perf_counter()
+            delivered = self._put(output, result)
+            stats.blocked = stats.blocked + time.perf_counter() - start
+            if not delivered:
+                return
+
+    def _run_inline(self, source):
+        sink = self._stats[self.sink_name]
+        iterator = iter(source)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._stats[self.source_name].busy = self._stats[self.source_name].busy + time.perf_counter() - start
+            self._stats[self.source_name].items = self._stats[self.source_name].items + 1
+            for name, function in self.stages:
+                start = time.perf_counter()
+                item = function(item)
+                self._stats[name].busy = self._stats[name].busy + time.perf_counter() - start
+                self._stats[name].items = self._stats[name].items + 1
+            sink.items = sink.items + 1
+            start = time.perf_counter()
+            yield item
+            sink.busy = sink.busy + time.perf_counter() - start
+
+    def _run_threaded(self, source):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(source, queues[0], self._stats[self.source_name]),
+                                    name='pipeline-' + self.source_name, daemon=True)]
+        for index, (name, function) in enumerate(self.stages):
+            threads.append(threading.Thread(target=self._run_stage, args=(function, queues[index], queues[index + 1], self._stats[name]),
+                                            name='pipeline-' + name, daemon=True))
+        for thread in threads:
+            thread.start()
+        sink = self._stats[self.sink_name]
+        try:
+            while True:
+                start = time.perf_counter()
+                item = queues[-1].get()
+                sink.idle = sink.idle + time.perf_counter() - start
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                sink.items = sink.items + 1
+                start = time.perf_counter()
+                yield item
+                sink.busy = sink.busy + time.perf_counter() - start
+        finally:
+            # Also when the consumer stops early, the stages finish their current item and exit
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def run(self, source):
+        start = time.perf_counter()
+        try:
+            if self.queue_size > 0:
+                yield from self._run_threaded(source)
+            else:
+                yield from self._run_inline(source)
+        finally:
+            self._wall = self._wall + time.perf_counter() - start
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Local on-disk copy of the PTV services and channels for the joins of the import.
+
+Every collection is a file of its BSON documents one after another, opened
+memory-mapped, and a pickled index of the offset of every id ( and of every
+value of the list fields, e.g. channel serviceIds ). Documents are decoded
+only when they are looked up. A collection is copied again only when its
+newest lastUpdated or its document count differs from the copied one.
+"""
+import mmap
+import os
+import pickle
+import struct
+import bson
+from pymongo import DESCENDING
+
+CATALOGUE_FORMAT_VERSION = 1
+# Every BSON document starts with its length as a little-endian int32
+_LENGTH = struct.Struct('<i')
+
+
+def get_collection_stamp(collection) -> dict:
+    """
+    Returns the newest lastUpdated and the document count of a collection, a copy
+    made with the same stamp is up to date
+
+    Args
+    ----------
+    collection : Collection
+        A pymongo collection
+
+    """
+    # Walks the lastUpdated index from its end, see INDEX_SPEC
+    newest = list(collection.find({}, {'_id': False, 'lastUpdated': True}).sort('lastUpdated', DESCENDING).limit(1))
+    last_updated = newest[0].get('lastUpdated') if len(newest) > 0 else None
+    return({'lastUpdated': last_updated, 'count': collection.estimated_document_count()})
+
+
+class _GroupView():
+    # value of a list field -> documents that have it, like a dict of lists
+    def __init__(self, catalogue_file: 'CatalogueFile', field: str) -> None:
+        self.catalogue_file = catalogue_file
+        self.field = field
+
+    def get(self, value, default=None):
+        offsets = self.catalogue_file._groups[self.field].get(value)
+        if offsets is None:
+            return(default)
+        return([self.catalogue_file._decode(offset) for offset in offsets])
+
+
+class CatalogueFile():
+    """
+    The documents of one collection in a memory-mapped file, looked up by id like a dict
+
+    Args
+    ----------
+    path : str
+        Path of the data file, the index is kept next to it in path + '.index'
+
+    Methods
+    -------
+    open()
+        Maps the file and reads the index, False if there is no complete copy
+
+    build(documents, stamp, projection, group_fields)
+        Writes a new copy of the documents and opens it
+
+    grouped_by(field)
+        Returns value -> documents of a list field given in group_fields
+
+    close()
+        Unmaps the file
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index_path = path + '.index'
+        self.stamp = None
+        self.projection = None
+        self._ids = {}
+        self._groups = {}
+        self._map = None
+
+    def open(self) -> bool:
+        self.close()
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                index = pickle.load(index_file)
+            size = os.path.getsize(self.path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return(False)
+        # A copy that was replaced half way has a data file of another size
+        if index.get('version') != CATALOGUE_FORMAT_VERSION or index.get('size') != size:
+            return(False)
+        if size > 0:
+            with open(self.path, 'rb') as data_file:
+                self._map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.stamp = index['stamp']
+        self.projection = index['projection']
+        self._ids = index['ids']
+        self._groups = index['groups']
+        return(True)
+
+    def build(self, documents, stamp: dict, projection: dict, group_fields: tuple = ()) -> int:
+        ids = {}
+        groups = {field: {} for field in group_fields}
+        offset = 0
+        with open(self.path + '.tmp', 'wb') as data_file:
+            for document in documents:
+                data = bson.encode(document)
+                data_file.write(data)
+                # The first document of an id wins like in the joins
+                ids.setdefault(document.get('id'), offset)
+                for field in group_fields:
+                    for value in dict.fromkeys(document.get(field) or []):
+                        groups[field].setdefault(value, []).append(offset)
+                offset = offset + len(data)
+        index = {'version': CATALOGUE_FORMAT_VERSION, 'size': offset, 'stamp': stamp, 'projection': projection,
+                 'ids': ids, 'groups': groups}
+        with open(self.index_path + '.tmp', 'wb') as index_file:
+            pickle.dump(index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.close()
+        os.replace(self.path + '.tmp', self.path)
+        os.replace(self.index_path + '.tmp', self.index_path)
+        if not self.open():
+            raise Exception("Could not open the catalogue copy {} that was just written".format(self.path))
+        return(len(ids))
+
+    def _decode(self, offset: int) -> dict:
+        length = _LENGTH.unpack_from(self._map, offset)[0]
+        return(bson.decode(self._map[offset:offset + length]))
+
+    def grouped_by(self, field: str) -> _GroupView:
+        if field not in self._groups:
+            raise Exception("{} is not indexed in {}".format(field, self.path))
+        return(_GroupView(self, field))
+
+    def __contains__(self, document_id) -> bool:
+        return(document_id in self._ids)
+
+    def __getitem__(self, document_id) -> dict:
+        return(self._decode(self._ids[document_id]))
+
+    def get(self, document_id, default=None):
+        offset = self._ids.get(document_id)
+        if offset is None:
+            return(default)
+        return(self._decode(offset))
+
+    def __len__(self) -> int:
+        return(len(self._ids))
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self.stamp = None
+        self.projection = None
+        self._ids = {}
+        self._groups = {}
+
+
+class PTVCatalogueCache():
+    """
+    Local copies of PTV collections that are refreshed when the collection changes
+
+    Args
+    ----------
+    directory : str
+        Where the copies are kept
+
+    collections : dict
+        Collection name -> ( projection, list fields to index ), e.g. {'channels': (projection, ('serviceIds',))}
+
+    Methods
+    -------
+    refresh(database)
+        Copies the collections that changed since they were copied, returns their names
+
+    get(name)
+        Returns the CatalogueFile of a collection
+
+    close()
+        Unmaps every copy
+
+    """
+
+    def __init__(self, directory: str, collections: dict) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.collections = collections
+        self.files = {name: CatalogueFile(os.path.join(directory, name + '.bson')) for name in collections}
+        self.rebuilds = 0
+
+    def get(self, name: str) -> CatalogueFile:
+        return(self.files[name])
+
+    def refresh(self, database, batch_size: int = 1000) -> list:
+        rebuilt = []
+        for name, (projection, group_fields) in self.collections.items():
+            collection = getattr(database, name)
+            stamp = get_collection_stamp(collection)
+            catalogue_file = self.files[name]
+            if catalogue_file.stamp is None:
+                catalogue_file.open()
+            if catalogue_file.stamp == stamp and catalogue_file.projection == projection \
+                    and set(catalogue_file._groups) == set(group_fields):
+                continue
+            catalogue_file.build(collection.find({}, projection, batch_size=batch_size), stamp, projection, group_fields)
+            self.rebuilds = self.rebuilds + 1
+            rebuilt.append(name)
+        return(rebuilt)
+
+    def close(self) -> None:
+        for catalogue_file in self.files.values():
+            catalogue_file.close()
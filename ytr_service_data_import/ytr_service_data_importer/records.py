@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory records for parsed services and channels.
+
+The records behave like the dicts they replace ( get, [], []=, in, items, copy )
+but keep their fields in __slots__, and empty per-language lists are the shared
+empty tuple. They are turned into BSON ready dicts with to_document() when
+they are written or hashed.
+"""
+
+LANGUAGES = ('en', 'fi', 'sv')
+# Shared by every empty per-language list
+EMPTY = ()
+
+
+class _Missing():
+    # Marks a field that the document does not have, survives pickling as the same object
+    __slots__ = ()
+
+    def __reduce__(self):
+        return('_MISSING')
+
+    def __repr__(self) -> str:
+        return('<missing>')
+
+
+_MISSING = _Missing()
+
+
+def _to_value(value):
+    if isinstance(value, (LanguageSplit, Record)):
+        return(value.to_document())
+    if isinstance(value, tuple):
+        return(list(value))
+    return(value)
+
+
+def compact_list(value):
+    """
+    Returns the shared empty tuple for an empty list and the value otherwise
+    """
+    if isinstance(value, list) and len(value) == 0:
+        return(EMPTY)
+    return(value)
+
+
+class _MappingMixin():
+    # dict-like access on top of _get / _set / _delete / keys
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return(self._get(key))
+
+    def __setitem__(self, key, value) -> None:
+        self._set(key, value)
+
+    def __delitem__(self, key) -> None:
+        self._delete(key)
+
+    def __contains__(self, key) -> bool:
+        try:
+            self._get(key)
+        except KeyError:
+            return(False)
+        return(True)
+
+    def __iter__(self):
+        return(iter(self.keys()))
+
+    def __len__(self) -> int:
+        return(len(self.keys()))
+
+    def get(self, key, default=None):
+        try:
+            return(self._get(key))
+        except KeyError:
+            return(default)
+
+    def items(self) -> list:
+        return([(key, self._get(key)) for key in self.keys()])
+
+    def values(self) -> list:
+        return([self._get(key) for key in self.keys()])
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (dict, _MappingMixin)):
+            return(self.to_document() == _to_value(other))
+        return(NotImplemented)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return("{}({!r})".format(type(self).__name__, self.to_document()))
+
+
+class LanguageSplit(_MappingMixin):
+    """
+    A value per language ( en, fi, sv ), replaces {'en': ..., 'fi': ..., 'sv': ...}
+
+    Args
+    ----------
+    en, fi, sv : ( default None )
+        The values, empty lists are stored as the shared empty tuple
+
+    """
+    __slots__ = LANGUAGES
+
+    def __init__(self, en=None, fi=None, sv=None) -> None:
+        self.en = en
+        self.fi = fi
+        self.sv = sv
+
+    @classmethod
+    def project(cls, function) -> 'LanguageSplit':
+        # function( language ) for every language, e.g. per-language names of a language-invariant structure
+        return(cls(compact_list(function('en')), compact_list(function('fi')), compact_list(function('sv'))))
+
+    @classmethod
+    def from_document(cls, document: dict) -> 'LanguageSplit':
+        split = cls.__new__(cls)
+        for language in LANGUAGES:
+            setattr(split, language, compact_list(document[language]) if language in document else _MISSING)
+        return(split)
+
+    def _get(self, key):
+        if key not in LANGUAGES:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return(value)
+
+    def _set(self, key, value) -> None:
+        if key not in LANGUAGES:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def _delete(self, key) -> None:
+        self._get(key)
+        setattr(self, key, _MISSING)
+
+    def keys(self) -> list:
+        return([language for language in LANGUAGES if getattr(self, language) is not _MISSING])
+
+    def copy(self) -> 'LanguageSplit':
+        split = LanguageSplit.__new__(LanguageSplit)
+        for language in LANGUAGES:
+            setattr(split, language, getattr(self, language))
+        return(split)
+
+    def to_document(self) -> dict:
+        document = {}
+        for language in LANGUAGES:
+            value = getattr(self, language)
+            if value is not _MISSING:
+                document[language] = list(value) if isinstance(value, tuple) else value
+        return(document)
+
+
+class Record(_MappingMixin):
+    """
+    Base of the service and channel records, the fields are listed in _fields and
+    any other key goes to a dict of extra fields
+
+    """
+    __slots__ = ('_extra',)
+    _fields = ()
+
+    def __init__(self, **fields) -> None:
+        for name in self._fields:
+            setattr(self, name, fields.pop(name, _MISSING))
+        self._extra = fields if len(fields) > 0 else None
+
+    @classmethod
+    def from_document(cls, document, **overrides) -> 'Record':
+        # A record of a document ( e.g. from Mongo ), the values are shared like with dict.copy()
+        record = cls.__new__(cls)
+        for name in cls._fields:
+            setattr(record, name, _MISSING)
+        record._extra = None
+        field_set = cls._field_set
+        for key, value in document.items():
+            if key in field_set:
+                setattr(record, key, value)
+            else:
+                record._set(key, value)
+        for key, value in overrides.items():
+            record._set(key, value)
+        return(record)
+
+    def _get(self, key):
+        if key in self._field_set:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return(value)
+        if self._extra is not None and key in self._extra:
+            return(self._extra[key])
+        raise KeyError(key)
+
+    def _set(self, key, value) -> None:
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def _delete(self, key) -> None:
+        if key in self._field_set:
+            self._get(key)
+            setattr(self, key, _MISSING)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def keys(self) -> list:
+        keys = [name for name in self._fields if getattr(self, name) is not _MISSING]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        return(keys)
+
+    def copy(self) -> 'Record':
+        # Shallow like dict.copy(), the values are shared
+        record = type(self).__new__(type(self))
+        for name in self._fields:
+            setattr(record, name, getattr(self, name))
+        record._extra = dict(self._extra) if self._extra is not None else None
+        return(record)
+
+    def to_document(self) -> dict:
+        document = {}
+        for name in self._fields:
+            value = getattr(self, name)
+            if value is not _MISSING:
+                document[name] = _to_value(value)
+        if self._extra is not None:
+            for key, value in self._extra.items():
+                document[key] = _to_value(value)
+        return(document)
+
+
+class ServiceRecord(Record):
+    """
+    A parsed YTR service or a PTV service matched to one
+    """
+    _fields = ('id', 'ptvId', 'type', 'subtype', 'channelIds', 'organizations', 'name', 'descriptions', 'requirement',
+               'targetGroups', 'serviceClasses', 'areas', 'lifeEvents', 'lastUpdated', 'contentHash')
+    _field_set = frozenset(_fields)
+    __slots__ = _fields
+
+
+class ChannelRecord(Record):
+    """
+    A parsed YTR service channel or a PTV channel matched to one
+    """
+    _fields = ('id', 'ptvId', 'areaType', 'type', 'serviceIds', 'organizationId', 'name', 'descriptions', 'webPages',
+               'emails', 'phoneNumbers', 'addresses', 'areas', 'channelUrls', 'organizations', 'lastUpdated', 'contentHash')
+    _field_set = frozenset(_fields)
+    __slots__ = _fields
+
+
+def to_document(document) -> dict:
+    """
+    Returns the BSON ready dict of a record, dicts are returned as they are
+    """
+    if isinstance(document, Record):
+        return(document.to_document())
+    return(document)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshots of the raw YTR responses and the PTV documents an import read, and their offline replay.
+
+A snapshot is a zip archive with a manifest.json, one member per response body
+as it came from YTR, and one Extended JSON member per PTV collection so that
+dates and 64-bit numbers come back with their BSON types.
+"""
+import io
+import json
+import os
+import threading
+import zipfile
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+import requests
+from bson import json_util
+
+SNAPSHOT_FORMAT_VERSION = 1
+_MANIFEST = 'manifest.json'
+# Stored datetimes come back naive like from a MongoClient without tz_aware
+_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.CANONICAL, tz_aware=False)
+
+
+class SnapshotRecorder():
+    """
+    Collects the response bodies and the PTV documents of an import, safe to use from several threads
+
+    Methods
+    -------
+    record_response(endpoint, body)
+        Keeps the body of a response, a later body of the same endpoint replaces it
+
+    record_documents(collection, documents)
+        Yields the documents and keeps them by id, the first document of an id wins
+
+    save(path, **fields)
+        Writes the snapshot archive, fields go to the manifest
+
+    """
+
+    def __init__(self) -> None:
+        self.responses = {}
+        self.collections = {}
+        self._lock = threading.Lock()
+
+    def record_response(self, endpoint: str, body: bytes) -> None:
+        with self._lock:
+            self.responses[endpoint] = bytes(body)
+
+    def record_documents(self, collection: str, documents):
+        with self._lock:
+            recorded = self.collections.setdefault(collection, {})
+        for document in documents:
+            with self._lock:
+                recorded.setdefault(document.get('id'), document)
+            yield document
+
+    def save(self, path: str, **fields) -> None:
+        with self._lock:
+            responses = dict(self.responses)
+            collections = {name: list(documents.values()) for name, documents in self.collections.items()}
+        manifest = dict(fields)
+        manifest['version'] = SNAPSHOT_FORMAT_VERSION
+        manifest['createdAt'] = datetime.utcnow().isoformat() + 'Z'
+        manifest['responses'] = {}
+        manifest['collections'] = {}
+        # Written next to the target first so that a failed run does not leave half an archive
+        temporary_path = path + '.tmp'
+        with zipfile.ZipFile(temporary_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for number, (endpoint, body) in enumerate(sorted(responses.items())):
+                member = 'responses/{:06d}.json'.format(number)
+                archive.writestr(member, body)
+                manifest['responses'][endpoint] = member
+            for name, documents in sorted(collections.items()):
+                member = 'collections/{}.json'.format(name)
+                archive.writestr(member, json_util.dumps(documents, json_options=json_util.CANONICAL_JSON_OPTIONS))
+                manifest['collections'][name] = member
+            archive.writestr(_MANIFEST, json.dumps(manifest, indent=1, sort_keys=True))
+        os.replace(temporary_path, path)
+
+
+class Snapshot():
+    """
+    The contents of a snapshot archive
+
+    Args
+    ----------
+    manifest : dict
+        Manifest of the archive
+
+    responses : dict
+        Endpoint -> response body
+
+    collections : dict
+        PTV collection name -> documents
+
+    Methods
+    -------
+    load(path)
+        Reads an archive written by SnapshotRecorder.save
+
+    load_collections(database)
+        Inserts the PTV documents to the collections of the same name in a database
+
+    """
+
+    def __init__(self, manifest: dict, responses: dict, collections: dict) -> None:
+        self.manifest = manifest
+        self.responses = responses
+        self.collections = collections
+
+    @classmethod
+    def load(cls, path: str) -> 'Snapshot':
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read(_MANIFEST))
+            if manifest.get('version') != SNAPSHOT_FORMAT_VERSION:
+                raise Exception("Snapshot {} has format version {}, expected {}".format(
+                    path, manifest.get('version'), SNAPSHOT_FORMAT_VERSION))
+            responses = {endpoint: archive.read(member) for endpoint, member in manifest['responses'].items()}
+            collections = {name: json_util.loads(archive.read(member), json_options=_JSON_OPTIONS)
+                           for name, member in manifest['collections'].items()}
+        return(cls(manifest, responses, collections))
+
+    def load_collections(self, database) -> None:
+        for name, documents in self.collections.items():
+            if len(documents) > 0:
+                getattr(database, name).insert_many([dict(document) for document in documents])
+
+
+class ReplaySession():
+    """
+    Stands in for the requests session of the importer and answers every GET from a snapshot,
+    without any network access. Endpoints missing from the snapshot get a 404, except pages
+    past the last recorded page of an endpoint, which get an empty list like from YTR.
+
+    Args
+    ----------
+    snapshot : Snapshot
+        The recorded responses
+
+    base_url : str
+        URL prefix of the endpoints, e.g. the importer's API
+
+    """
+
+    def __init__(self, snapshot: Snapshot, base_url: str) -> None:
+        self.snapshot = snapshot
+        self.base_url = base_url
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        endpoint = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        response = requests.Response()
+        response.url = url
+        body = self.snapshot.responses.get(endpoint)
+        if body is None and self._is_past_last_page(endpoint):
+            body = b'[]'
+        if body is None:
+            response.status_code = 404
+            response.reason = 'Not in snapshot'
+            body = b''
+        else:
+            response.status_code = 200
+            response.reason = 'OK'
+            response.headers['Content-Type'] = 'application/json'
+        response.headers['Content-Length'] = str(len(body))
+        response.encoding = 'utf-8'
+        # The body is already read, iter_content() slices it for streamed reads
+        response._content = body
+        response._content_consumed = True
+        response.raw = io.BytesIO(body)
+        return(response)
+
+    def _is_past_last_page(self, endpoint: str) -> bool:
+        # The pages are read in order up to the short one, so every page up to the end is recorded.
+        # Which pages past the end were requested while the last ones were in flight depends on timing.
+        offset = self._page_offset(endpoint)
+        if offset is None:
+            return(False)
+        path = urlsplit(endpoint).path
+        recorded = [self._page_offset(other) for other in self.snapshot.responses if urlsplit(other).path == path]
+        recorded = [other_offset for other_offset in recorded if other_offset is not None]
+        return(len(recorded) > 0 and offset > max(recorded))
+
+    @staticmethod
+    def _page_offset(endpoint: str):
+        offsets = parse_qs(urlsplit(endpoint).query).get('offset')
+        if offsets is None or not offsets[0].isdigit():
+            return(None)
+        return(int(offsets[0]))
+
+    def close(self) -> None:
+        pass
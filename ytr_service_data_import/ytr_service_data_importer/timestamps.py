@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing of the YTR modification times, e.g. "2021-08-06T13:45.07.123Z".
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+# Format of the 'muutettu' field, minutes and seconds are separated by a dot
+YTR_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M.%S.%fZ"
+# Timestamps repeat a lot since many records come from bulk edits
+TIMESTAMP_CACHE_SIZE = 8192
+# The zero padded form with 1 - 6 fraction digits like %f, ASCII digits only
+_FIXED_WIDTH = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d)\.(\d\d)\.(\d{1,6})Z', re.ASCII)
+
+
+def _parse_fixed_width(value: str) -> Optional[datetime]:
+    # None if the value is not in the zero padded form
+    match = _FIXED_WIDTH.fullmatch(value)
+    if match is None:
+        return(None)
+    year, month, day, hour, minute, second, fraction = match.groups()
+    return(datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), int(fraction.ljust(6, '0'))))
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_ytr_timestamp(value: str) -> datetime:
+    """
+    Parses a YTR timestamp, gives the same result as datetime.strptime(value, YTR_TIMESTAMP_FORMAT)
+
+    Args
+    ----------
+    value : str
+        e.g. "2021-08-06T13:45.07.123Z"
+
+    """
+    try:
+        parsed = _parse_fixed_width(value)
+        if parsed is None:
+            # Forms that strptime also accepts, e.g. without zero padding
+            parsed = datetime.strptime(value, YTR_TIMESTAMP_FORMAT)
+    except ValueError as error:
+        raise ValueError("Malformed YTR timestamp {!r}, expected YYYY-MM-DDTHH:MM.SS.fffZ: {}".format(value, error)) from None
+    return(parsed)
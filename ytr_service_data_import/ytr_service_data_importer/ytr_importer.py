@@ -5,19 +5,99 @@ Created on Wed Jun  2 09:40:06 2021
 @author: joonas.itkonen
 """
 import os
-from pymongo import MongoClient, DESCENDING
+from pymongo import MongoClient, DESCENDING, InsertOne, ReplaceOne, UpdateOne, DeleteOne
+from pymongo.errors import PyMongoError
 import requests
 import json
+import hashlib
 import time
 import urllib
 import math
 import pickle
+import itertools
 from datetime import datetime
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from .channel_registry import ChannelRegistry
+from .channel_cache import ChannelCache
+from .json_stream import iter_json_array, decode_json
+from .http_cache import HTTPResponseCache
+from .http_transport import create_api_session, get_retry_count
+from .metrics import ImportMetrics
+from .parallel_parse import ParallelParser
+from .records import ServiceRecord, ChannelRecord, LanguageSplit, EMPTY, to_document
+from .timestamps import parse_ytr_timestamp
+from .indexes import INDEX_SPEC, ensure_indexes
+from .paged_fetch import iter_pages
+from .pipeline import StagedPipeline
+from .snapshot import SnapshotRecorder, Snapshot, ReplaySession
+from .ptv_catalogue import PTVCatalogueCache, CatalogueFile
 API = "http://{}:{}/palvelutieto/api/v1".format(
                 os.environ.get("KOMPASSIYTR_HOST"),
                 os.environ.get("KOMPASSIYTR_PORT"))
+# Number of parallel requests when fetching service channels, 1 fetches them one by one
+FETCH_CONCURRENCY = int(os.environ.get("KOMPASSIYTR_FETCH_CONCURRENCY", 1))
+# Seconds to wait for a connection and between received bytes of a YTR response
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("KOMPASSIYTR_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.environ.get("KOMPASSIYTR_READ_TIMEOUT", 120))
+# Failed GETs ( connection errors, timeouts, 429 and 5xx ) are retried with exponential backoff
+HTTP_MAX_RETRIES = int(os.environ.get("KOMPASSIYTR_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("KOMPASSIYTR_BACKOFF_FACTOR", 1.0))
+# Offers per page when /palvelutarjous is fetched with offset and limit, 0 fetches the whole catalogue with one GET
+OFFER_PAGE_SIZE = int(os.environ.get("KOMPASSIYTR_PAGE_SIZE", 0))
+# Pages fetched in parallel ahead of the one being parsed
+OFFER_PAGE_WINDOW = int(os.environ.get("KOMPASSIYTR_PAGE_WINDOW", 4))
+# Attempts at a page whose connection broke off, on top of the GET retries of the session
+OFFER_PAGE_RETRIES = int(os.environ.get("KOMPASSIYTR_PAGE_RETRIES", 3))
+# Statuses that tell the endpoint does not take the paging parameters
+PAGING_REJECTED_STATUSES = (400, 404, 422)
+# Worker processes that parse service offers and channels, 1 parses them in the importing process
+PARSE_WORKERS = int(os.environ.get("YTR_PARSE_WORKERS", 1))
+# Documents sent to a parse worker at a time, smaller inputs than PARSE_PARALLEL_MIN_ITEMS are parsed serially
+PARSE_CHUNK_SIZE = int(os.environ.get("YTR_PARSE_CHUNK_SIZE", 100))
+PARSE_PARALLEL_MIN_ITEMS = 200
+# Maximum number of ids in one $in query against the PTV collections
+PTV_QUERY_CHUNK_SIZE = 500
+# Directory for the conditional GET cache of the YTR catalogue endpoints, caching is off if not set
+HTTP_CACHE_DIR = os.environ.get("YTR_HTTP_CACHE_DIR")
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("YTR_HTTP_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Directory for memory-mapped copies of the PTV services and channels, the joins query Mongo if not set
+PTV_CACHE_DIR = os.environ.get("YTR_PTV_CACHE_DIR")
+# Number of service offers that go through parse, PTV join and channel enrichment together
+SERVICE_BATCH_SIZE = int(os.environ.get("YTR_SERVICE_BATCH_SIZE", 500))
+# Batches waiting between the fetch, parse, channel and write stages of the import pipeline,
+# 0 runs the stages one after another in the importing thread. The threads only pay off with several cores.
+PIPELINE_QUEUE_SIZE = int(os.environ.get("YTR_PIPELINE_QUEUE_SIZE", 0))
+# Maximum number of documents in one insert_many
+STORE_BATCH_SIZE = int(os.environ.get("YTR_STORE_BATCH_SIZE", 1000))
+# Full imports are written to these collections first and then renamed over the live ones
+STAGING_SUFFIX = "_staging"
+# Keeps the newest YTR 'muutettu' of the stored offers, the high-water mark of incremental imports.
+# The stored lastUpdated cannot be used since PTV matched services carry the PTV lastUpdated
+IMPORT_STATE_COLLECTION = "ytr_import_state"
+IMPORT_STATE_ID = "ytr_services"
+# "full" rebuilds ytr_services and ytr_channels, "incremental" processes only offers changed since the last import
+# and "sync" writes only the documents whose content hash differs from the stored one
+IMPORT_MODE = os.environ.get("YTR_IMPORT_MODE", "full")
+# Missing indexes of INDEX_SPEC are created when the first import starts, "false" leaves the indexes alone
+ENSURE_INDEXES = os.environ.get("YTR_ENSURE_INDEXES", "true").lower() != "false"
+# The JSON summary of every run is also written here if set
+METRICS_FILE = os.environ.get("YTR_METRICS_FILE")
+# Archive of the raw YTR responses and the PTV documents of every run for an offline replay, not recorded if not set
+SNAPSHOT_FILE = os.environ.get("YTR_SNAPSHOT_FILE")
+# Documents per round trip when reading PTV collections, the $in chunks fit in one batch
+PTV_CURSOR_BATCH_SIZE = 1000
+# Fields of the PTV municipality documents used for the area names
+PTV_MUNICIPALITY_PROJECTION = {'_id': False, 'id': True, 'name': True}
+# PTV matched services and channels are stored as they are in PTV, so only _id is left out
+PTV_SERVICE_PROJECTION = {'_id': False}
+PTV_CHANNEL_PROJECTION = {'_id': False}
+# PTV collections kept in the local catalogue cache: projection and the list fields looked up by their values
+PTV_CACHE_COLLECTIONS = {'services': (PTV_SERVICE_PROJECTION, ()),
+                         'channels': (PTV_CHANNEL_PROJECTION, ('serviceIds',))}
+# Names of a municipality that PTV does not know
+_NO_NAMES = {}
 TG_MAP = {"KR-1": "KR1.1", "KR-2": "KR1.2", "KR-3": "KR1.3", "KR-4": "KR1"}
 PROVINCE_CODES = ["02"]
 suitable_target_groups = ['KR1', 'KR1.2']
@@ -35,14 +115,37 @@ class YTRImporter():
     api_session : requests.Session ( default None )
         A requests session to send requests to PTV API
 
+    fetch_concurrency : int ( default None )
+        Maximum number of parallel channel requests, KOMPASSIYTR_FETCH_CONCURRENCY is used if not given
+
+    http_cache : HTTPResponseCache ( default None )
+        On-disk cache for the catalogue endpoints, created from YTR_HTTP_CACHE_DIR if not given
+
+    parse_workers : int ( default None )
+        Number of parse worker processes, YTR_PARSE_WORKERS is used if not given
+
+    page_size : int ( default None )
+        Offers per /palvelutarjous page, 0 for one GET, KOMPASSIYTR_PAGE_SIZE is used if not given
+
+    snapshot_file : str ( default None )
+        Where every run records its YTR responses and PTV documents, YTR_SNAPSHOT_FILE is used if not given
+
+    ptv_cache : PTVCatalogueCache ( default None )
+        Local copies of the PTV services and channels for the joins, created from YTR_PTV_CACHE_DIR if not given
+
     Methods
     -------      
     import_services()
         Does nothing yet
 
+    from_snapshot(path, mongo_client, **kwargs)
+        Returns an importer that reads YTR and PTV from a recorded snapshot instead
+
     """
     
-    def __init__(self, mongo_client: Optional[MongoClient] = None, api_session: Optional[requests.Session] = None) -> None:
+    def __init__(self, mongo_client: Optional[MongoClient] = None, api_session: Optional[requests.Session] = None, fetch_concurrency: Optional[int] = None, http_cache: Optional[HTTPResponseCache] = None, parse_workers: Optional[int] = None, page_size: Optional[int] = None, snapshot_file: Optional[str] = None, ptv_cache: Optional[PTVCatalogueCache] = None) -> None:
+        self.metrics = ImportMetrics()
+        self.request_metrics = self.metrics.http
         if mongo_client is None:        
             self.mongo_client = MongoClient("mongodb://{}:{}@{}:{}/{}".format(
                 os.environ.get("MONGO_USERNAME"),
@@ -55,21 +158,108 @@ class YTRImporter():
                 replicaSet="globaldb",
                 retrywrites=False,
                 maxIdleTimeMS=120000,
-                appName="@{}@".format(os.environ.get("MONGO_USERNAME"))
+                appName="@{}@".format(os.environ.get("MONGO_USERNAME")),
+                event_listeners=[self.metrics.mongo]
                 )
         else:
             self.mongo_client = mongo_client
         
+        if fetch_concurrency is None:
+            fetch_concurrency = FETCH_CONCURRENCY
+        self.fetch_concurrency = max(1, fetch_concurrency)
+        if parse_workers is None:
+            parse_workers = PARSE_WORKERS
+        self.parse_workers = max(1, parse_workers)
+        self.parser = None
+        if page_size is None:
+            page_size = OFFER_PAGE_SIZE
+        self.page_size = max(0, page_size)
+
         # Init DB api session
         if api_session is None:
-            self.api_session = requests.Session()
+            # Let every fetch worker and every page in the window keep its own connection alive
+            self.api_session = create_api_session(max(self.fetch_concurrency, OFFER_PAGE_WINDOW), HTTP_MAX_RETRIES, HTTP_BACKOFF_FACTOR)
         else:
             self.api_session = api_session
-        self.ptv_municipalities = list(self.mongo_client.service_db.municipalities.find({}))
-            
 
-    def _parse_service_info(self, service: dict) -> dict:
-        service_final = {}
+        if http_cache is None and HTTP_CACHE_DIR:
+            http_cache = HTTPResponseCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES)
+        self.http_cache = http_cache
+        # PTV municipality names and codes, read from Mongo on first use
+        self._ptv_municipality_index = None
+        self.ensure_indexes = ENSURE_INDEXES
+        self._indexes_checked = False
+        if snapshot_file is None:
+            snapshot_file = SNAPSHOT_FILE
+        self.snapshot_file = snapshot_file
+        # Recorder of the current run when snapshot_file is set
+        self.snapshot = None
+        if ptv_cache is None and PTV_CACHE_DIR:
+            ptv_cache = PTVCatalogueCache(PTV_CACHE_DIR, PTV_CACHE_COLLECTIONS)
+        self.ptv_cache = ptv_cache
+        # Set by _prepare_import when the joins of the run use ptv_cache
+        self._use_ptv_cache = False
+        # Newest 'muutettu' of the offers of the current run
+        self._offers_high_water_mark = None
+        # Cleared when the server refuses renameCollection, full imports then replace the documents
+        self._rename_supported = True
+
+    @classmethod
+    def from_snapshot(cls, path: str, mongo_client: Optional[MongoClient] = None, **kwargs) -> 'YTRImporter':
+        """
+        Returns an importer that gets the YTR responses from a snapshot without network access
+
+        Args
+        ----------
+        path : str
+            Snapshot archive written by an import with snapshot_file set
+
+        mongo_client : MongoClient ( default None )
+            Used as it is, if not given the PTV documents of the snapshot are loaded into mongomock
+
+        kwargs
+            Other arguments of YTRImporter, page_size defaults to the one of the recorded run
+
+        """
+        snapshot = Snapshot.load(path)
+        if mongo_client is None:
+            try:
+                import mongomock
+            except ImportError:
+                raise Exception("Install mongomock or give a mongo_client to replay a snapshot")
+            mongo_client = mongomock.MongoClient()
+            snapshot.load_collections(mongo_client.service_db)
+        kwargs.setdefault('page_size', snapshot.manifest.get('pageSize', 0))
+        importer = cls(mongo_client=mongo_client, api_session=ReplaySession(snapshot, API), **kwargs)
+        # Every body comes from the snapshot, not from the response cache
+        importer.http_cache = None
+        return(importer)
+
+    @property
+    def ptv_municipality_names(self) -> dict:
+        return(self._get_municipality_index()[0])
+
+    @property
+    def ptv_municipality_codes(self) -> frozenset:
+        return(self._get_municipality_index()[1])
+
+    def _get_municipality_index(self) -> tuple:
+        if self._ptv_municipality_index is None:
+            municipalities = self._find_ptv('municipalities', {}, PTV_MUNICIPALITY_PROJECTION)
+            self._ptv_municipality_index = self._build_municipality_index(municipalities)
+        return(self._ptv_municipality_index)
+
+    def _build_municipality_index(self, municipalities) -> tuple:
+        # PTV municipality code -> per-language names, first occurrence wins
+        names = {}
+        for municipality in municipalities:
+            code = municipality.get('id')
+            if code not in names:
+                names[code] = municipality.get('name')
+        return names, frozenset(names.keys())
+
+    def _parse_service_info(self, service: dict) -> ServiceRecord:
+        service_final = ServiceRecord()
         service_id = service.get('id')
         if service_id is not None:
             service_id = str(service_id)
@@ -90,81 +280,46 @@ class YTRImporter():
             organization_id = str(organization_id)
         organization_elements = [{'name': None, 'id': organization_id}]        
         service_final['organizations'] = organization_elements
-            
-        languages = ['en', 'fi', 'sv']
-        language_division = {'en': None, 'fi': None, 'sv': None}
-        service_final['name'] = language_division.copy()
-        service_final['descriptions'] = language_division.copy()
-        service_final['requirement'] = language_division.copy()
-        service_final['targetGroups'] = language_division.copy()
-        service_final['serviceClasses'] = language_division.copy()
-        service_final['areas'] = language_division.copy()
-        service_final['lifeEvents'] = language_division.copy()
-        # Divided by language    
-        for language in languages:
-            names = [service.get('nimi', {}).get(language)]
-            names = [l_name for l_name in names if l_name is not None]
-            if len(names) > 0:
-                name = ' - '.join(names)
-            else:
-                name = None
-            service_final['name'][language] = name
-            descriptions = [{'value': service.get('kuvaus', {}).get(language), 'type': 'Description'}]
-            descriptions = [d for d in descriptions if d['value'] is not None]
-            service_final['descriptions'][language] = descriptions
-            
-            service_final['requirement'][language] = ''
-            
-            # Target groups
-            target_groups = service.get('kohderyhmat', [])
-            target_group_elements = []
-            for target_group in target_groups:
-                target_group_name = target_group.get('nimi').get(language)
-                target_group_code = TG_MAP.get(target_group.get('koodi'))
-                if target_group_code is None:
-                    raise Exception("Unrecognized target group {}".format(target_group.get('koodi')))
-                
-                target_group_el = {"name": target_group_name,
-                                   "code": target_group_code}
-                target_group_elements.append(target_group_el) 
-            service_final['targetGroups'][language] = target_group_elements
-    
-            # Service classes
-            service_final['serviceClasses'][language] = []
-                
-            # Areas
-            areas = service.get('kuntasaatavuudet', [])
-            area_elements = []
-            for area in areas:
-                area_type = 'Municipality'
-                area_id = area.get('kunta')
-                area_code = self.municipality_map.get(area_id)
-                municipality_element = [mun for mun in self.ptv_municipalities if mun.get('id') == area_code]
-                if len(municipality_element) > 0:
-                    area_name = municipality_element[0].get('name').get(language)
-                else:
-                    area_name = None
 
-                area_el = {"name": area_name,
-                           "type": area_type,
-                           "code": area_code}
-                area_elements.append(area_el)
-            service_final['areas'][language] = area_elements
-            
-            # Life events
-            service_final['lifeEvents'][language] = []
-            
+        # Language-invariant structure first, the target group codes and areas are resolved once
+        service_names = service.get('nimi', {})
+        service_descriptions = service.get('kuvaus', {})
+        target_groups = []
+        for target_group in service.get('kohderyhmat', []):
+            target_group_code = TG_MAP.get(target_group.get('koodi'))
+            if target_group_code is None:
+                raise Exception("Unrecognized target group {}".format(target_group.get('koodi')))
+            target_groups.append((target_group.get('nimi'), target_group_code))
+        areas = [self._resolve_municipality(area.get('kunta')) for area in service.get('kuntasaatavuudet', [])]
+
+        # Then divided by language
+        def descriptions(language: str) -> list:
+            description = service_descriptions.get(language)
+            if description is None:
+                return([])
+            return([{'value': description, 'type': 'Description'}])
+
+        service_final['name'] = LanguageSplit.project(service_names.get)
+        service_final['descriptions'] = LanguageSplit.project(descriptions)
+        service_final['requirement'] = LanguageSplit('', '', '')
+        service_final['targetGroups'] = LanguageSplit.project(
+            lambda language: [{"name": names.get(language), "code": code} for names, code in target_groups])
+        service_final['serviceClasses'] = LanguageSplit(EMPTY, EMPTY, EMPTY)
+        service_final['areas'] = LanguageSplit.project(
+            lambda language: [{"name": names.get(language), "type": 'Municipality', "code": code} for code, names in areas])
+        service_final['lifeEvents'] = LanguageSplit(EMPTY, EMPTY, EMPTY)
+
         if 'muutettu' in service.keys() and service.get('muutettu') is not None:
-            service_final['lastUpdated'] = datetime.strptime(service.get('muutettu'), "%Y-%m-%dT%H:%M.%S.%fZ")
+            service_final['lastUpdated'] = parse_ytr_timestamp(service.get('muutettu'))
         else:
             service_final['lastUpdated'] = None
             
         return(service_final)      
     
     
-    def _parse_channel_info(self, channel: dict) -> dict:
+    def _parse_channel_info(self, channel: dict) -> ChannelRecord:
                         
-        channel_final = {}
+        channel_final = ChannelRecord()
         
         channel_id = channel.get('id')
         if channel_id is not None:
@@ -185,106 +340,80 @@ class YTRImporter():
             organization_id = str(organization_id)
         channel_final['organizationId'] = organization_id
 
-        languages = ['en', 'fi', 'sv']
-        language_division = {'en': None, 'fi': None, 'sv': None}
-        channel_final['name'] = language_division.copy()
-        channel_final['descriptions'] = language_division.copy()
-        channel_final['webPages'] = language_division.copy()
-        channel_final['emails'] = language_division.copy()
-        channel_final['phoneNumbers'] = language_division.copy()
-        channel_final['addresses'] = language_division.copy()
-        channel_final['areas'] = language_division.copy()
-        channel_final['channelUrls'] = language_division.copy()
-        channel_final['organizations'] = language_division.copy()
-        
-        # Divided by language    
-        for language in languages:
-            
-            if 'nimi' in channel.keys():
-                names = [channel.get('nimi').get(language)]
-                names = [l_name for l_name in names if l_name is not None]
-                if len(names) > 0:
-                    name = ' - '.join(names)
-                else:
-                    name = None
-            else:
-                name = None
-            channel_final['name'][language] = name
-            
-            if 'kuvaus' in channel.keys():
-                descriptions = [{'value': channel.get('kuvaus').get(language), 'type': 'Description'}]
-                descriptions = [d for d in descriptions if d['value'] is not None]
-            else:
-                descriptions = []
-            channel_final['descriptions'][language] = descriptions
-        
-            channel_types = channel.get('yhteystiedot')
-            channel_final['phoneNumbers'][language] = []
-            channel_final['webPages'][language] = []
-            channel_final['emails'][language] = []
-            if channel_types is not None:
-                for channel_type in channel_types:
-                    if 'yhteystietotyyppi' in channel_type.keys():
-                        if channel_type.get('yhteystietotyyppi').get('id') == 1:
-                            if channel_type.get('arvo') is not None:
-                                phone_numbers = [{'number': channel_type.get('arvo'),
-                                                  'prefixNumber': None,
-                                                  'chargeDescription': None,
-                                                  'serviceChargeType': None}]
-                            else:
-                                phone_numbers = []
-                            channel_final['phoneNumbers'][language] = phone_numbers
-                        elif channel_type.get('yhteystietotyyppi').get('id') == 2:
-                            if channel_type.get('arvo') is not None:
-                                web_pages = [channel_type.get('arvo')]
-                            else:
-                                web_pages = []
-                            channel_final['webPages'][language] = web_pages        
-                
-            # Addresses
-            if channel.get('osoite') is not None:
-                addresses = [channel.get('osoite')]
-            else:
-                addresses = []
-            address_elements = []
-            for address in addresses:
-                if address.get('katuosoite') is not None:
-                    street_address = address.get('katuosoite').get(language)
-                else:
-                    street_address = None                
-                if address.get('postinumero') is not None:    
-                    postal_code = address.get('postinumero')
-                else:
-                    postal_code = None
-                    
-                mun_id = address.get('kunta')
-                municipality_code = self.municipality_map.get(mun_id)
-                municipality_element = [mun for mun in self.ptv_municipalities if mun.get('id') == municipality_code]
-                if len(municipality_element) > 0: 
-                    municipality_name = municipality_element[0].get('name').get(language)
-                else:
-                    municipality_name = None
-
-                address_el = {"streetName": street_address,
-                                   "postalCode": postal_code,
-                                   "municipalityCode": municipality_code,
-                                   "municipalityName": municipality_name,
-                                   "type": None,
-                                   "subtype": None,
-                                   "streetNumber": None,
-                                   "latitude": None,
-                                   "longitude": None,
-                                   "postOffice": None}
-                address_elements.append(address_el)
-            channel_final['addresses'][language] = address_elements
-                
-            channel_final['areas'][language] = []
+        # Language-invariant structure first, the contact list is scanned and the address municipality resolved once
+        channel_names = channel.get('nimi') if 'nimi' in channel.keys() else {}
+        channel_descriptions = channel.get('kuvaus') if 'kuvaus' in channel.keys() else {}
+        phone_numbers = []
+        web_pages = []
+        channel_types = channel.get('yhteystiedot')
+        if channel_types is not None:
+            # The last contact of each type wins
+            for channel_type in channel_types:
+                if 'yhteystietotyyppi' in channel_type.keys():
+                    if channel_type.get('yhteystietotyyppi').get('id') == 1:
+                        if channel_type.get('arvo') is not None:
+                            phone_numbers = [{'number': channel_type.get('arvo'),
+                                              'prefixNumber': None,
+                                              'chargeDescription': None,
+                                              'serviceChargeType': None}]
+                        else:
+                            phone_numbers = []
+                    elif channel_type.get('yhteystietotyyppi').get('id') == 2:
+                        if channel_type.get('arvo') is not None:
+                            web_pages = [channel_type.get('arvo')]
+                        else:
+                            web_pages = []
+
+        # Addresses
+        address = channel.get('osoite')
+        if address is not None:
+            street_addresses = address.get('katuosoite')
+            if street_addresses is None:
+                street_addresses = {}
+            postal_code = address.get('postinumero')
+            municipality_code, municipality_names = self._resolve_municipality(address.get('kunta'))
+
+        def addresses(language: str) -> list:
+            if address is None:
+                return([])
+            return([{"streetName": street_addresses.get(language),
+                     "postalCode": postal_code,
+                     "municipalityCode": municipality_code,
+                     "municipalityName": municipality_names.get(language),
+                     "type": None,
+                     "subtype": None,
+                     "streetNumber": None,
+                     "latitude": None,
+                     "longitude": None,
+                     "postOffice": None}])
+
+        def descriptions(language: str) -> list:
+            description = channel_descriptions.get(language)
+            if description is None:
+                return([])
+            return([{'value': description, 'type': 'Description'}])
+
+        # Then divided by language, the contacts are the same in every language
+        channel_final['name'] = LanguageSplit.project(channel_names.get)
+        channel_final['descriptions'] = LanguageSplit.project(descriptions)
+        channel_final['webPages'] = LanguageSplit.project(lambda language: web_pages)
+        channel_final['emails'] = LanguageSplit(EMPTY, EMPTY, EMPTY)
+        channel_final['phoneNumbers'] = LanguageSplit.project(lambda language: phone_numbers)
+        channel_final['addresses'] = LanguageSplit.project(addresses)
+        channel_final['areas'] = LanguageSplit(EMPTY, EMPTY, EMPTY)
+        channel_final['channelUrls'] = LanguageSplit()
+        channel_final['organizations'] = LanguageSplit()
         if 'muutettu' in channel.keys() and channel.get('muutettu') is not None:
-            channel_final['lastUpdated'] = datetime.strptime(channel.get('muutettu'), "%Y-%m-%dT%H:%M.%S.%fZ")
+            channel_final['lastUpdated'] = parse_ytr_timestamp(channel.get('muutettu'))
         else:
             channel_final['lastUpdated'] = None
         return(channel_final)
     
+    def _resolve_municipality(self, municipality_id) -> tuple:
+        # YTR municipality id -> ( municipality code, PTV names by language ), no names if PTV does not know the code
+        municipality_code = self.municipality_map.get(municipality_id)
+        return(municipality_code, self.ptv_municipality_names.get(municipality_code, _NO_NAMES))
+
     def _parse_municipality_map(self, municipalities: list) -> dict:
         mun_map = {}
         for municipality in municipalities:
@@ -300,7 +429,7 @@ class YTRImporter():
         province_match = True
         municipality_match = True
         if len(service_areas) > 0:
-            municipality_codes = [mun.get('id') for mun in self.ptv_municipalities]
+            municipality_codes = self.ptv_municipality_codes
             province_codes = PROVINCE_CODES
             address_municipality_codes = [area.get('code') for area in service_areas if area.get('type') == 'Municipality']
             address_province_codes = [area.get('code') for area in service_areas if area.get('type') == 'Province' or area.get('type') == 'Region']
@@ -314,16 +443,29 @@ class YTRImporter():
             tg_OK = contains_suitable
         return(tg_OK and region_OK)
     
+    def _index_by_id(self, documents) -> dict:
+        # id -> document, first occurrence wins like the earlier list scans did
+        index = {}
+        for document in documents:
+            document_id = document.get('id')
+            if document_id not in index:
+                index[document_id] = document
+        return(index)
+
     def _filter_and_split_services(self, services: list, ptv_services) -> tuple:
 
-        ptv_ids = [ptv_service.get('id') for ptv_service in ptv_services]
+        # PTV services can be given either as a list or as the cached catalogue
+        if isinstance(ptv_services, CatalogueFile):
+            ptv_services_by_id = ptv_services
+        else:
+            ptv_services_by_id = self._index_by_id(ptv_services)
         ytr_originals = [service for service in services if service.get('ptvId') is None]
         ptv_fetched = [service for service in services if service.get('ptvId') is not None]
         ptv_services_filtered = []
         for service in ptv_fetched:
             ptv_id = service.get('ptvId')
-            if ptv_id in ptv_ids:
-                ptv_service = [ptv_ser for ptv_ser in ptv_services if ptv_id == ptv_ser.get('id')][0].copy()
+            if ptv_id in ptv_services_by_id:
+                ptv_service = ServiceRecord.from_document(ptv_services_by_id[ptv_id])
                 ptv_service['ptvId'] = ptv_service.get('id')
                 ptv_service['id'] = service.get('id')
                 ptv_service['organizations'] = service.get('organizations')
@@ -336,83 +478,251 @@ class YTRImporter():
         return ytr_originals, ptv_services_filtered
     
     
-    def _split_channels(self, channels: list, old_channels: list, ptv_channels) -> tuple:
+    def _split_channels(self, channels: list, old_channels, ptv_channels) -> tuple:
         
-        ptv_ids = [ptv_channel.get('id') for ptv_channel in ptv_channels]
-        matched_ptv_ids = [old_cha.get('ptvId') for old_cha in old_channels if old_cha.get('ptvId') is not None]
-        matched_ytr_ids = [old_cha.get('id') for old_cha in old_channels if old_cha.get('id') is not None]
+        ptv_channels_by_id = self._index_by_id(ptv_channels)
+        # Earlier channels can be given either as a list or as a ChannelRegistry
+        if isinstance(old_channels, ChannelRegistry):
+            old_registry = old_channels
+        else:
+            old_registry = ChannelRegistry(old_channels)
+        matched_ptv_ids = set()
+        matched_ytr_ids = set()
         new_channels = []
         known_channels = []
         for channel in channels:
             ytr_id = channel.get('id') 
             ptv_id = channel.get('ptvId')
-            if ptv_id in matched_ptv_ids or ytr_id in matched_ytr_ids:
+            if old_registry.has_ptv_id(ptv_id) or old_registry.has_ytr_id(ytr_id) or ptv_id in matched_ptv_ids or ytr_id in matched_ytr_ids:
                 # A channel that has been found earlier
                 known_channels.append(channel)
             else:
                 # A new channel
-                matched_ytr_ids.append(ytr_id)
-                if ptv_id in ptv_ids:
+                matched_ytr_ids.add(ytr_id)
+                if ptv_id in ptv_channels_by_id:
                     # PTV channel
-                    ptv_channel = [ptv_cha for ptv_cha in ptv_channels if ptv_cha.get('id') == ptv_id][0].copy()
+                    ptv_channel = ChannelRecord.from_document(ptv_channels_by_id[ptv_id])
                     ptv_channel['ptvId'] = ptv_channel.get('id')
                     ptv_channel['id'] = ytr_id
                     ptv_channel['organizationId'] = channel.get('organizationId')
                     new_channels.append(ptv_channel)
-                    matched_ptv_ids.append(ptv_id)
+                    matched_ptv_ids.add(ptv_id)
                 else:
                     # YTR original channel
                     new_channels.append(channel)
 
-        # Handle rest of thr PTV channels separately
-        nonmatched_ptv_ids = list(set(ptv_ids) - set(matched_ptv_ids))
-        nonmatched_ptv_channels = [[ptv_channel for ptv_channel in ptv_channels if ptv_channel.get('id') == nonmatched_ptv_id][0] for nonmatched_ptv_id in nonmatched_ptv_ids]
+        # Handle rest of the PTV channels separately, in the order they were given
+        known_ptv_ids = set(channel.get('ptvId') for channel in known_channels)
         nonmatched_ptv_channels_mod = []
-        for nonmatched_ptv_channel in nonmatched_ptv_channels:
-            nonmatched_ptv_channel_c = nonmatched_ptv_channel.copy()
+        for nonmatched_ptv_id, nonmatched_ptv_channel in ptv_channels_by_id.items():
+            if nonmatched_ptv_id in matched_ptv_ids or nonmatched_ptv_id in known_ptv_ids:
+                continue
+            nonmatched_ptv_channel_c = ChannelRecord.from_document(nonmatched_ptv_channel)
             nonmatched_ptv_channel_c['ptvId'] = nonmatched_ptv_channel_c.get('id')
             nonmatched_ptv_channel_c['organizationId'] = None
-            nonmatched_ptv_channels_mod.append(nonmatched_ptv_channel_c)
+            if old_registry.has_ptv_id(nonmatched_ptv_id):
+                # Found earlier, the service refers to it whichever service came first
+                known_channels.append(nonmatched_ptv_channel_c)
+            else:
+                nonmatched_ptv_channels_mod.append(nonmatched_ptv_channel_c)
         return new_channels, nonmatched_ptv_channels_mod, known_channels
     
+    def _chunks(self, items: list, size: int):
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+    def _batches(self, items, size: int):
+        # Like _chunks but for any iterable, holds only one batch at a time
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def _find_ptv(self, collection: str, query: dict, projection: dict):
+        # Reads a PTV collection, the documents also go to the snapshot of the run if one is recorded
+        documents = getattr(self.mongo_client.service_db, collection).find(query, projection, batch_size=PTV_CURSOR_BATCH_SIZE)
+        if self.snapshot is None:
+            return(documents)
+        return(self.snapshot.record_documents(collection, documents))
+
+    def _get_ptv_services(self, services: list) -> list:
+        # Only the PTV services the given YTR services refer to
+        ptv_ids = list(dict.fromkeys(service.get('ptvId') for service in services if service.get('ptvId') is not None))
+        ptv_services = []
+        for chunk in self._chunks(ptv_ids, PTV_QUERY_CHUNK_SIZE):
+            ptv_services.extend(self._find_ptv('services', {'id': {"$in": chunk}}, PTV_SERVICE_PROJECTION))
+        return(ptv_services)
+
+    def _prefetch_ptv_channels(self, services: list, channel_cache: ChannelCache) -> tuple:
+        if self._use_ptv_cache:
+            # The cached catalogue answers both lookups without queries
+            ptv_channels = self.ptv_cache.get('channels')
+            return ptv_channels.grouped_by('serviceIds'), ptv_channels
+        # Gather the PTV ids of the services and of the channels they refer to, in first-seen order
+        service_ptv_ids = {}
+        channel_ptv_ids = {}
+        for service in services:
+            service_ptv_id = service.get('ptvId')
+            if service_ptv_id is None:
+                continue
+            service_ptv_ids[service_ptv_id] = None
+            for channel in channel_cache.peek_channels(service.get('channelIds')):
+                channel_ptv_id = self._get_ptv_channel_id(channel)
+                if channel_ptv_id is not None:
+                    channel_ptv_ids[channel_ptv_id] = None
+
+        ptv_channels_by_service = {}
+        for chunk in self._chunks(list(service_ptv_ids), PTV_QUERY_CHUNK_SIZE):
+            chunk_ids = set(chunk)
+            for ptv_channel in self._find_ptv('channels', {'serviceIds': {"$in": chunk}}, PTV_CHANNEL_PROJECTION):
+                for ptv_service_id in chunk_ids.intersection(ptv_channel.get('serviceIds') or []):
+                    ptv_channels_by_service.setdefault(ptv_service_id, []).append(ptv_channel)
+        ptv_channels_by_id = {}
+        for chunk in self._chunks(list(channel_ptv_ids), PTV_QUERY_CHUNK_SIZE):
+            for ptv_channel in self._find_ptv('channels', {'id': {"$in": chunk}}, PTV_CHANNEL_PROJECTION):
+                ptv_channels_by_id.setdefault(ptv_channel.get('id'), ptv_channel)
+        return ptv_channels_by_service, ptv_channels_by_id
+
     def _get_ptv_service_id(self, service: dict) -> list:
         return(service.get('ptvId'))
     
     def _get_ptv_channel_id(self, channel: dict) -> list:
         return(channel.get('ptvId'))
     
+    def _api_get(self, endpoint: str, cached: bool = False, stream: bool = False):
+        url = API + endpoint
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            if cached and self.http_cache is not None:
+                response = self.http_cache.get(self.api_session, url, timeout=timeout)
+            elif stream:
+                response = self.api_session.get(url=url, stream=True, timeout=timeout)
+            else:
+                response = self.api_session.get(url=url, timeout=timeout)
+            try:
+                response.raise_for_status()
+            except Exception:
+                response.close()
+                raise
+        except Exception:
+            self.request_metrics.record_error(endpoint)
+            raise
+        # Time to the response headers including the retries, streamed bodies are read later
+        self.request_metrics.record(endpoint, time.perf_counter() - start, get_retry_count(response))
+        return(response)
+
+    def _decode(self, response, expected_type: Optional[type], endpoint: str):
+        # orjson when it is installed, the standard library otherwise
+        content = response.content
+        self.request_metrics.record_bytes(endpoint, len(content))
+        if self.snapshot is not None:
+            self.snapshot.record_response(endpoint, content)
+        return(decode_json(content, expected_type, endpoint))
+
     def get_service_types(self) -> list:
         endpoint = "/palvelutyyppi"
-        url = API + endpoint
-        response = self.api_session.get(url=url)
-        return(response.json())
+        response = self._api_get(endpoint, cached=True)
+        return(self._decode(response, list, endpoint))
         
     def get_services(self) -> list:
         endpoint = "/palvelu"
-        url = API + endpoint
-        response = self.api_session.get(url=url)
+        response = self._api_get(endpoint)
         
-        return(response.json())
+        return(self._decode(response, list, endpoint))
         
     def get_service_offers(self) -> list:
         
         try:
             endpoint = "/palvelutarjous"
-            url = API + endpoint
-            response = self.api_session.get(url=url)
-            return(response.json())
+            response = self._api_get(endpoint, cached=True)
+            return(self._decode(response, list, endpoint))
         except Exception as e:
             print("There was a problem fetching services from YTR.")
             raise Exception(e)
-        
+
+    def iter_service_offers(self):
+        # Yields the offers one at a time as the pages or the response stream arrive
+        try:
+            if self.page_size > 0:
+                service_offers = self._iter_offer_pages()
+            else:
+                service_offers = self._iter_offer_stream()
+            for service_offer in service_offers:
+                yield service_offer
+        except Exception as e:
+            print("There was a problem fetching services from YTR.")
+            raise Exception(e)
+
+    def _iter_offer_stream(self):
+        # Streams the offers from one GET instead of decoding the whole response at once
+        endpoint = "/palvelutarjous"
+        response = self._api_get(endpoint, cached=True, stream=True)
+        # The body goes to the snapshot once the whole array is read
+        chunks = [] if self.snapshot is not None else None
+        try:
+            for service_offer in iter_json_array(self._counted_chunks(response, endpoint, chunks)):
+                yield service_offer
+            if chunks is not None:
+                self.snapshot.record_response(endpoint, b''.join(chunks))
+        finally:
+            response.close()
+
+    def _iter_offer_pages(self):
+        pages = iter_pages(self._get_offer_page, self.page_size, OFFER_PAGE_WINDOW)
+        try:
+            first_page = next(pages)
+        except requests.HTTPError as error:
+            if error.response is None or error.response.status_code not in PAGING_REJECTED_STATUSES:
+                raise
+            print("Kompassi-YTR does not page /palvelutarjous, fetching it with one GET.")
+            yield from self._iter_offer_stream()
+            return
+        try:
+            for page in itertools.chain([first_page], pages):
+                self.metrics.count('offer_pages')
+                for service_offer in page:
+                    yield service_offer
+        finally:
+            pages.close()
+
+    def _get_offer_page(self, offset: int, limit: int) -> list:
+        # A page that breaks off is fetched again, the pages before it are not
+        endpoint = "/palvelutarjous?offset={}&limit={}".format(offset, limit)
+        for attempt in range(OFFER_PAGE_RETRIES + 1):
+            try:
+                response = self._api_get(endpoint)
+                return(self._decode(response, list, endpoint))
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, ValueError):
+                if attempt >= OFFER_PAGE_RETRIES:
+                    raise
+                self.metrics.count('offer_page_retries')
+                time.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
+
+    def _counted_chunks(self, response, endpoint: str, chunks: Optional[list] = None):
+        for chunk in response.iter_content(chunk_size=65536):
+            self.request_metrics.record_bytes(endpoint, len(chunk))
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+
+    def _get_service_channel(self, channel_id) -> dict:
+        endpoint = "/palvelukanava/{}".format(channel_id)
+        response = self._api_get(endpoint)
+        return(self._decode(response, dict, endpoint))
+
     def get_service_channels(self, channel_ids: list) -> list:
         try:
-            channels = []
-            for channel_id in channel_ids:
-                endpoint = "/palvelukanava/{}".format(channel_id)
-                url = API + endpoint
-                response = self.api_session.get(url=url)
-                channels.append(response.json())
+            if self.fetch_concurrency > 1 and len(channel_ids) > 1:
+                # Executor.map keeps the results in the order of channel_ids
+                with ThreadPoolExecutor(max_workers=min(self.fetch_concurrency, len(channel_ids))) as executor:
+                    channels = list(executor.map(self._get_service_channel, channel_ids))
+            else:
+                channels = [self._get_service_channel(channel_id) for channel_id in channel_ids]
             return(channels)
         except Exception as e:
             print("There was a problem fetching service channels from YTR.")
@@ -420,17 +730,15 @@ class YTRImporter():
         
     def get_organization(self) -> dict:
         endpoint = "/toimija"
-        url = API + endpoint
-        response = self.api_session.get(url=url)
+        response = self._api_get(endpoint, cached=True)
         
-        return(response.json())
+        return(self._decode(response, None, endpoint))
         
     def get_municipalities(self) -> list:
         try:
             endpoint = "/kunta"
-            url = API + endpoint
-            response = self.api_session.get(url=url)
-            return(response.json())
+            response = self._api_get(endpoint, cached=True)
+            return(self._decode(response, list, endpoint))
         except Exception as e:
             print("There was a problem fetching municipalities from YTR.")
             raise Exception(e)
@@ -454,22 +762,47 @@ class YTRImporter():
             
     def get_latest_update_time_from_mongo(self, collection: str) -> Optional[datetime]:
         
-        if collection == "ytr_services":
-            last_result = self.mongo_client.service_db.ytr_services.aggregate([{"$group" : {"_id" : None, "max" : {"$max" : "$lastUpdated"}}}])
-            last_result = list(last_result)
-            time = None
-            if len(last_result) > 0 and last_result[0].get('max') is not None:
-                time = datetime.fromtimestamp(last_result[0]['max']/1000)
-        elif collection == "ytr_channels":
-            last_result = self.mongo_client.service_db.ytr_channels.aggregate([{"$group" : {"_id" : None, "max" : {"$max" : "$lastUpdated"}}}])
-            last_result = list(last_result)
-            time = None
-            if len(last_result) > 0 and last_result[0].get('max') is not None:
-                time = datetime.fromtimestamp(last_result[0]['max']/1000)
-        else:
+        if collection not in ("ytr_services", "ytr_channels"):
             raise Exception("Collection not recognized")
+        # A sort on lastUpdated walks its index backwards and stops at the first document
+        last_result = getattr(self.mongo_client.service_db, collection).find(
+            {}, {'_id': False, 'lastUpdated': True}).sort('lastUpdated', DESCENDING).limit(1)
+        last_result = list(last_result)
+        time = None
+        if len(last_result) > 0 and last_result[0].get('lastUpdated') is not None:
+            if isinstance(last_result[0]['lastUpdated'], datetime):
+                # Dates stored by this importer come back as datetimes
+                time = last_result[0]['lastUpdated']
+            else:
+                time = datetime.fromtimestamp(last_result[0]['lastUpdated']/1000)
         return(time)
     
+    def get_high_water_mark(self) -> Optional[datetime]:
+        # None if no import has stored one yet
+        state = getattr(self.mongo_client.service_db, IMPORT_STATE_COLLECTION).find_one({'_id': IMPORT_STATE_ID})
+        if state is None:
+            return(None)
+        return(state.get('highWaterMark'))
+
+    def _store_high_water_mark(self, replace: bool) -> None:
+        # A full import sets the mark, an incremental one only moves it forward
+        if self._offers_high_water_mark is None:
+            return
+        operator = '$set' if replace else '$max'
+        getattr(self.mongo_client.service_db, IMPORT_STATE_COLLECTION).update_one(
+            {'_id': IMPORT_STATE_ID}, {operator: {'highWaterMark': self._offers_high_water_mark}}, upsert=True)
+
+    def _track_high_water_mark(self, service_offers):
+        # The newest 'muutettu' of the offers read in this run
+        self._offers_high_water_mark = None
+        for service_offer in service_offers:
+            modified = service_offer.get('muutettu')
+            if modified is not None:
+                modified = parse_ytr_timestamp(modified)
+                if self._offers_high_water_mark is None or modified > self._offers_high_water_mark:
+                    self._offers_high_water_mark = modified
+            yield service_offer
+
     def store_to_mongo(self, collection: str, to_store: list) -> None:
         if collection == "ytr_services":
             if len(to_store) > 0:
@@ -492,74 +825,449 @@ class YTRImporter():
         del_count = delete_result.deleted_count
         print(del_count, "old channels deleted.")
     
-    def _get_new_services_and_channels(self) -> tuple:
-        
+    def _prepare_import(self) -> None:
         # Get id -> code mapping for YTR municipalities
-        municipalities = self.get_municipalities()
+        with self.metrics.stage('fetch_municipalities'):
+            municipalities = self.get_municipalities()
         self.municipality_map = self._parse_municipality_map(municipalities)
+        with self.metrics.stage('ptv_municipalities'):
+            self._get_municipality_index()
+        self._refresh_ptv_cache()
+        # Channels are fetched at most once per import
+        self.channel_cache = ChannelCache(self.get_service_channels, self._parse_fetched_channels)
+        # The workers get the municipality map of this import
+        self._close_parser()
+        self.parser = ParallelParser(self, self.parse_workers, PARSE_CHUNK_SIZE, PARSE_PARALLEL_MIN_ITEMS)
+        self.parser.start()
+
+    def _refresh_ptv_cache(self) -> None:
+        # A recorded snapshot needs the PTV documents read from Mongo, and a cache that cannot
+        # be refreshed does not stop the import
+        self._use_ptv_cache = False
+        if self.ptv_cache is None or self.snapshot is not None:
+            return
+        with self.metrics.stage('ptv_cache_refresh'):
+            try:
+                rebuilt = self.ptv_cache.refresh(self.mongo_client.service_db, PTV_CURSOR_BATCH_SIZE)
+            except (PyMongoError, OSError) as error:
+                print("Could not refresh the PTV catalogue cache, reading PTV from Mongo:", error)
+                self.metrics.count('ptv_cache_failures')
+                return
+        if len(rebuilt) > 0:
+            print("PTV catalogue cache refreshed:", ", ".join(rebuilt))
+            self.metrics.count('ptv_cache_rebuilds', len(rebuilt))
+        self._use_ptv_cache = True
+
+    def _ensure_indexes(self) -> None:
+        # Once per importer, a collection that cannot be indexed ( e.g. no rights ) does not stop the import
+        if self._indexes_checked or not self.ensure_indexes:
+            return
+        with self.metrics.stage('ensure_indexes'):
+            for collection, fields in INDEX_SPEC.items():
+                try:
+                    created = ensure_indexes(getattr(self.mongo_client.service_db, collection), fields)
+                except PyMongoError as error:
+                    print("Could not check the indexes of", collection + ":", error)
+                    continue
+                if len(created) > 0:
+                    print("Created indexes on", collection + ":", ", ".join(created))
+                    self.metrics.count('indexes_created', len(created))
+        self._indexes_checked = True
+
+    def _close_parser(self) -> None:
+        if self.parser is not None:
+            self.parser.close()
+            self.parser = None
+
+    def _add_service_channels(self, services: list, channel_registry: ChannelRegistry) -> list:
+        # Fetch all the channels related to the services, each distinct channel only once
+        with self.metrics.stage('fetch_channels'):
+            self.channel_cache.prefetch([channel_id for new_service in services for channel_id in new_service.get('channelIds')])
+        # Current PTV channels of the PTV recognized services with a few chunked queries
+        with self.metrics.stage('ptv_channel_lookup'):
+            ptv_channels_by_service, ptv_channels_by_id = self._prefetch_ptv_channels(services, self.channel_cache)
+
+        with self.metrics.stage('join_channels'):
+            self._join_service_channels(services, channel_registry, ptv_channels_by_service, ptv_channels_by_id)
+        return(services)
 
-        # Update service data
-        service_offers = self.get_service_offers()
-        current_ptv_services = list(self.mongo_client.service_db.services.find({}))
-        for current_ptv_service in current_ptv_services:
-            if '_id' in current_ptv_service:
-                del current_ptv_service['_id']
-        service_offers_parsed = [self._parse_service_info(ser) for ser in service_offers]
-        ytr_original, ptv_recognized_services = self._filter_and_split_services(service_offers_parsed, current_ptv_services)
-        all_services = ptv_recognized_services + ytr_original
-        all_services = [ser for ser in all_services if self._is_suitable_service(ser)]
- 
-        all_channels = []
-        all_channel_ids = []
-        # Fetch all the channels related to the new and updated services
-        for new_service in all_services:
-            channels = self.get_service_channels(new_service.get('channelIds'))
+    def _parse_fetched_channels(self, channels: list) -> list:
+        # Parses the channels the cache fetched, so that the raw channels are not kept for the whole import
+        with self.metrics.stage('parse_channels'):
+            channels_parsed = self.parser.parse_channels(channels)
+        self.metrics.count('channels_parsed', len(channels_parsed))
+        return(channels_parsed)
+
+    def _join_service_channels(self, services: list, channel_registry: ChannelRegistry, ptv_channels_by_service: dict, ptv_channels_by_id: dict) -> None:
+        for new_service in services:
+            # Every service gets its own copies of its channels, the cache parsed each of them once
+            channels_parsed = [channel.copy() for channel in self.channel_cache.get_channels(new_service.get('channelIds'))]
             new_service['channelIds'] = [] # Cannot refer to every channel with ID
-            channels_parsed = [self._parse_channel_info(cha) for cha in channels]
             channels_parsed_ptv_ids = [cha.get('ptvId') for cha in channels_parsed if cha.get('ptvId') is not None]
 
             new_service_ptv_id = new_service.get('ptvId')
             if new_service_ptv_id is not None:
-                current_ptv_channels_by_service = list(self.mongo_client.service_db.channels.find({'serviceIds': {"$in": [new_service_ptv_id]}}))
-                if len(channels_parsed_ptv_ids) > 0:
-                    channel_referred_ptv_channels = list(self.mongo_client.service_db.channels.find({'id': {"$in": channels_parsed_ptv_ids}}))
-                else:
-                    channel_referred_ptv_channels = []
-                current_ptv_channels = current_ptv_channels_by_service + channel_referred_ptv_channels
+                current_ptv_channels = list(ptv_channels_by_service.get(new_service_ptv_id, []))
+                for channel_ptv_id in dict.fromkeys(channels_parsed_ptv_ids):
+                    if channel_ptv_id in ptv_channels_by_id:
+                        current_ptv_channels.append(ptv_channels_by_id[channel_ptv_id])
             else:
                 current_ptv_channels = []
-            for current_ptv_channel in current_ptv_channels:
-                current_ptv_channel['serviceIds'] = []
-                if '_id' in current_ptv_channel:
-                    del current_ptv_channel['_id']
+            # Prefetched documents are shared between services, use shallow copies with empty references
+            current_ptv_channels = [dict(current_ptv_channel, serviceIds=[]) for current_ptv_channel in current_ptv_channels]
 
-            new_channels, ptv_unrecognized_channels, known_channels = self._split_channels(channels_parsed, all_channels, current_ptv_channels)
-            all_new_service_channels = new_channels + ptv_unrecognized_channels
+            new_channels, ptv_unrecognized_channels, known_channels = self._split_channels(channels_parsed, channel_registry, current_ptv_channels)
+            new_service_id = new_service.get('id')
             # Add reference to the services that have been found earlier
             for known_channel in known_channels:
-                known_channels_handle = [cha for cha in all_channels if cha.get('ptvId') == known_channel.get('ptvId') or cha.get('id') == known_channel.get('id')][0]
-                known_channels_handle['serviceIds'] = known_channels_handle['serviceIds'] + [new_service.get('id')]
+                channel_registry.link(known_channel, new_service_id)
             # Add same reference to the new ones
-            for channel in all_new_service_channels:
-                channel['serviceIds'] = channel['serviceIds'] + [new_service.get('id')]
-            all_channels = all_channels + all_new_service_channels
-            all_channel_ids = all_channel_ids + [cha.get('id') for cha in all_new_service_channels if cha.get('id') is not None]
-        
-        return(all_services, all_channels)
+            for channel in new_channels + ptv_unrecognized_channels:
+                channel_registry.add(channel, new_service_id)
+
+    def _iter_new_services(self, service_offers, channel_registry: ChannelRegistry):
+        # fetch -> parse -> split -> filter -> channel enrich, SERVICE_BATCH_SIZE offers at a time.
+        # The stages run in their own threads so that e.g. the channels of one batch are fetched while the
+        # next batch is parsed and the previous one is written by the caller.
+        # The channels end up in channel_registry since they collect references from all the services.
+        # Waiting for the offers is the download and decoding of /palvelutarjous
+        service_offer_batches = self.metrics.timed_iter('read_offers', self._batches(service_offers, SERVICE_BATCH_SIZE))
+        pipeline = StagedPipeline([('parse', self._parse_service_batch),
+                                   ('channels', lambda services: self._add_service_channels(services, channel_registry))],
+                                  PIPELINE_QUEUE_SIZE)
+        try:
+            for services in pipeline.run(service_offer_batches):
+                for service in services:
+                    yield service
+        finally:
+            self.metrics.add_pipeline(pipeline.utilisation())
+
+    def _parse_service_batch(self, service_offer_batch: list) -> list:
+        # The suitable services of a batch of offers, PTV recognized ones replaced by their PTV documents
+        self.metrics.count('offers_read', len(service_offer_batch))
+        with self.metrics.stage('parse_services'):
+            service_offers_parsed = self.parser.parse_services(service_offer_batch)
+        with self.metrics.stage('ptv_service_lookup'):
+            if self._use_ptv_cache:
+                current_ptv_services = self.ptv_cache.get('services')
+            else:
+                current_ptv_services = self._get_ptv_services(service_offers_parsed)
+        with self.metrics.stage('split_services'):
+            ytr_original, ptv_recognized_services = self._filter_and_split_services(service_offers_parsed, current_ptv_services)
+            services = ptv_recognized_services + ytr_original
+            services = [ser for ser in services if self._is_suitable_service(ser)]
+        self.metrics.count('services_ptv_recognized', len(ptv_recognized_services))
+        self.metrics.count('services_suitable', len(services))
+        return(services)
+
+    def _save_snapshot(self, mode: str, status: str) -> None:
+        # Also a failed run is kept, it is the one worth replaying
+        if self.snapshot is None:
+            return
+        try:
+            self.snapshot.save(self.snapshot_file, mode=mode, status=status, pageSize=self.page_size)
+            print("Snapshot of", len(self.snapshot.responses), "responses written to", self.snapshot_file + ".")
+        except OSError as error:
+            print("Could not write the snapshot to", self.snapshot_file + ":", error)
+        self.snapshot = None
+
+    def _print_channel_cache_stats(self) -> None:
+        print(len(self.channel_cache), "channels fetched,", self.channel_cache.hits, "channel cache hits,", self.channel_cache.misses, "misses.")
+
+    def _emit_metrics(self, mode: str, status: str) -> dict:
+        # One line of JSON at the end of the run, and the metrics file for the scheduler
+        channel_cache = getattr(self, 'channel_cache', None)
+        if channel_cache is not None:
+            self.metrics.count('channel_cache_hits', channel_cache.hits)
+            self.metrics.count('channel_cache_misses', channel_cache.misses)
+        if self.http_cache is not None:
+            self.metrics.count('http_cache_hits', self.http_cache.hits - self._http_cache_counts[0])
+            self.metrics.count('http_cache_misses', self.http_cache.misses - self._http_cache_counts[1])
+        summary = self.metrics.summary(mode=mode, status=status)
+        if 'pipeline' in summary:
+            print("Pipeline utilisation:", ", ".join("{} {:.0%}".format(name, entry['utilisation'])
+                                                      for name, entry in summary['pipeline'].items()))
+        print(json.dumps(summary, sort_keys=True))
+        if METRICS_FILE:
+            self.metrics.write(METRICS_FILE, summary)
+        return(summary)
+
+    def _get_new_services_and_channels(self) -> tuple:
+        self._prepare_import()
+        channel_registry = ChannelRegistry()
+        try:
+            all_services = list(self._iter_new_services(self.iter_service_offers(), channel_registry))
+        finally:
+            self._close_parser()
+        self._print_channel_cache_stats()
         
-    def import_ytr_data(self) -> dict:
-        all_services, all_channels = self._get_new_services_and_channels()
+        return(all_services, channel_registry.channels())
+
+    def _insert_in_batches(self, collection, documents) -> int:
+        count = 0
+        for batch in self._batches(documents, STORE_BATCH_SIZE):
+            with self.metrics.stage('mongo_insert'):
+                collection.insert_many(batch, ordered=False)
+            count = count + len(batch)
+        return(count)
+
+    def _content_hash(self, document: dict) -> str:
+        content = {key: value for key, value in to_document(document).items() if key not in ('_id', 'contentHash')}
+        # Canonical JSON, datetimes and other non-JSON values by their string form
+        canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+        return(hashlib.sha1(canonical.encode('utf-8')).hexdigest())
+
+    def _with_content_hash(self, documents):
+        # Records become BSON ready dicts here, right before they are written
+        for document in documents:
+            with self.metrics.stage('content_hash'):
+                document = to_document(document)
+                document['contentHash'] = self._content_hash(document)
+            yield document
+
+    def _sync_collection(self, collection, documents) -> tuple:
+        # Compares the documents with the stored ones by content hash and returns the needed write operations
+        stored_hashes = {}
+        with self.metrics.stage('mongo_read_hashes'):
+            for stored in collection.find({}, {'_id': False, 'id': True, 'contentHash': True}):
+                stored_hashes[stored.get('id')] = stored.get('contentHash')
+        operations = []
+        counts = {'unchanged': 0, 'updated': 0, 'inserted': 0, 'deleted': 0}
+        seen_ids = set()
+        for document in self._with_content_hash(documents):
+            document_id = document.get('id')
+            seen_ids.add(document_id)
+            if document_id not in stored_hashes:
+                operations.append(InsertOne(document))
+                counts['inserted'] = counts['inserted'] + 1
+            elif stored_hashes[document_id] == document['contentHash']:
+                counts['unchanged'] = counts['unchanged'] + 1
+            else:
+                operations.append(ReplaceOne({'id': document_id}, document))
+                counts['updated'] = counts['updated'] + 1
+        for document_id in stored_hashes:
+            if document_id not in seen_ids:
+                operations.append(DeleteOne({'id': document_id}))
+                counts['deleted'] = counts['deleted'] + 1
+        return operations, counts, len(seen_ids)
+
+    def _get_staging_collection(self, collection: str):
+        # An empty staging collection next to the live one
+        staging = getattr(self.mongo_client.service_db, collection + STAGING_SUFFIX)
+        staging.drop()
+        return(staging)
+
+    def _swap_in_staging_collection(self, staging, collection: str) -> None:
+        with self.metrics.stage('swap_collections'):
+            ensure_indexes(staging, INDEX_SPEC[collection])
+            if self._rename_supported:
+                try:
+                    # renameCollection with dropTarget replaces the live collection in one step
+                    staging.rename(collection, dropTarget=True)
+                    return
+                except PyMongoError as error:
+                    # e.g. the Cosmos DB API for MongoDB has no renameCollection
+                    print("Could not rename the staging collection over", collection + ", replacing its documents instead:", error)
+                    self._rename_supported = False
+            self.metrics.count('swap_fallbacks')
+            self._replace_from_staging(staging, collection)
+
+    def _replace_from_staging(self, staging, collection: str) -> None:
+        # Refills the live collection in place, so readers always find every document in its old or new version.
+        # Documents whose content hash did not change are not written again.
+        live = getattr(self.mongo_client.service_db, collection)
+        with self.metrics.stage('mongo_read_ids'):
+            stored_hashes = dict((document.get('id'), document.get('contentHash'))
+                                 for document in live.find({}, {'_id': False, 'id': True, 'contentHash': True}, batch_size=STORE_BATCH_SIZE))
+        staged_ids = set()
+        replaced = 0
+        for batch in self._batches(staging.find({}, {'_id': False}, batch_size=STORE_BATCH_SIZE), STORE_BATCH_SIZE):
+            staged_ids.update(document.get('id') for document in batch)
+            changed = [document for document in batch
+                       if document.get('contentHash') is None or stored_hashes.get(document.get('id')) != document.get('contentHash')]
+            if len(changed) > 0:
+                with self.metrics.stage('mongo_write'):
+                    live.bulk_write([ReplaceOne({'id': document.get('id')}, document, upsert=True) for document in changed], ordered=False)
+                replaced = replaced + len(changed)
+        # Only when every staged document is in place, the ones that are gone are removed
+        removed = [document_id for document_id in stored_hashes if document_id not in staged_ids]
+        with self.metrics.stage('mongo_write'):
+            for chunk in self._chunks(removed, PTV_QUERY_CHUNK_SIZE):
+                live.delete_many({'id': {"$in": chunk}})
+        staging.drop()
+        self.metrics.count('swap_fallback_writes', replaced + len(removed))
+        print(collection, "refilled in place:", replaced, "documents replaced,", len(removed), "deleted.")
         
+    def _import_full(self) -> None:
+        self._prepare_import()
+        channel_registry = ChannelRegistry()
+        services = self._iter_new_services(self._track_high_water_mark(self.iter_service_offers()), channel_registry)
+
+        # Everything goes to staging collections first, readers keep seeing the previous import
+        services_staging = self._get_staging_collection('ytr_services')
+        channels_staging = self._get_staging_collection('ytr_channels')
+        # Store original ytr services and matched PTV services as they come out of the pipeline
+        service_count = self._insert_in_batches(services_staging, self._with_content_hash(services))
+        self._print_channel_cache_stats()
+        # Store original ytr service channels and those that correspond PTV recognized ones
+        channel_count = self._insert_in_batches(channels_staging, self._with_content_hash(channel_registry))
+
         # If empty response don't update because it's probably some error
-        if len(all_services) > 0 and len(all_channels) > 0:
-            # Delete all services and channels
-            self.remove_old_from_mongo()
-            
-            # Store original ytr services and matched PTV services to database
-            self.store_to_mongo('ytr_services', all_services)
-            
-            # Store original ytr service channels and those that correspond PTV recognized ones to database
-            self.store_to_mongo('ytr_channels', all_channels)
+        self.metrics.count('services_stored', service_count)
+        self.metrics.count('channels_stored', channel_count)
+        if service_count > 0 and channel_count > 0:
+            self._swap_in_staging_collection(services_staging, 'ytr_services')
+            self._swap_in_staging_collection(channels_staging, 'ytr_channels')
+            self._store_high_water_mark(replace=True)
+            print(service_count, "new services stored.")
+            print(channel_count, "new channels stored.")
         else:
+            services_staging.drop()
+            channels_staging.drop()
             print("There was some problem with fetching data from YTR")
-        
\ No newline at end of file
+            self.metrics.count('empty_responses')
+
+    def _is_changed_offer(self, service_offer: dict, high_water_mark: datetime) -> bool:
+        # Offers without a modification time are always processed
+        if service_offer.get('muutettu') is None:
+            return(True)
+        return(parse_ytr_timestamp(service_offer.get('muutettu')) > high_water_mark)
+
+    def _import_incremental(self, high_water_mark: datetime) -> None:
+        ytr_services = self.mongo_client.service_db.ytr_services
+        ytr_channels = self.mongo_client.service_db.ytr_channels
+        with self.metrics.stage('mongo_read_ids'):
+            stored_ids = set(service.get('id') for service in ytr_services.find({}, {'_id': False, 'id': True}))
+
+        self._prepare_import()
+        seen_ids = set()
+        changed_ids = set()
+        def changed_offers():
+            for service_offer in self._track_high_water_mark(self.iter_service_offers()):
+                # Same id conversion as in _parse_service_info
+                offer_id = str(service_offer.get('id'))
+                seen_ids.add(offer_id)
+                if self._is_changed_offer(service_offer, high_water_mark):
+                    changed_ids.add(offer_id)
+                    yield service_offer
+
+        channel_registry = ChannelRegistry()
+        upserted_ids = set()
+        changed_services = self._with_content_hash(self._iter_new_services(changed_offers(), channel_registry))
+        for service_batch in self._batches(changed_services, STORE_BATCH_SIZE):
+            with self.metrics.stage('mongo_write'):
+                ytr_services.bulk_write([ReplaceOne({'id': service.get('id')}, service, upsert=True) for service in service_batch], ordered=False)
+            upserted_ids.update(service.get('id') for service in service_batch)
+        self._print_channel_cache_stats()
+
+        if len(seen_ids) == 0:
+            # If empty response don't update because it's probably some error
+            print("There was some problem with fetching data from YTR")
+            self.metrics.count('empty_responses')
+            return
+
+        # Offers that are gone from YTR or are not suitable anymore
+        deleted_ids = (stored_ids - seen_ids) | (changed_ids - upserted_ids)
+        with self.metrics.stage('mongo_write'):
+            for chunk in self._chunks(list(deleted_ids), PTV_QUERY_CHUNK_SIZE):
+                ytr_services.delete_many({'id': {"$in": chunk}})
+
+            # Re-point the channel references of the changed and deleted services
+            touched_ids = list(changed_ids | deleted_ids)
+            for chunk in self._chunks(touched_ids, PTV_QUERY_CHUNK_SIZE):
+                ytr_channels.update_many({'serviceIds': {"$in": chunk}}, {'$pull': {'serviceIds': {"$in": chunk}}})
+        stored_channel_ids = self._get_stored_channel_ids(channel_registry)
+        channel_operations = []
+        for channel in channel_registry:
+            channel_fields = {key: value for key, value in to_document(channel).items() if key != 'serviceIds'}
+            # A PTV channel that is stored already keeps its id like in a full import, where it is only stored once
+            channel_id = stored_channel_ids.get(channel.get('ptvId'), channel.get('id'))
+            channel_fields['id'] = channel_id
+            # The merged references are not known here, so the content hash is dropped
+            channel_operations.append(UpdateOne({'id': channel_id},
+                                                {'$set': channel_fields, '$addToSet': {'serviceIds': {'$each': channel.get('serviceIds')}},
+                                                 '$unset': {'contentHash': ''}},
+                                                upsert=True))
+        with self.metrics.stage('mongo_write'):
+            for operation_batch in self._batches(channel_operations, STORE_BATCH_SIZE):
+                ytr_channels.bulk_write(operation_batch, ordered=False)
+            orphan_result = ytr_channels.delete_many({'serviceIds': {'$size': 0}})
+        self.metrics.count('services_stored', len(upserted_ids))
+        self.metrics.count('services_deleted', len(deleted_ids))
+        self.metrics.count('channels_stored', len(channel_operations))
+        self.metrics.count('channels_deleted', orphan_result.deleted_count)
+        self._store_high_water_mark(replace=False)
+
+        print(len(seen_ids), "services in YTR,", len(changed_ids), "changed since", high_water_mark)
+        print(len(upserted_ids), "services upserted,", len(deleted_ids), "services deleted.")
+        print(len(channel_operations), "channels upserted,", orphan_result.deleted_count, "orphan channels deleted.")
+
+    def _get_stored_channel_ids(self, channel_registry: ChannelRegistry) -> dict:
+        # PTV id -> id of the stored channel with it, for the PTV ids of the registered channels
+        ptv_ids = list(dict.fromkeys(channel.get('ptvId') for channel in channel_registry if channel.get('ptvId') is not None))
+        stored_channel_ids = {}
+        with self.metrics.stage('mongo_read_ids'):
+            for chunk in self._chunks(ptv_ids, PTV_QUERY_CHUNK_SIZE):
+                for stored in self.mongo_client.service_db.ytr_channels.find({'ptvId': {"$in": chunk}}, {'_id': False, 'id': True, 'ptvId': True}):
+                    stored_channel_ids.setdefault(stored.get('ptvId'), stored.get('id'))
+        return(stored_channel_ids)
+
+    def _import_sync(self) -> None:
+        self._prepare_import()
+        channel_registry = ChannelRegistry()
+        services = self._iter_new_services(self._track_high_water_mark(self.iter_service_offers()), channel_registry)
+        service_operations, service_counts, service_count = self._sync_collection(self.mongo_client.service_db.ytr_services, services)
+        self._print_channel_cache_stats()
+        channel_operations, channel_counts, channel_count = self._sync_collection(self.mongo_client.service_db.ytr_channels, channel_registry)
+
+        # If empty response don't update because it's probably some error
+        if service_count == 0 or channel_count == 0:
+            print("There was some problem with fetching data from YTR")
+            self.metrics.count('empty_responses')
+            return
+        with self.metrics.stage('mongo_write'):
+            if len(service_operations) > 0:
+                self.mongo_client.service_db.ytr_services.bulk_write(service_operations, ordered=False)
+            if len(channel_operations) > 0:
+                self.mongo_client.service_db.ytr_channels.bulk_write(channel_operations, ordered=False)
+        self._store_high_water_mark(replace=True)
+        for collection, counts in (('services', service_counts), ('channels', channel_counts)):
+            for change in ('inserted', 'updated', 'deleted', 'unchanged'):
+                self.metrics.count('{}_{}'.format(collection, change), counts[change])
+        for collection, counts in (('services', service_counts), ('channels', channel_counts)):
+            print("{}: {} unchanged, {} updated, {} inserted, {} deleted.".format(
+                collection, counts['unchanged'], counts['updated'], counts['inserted'], counts['deleted']))
+        self.sync_counts = {'ytr_services': service_counts, 'ytr_channels': channel_counts}
+
+    def import_ytr_data(self, mode: Optional[str] = None) -> None:
+        if mode is None:
+            mode = IMPORT_MODE
+        self.metrics.reset()
+        self.channel_cache = None
+        if self.http_cache is not None:
+            self._http_cache_counts = (self.http_cache.hits, self.http_cache.misses)
+        self.snapshot = SnapshotRecorder() if self.snapshot_file else None
+        self._offers_high_water_mark = None
+        status = "failed"
+        try:
+            self._ensure_indexes()
+            if mode == "incremental":
+                high_water_mark = self.get_high_water_mark()
+                if high_water_mark is not None:
+                    self._import_incremental(high_water_mark)
+                    status = "ok"
+                    return
+                print("No high-water mark of an earlier import found, doing a full import.")
+                mode = "full"
+            elif mode == "sync":
+                self._import_sync()
+                status = "ok"
+                return
+            elif mode != "full":
+                raise Exception("Import mode {} not recognized".format(mode))
+            self._import_full()
+            status = "ok"
+        finally:
+            self._close_parser()
+            self._save_snapshot(mode, status)
+            self._emit_metrics(mode, status)